@@ -0,0 +1,223 @@
+"""
+Batched offline inference of a trained model over the non-redundant
+(raw) database.
+
+Feature rows are streamed from the database in large contiguous chunks.
+As one feature row is shared by all subjects, each row is predicted
+only once and the prediction is fanned out to the subjects' global IDs
+(ID = feature row * n_subjects + subject index) when writing results.
+
+Usage (from this directory):
+    python predict_raw.py MODEL DATABASE OUTPUT [--chunksize N] ...
+
+DATABASE is either a raw HDF5 file or a directory containing the .npy
+database written by utils.file_conversion.raw2npy (trailing slash).
+OUTPUT is either a '.npy' file holding one float32 prediction per
+global ID (the array index is the global ID, IDs before --start are
+NaN) or a '.h5' file holding a table with columns global_id and
+prediction. Models trained on scaled features are applied to the
+unscaled database with --scaler, the json sidecar written by
+utils.scaler.fit_scaler. Models trained on a subset of the feature
+columns are applied with --columns, selecting columns by label, index
+or feature group as in utils.load_data_raw.get_column_idx, e.g.
+--columns ILD ITD. The scaler is then reduced to the selected columns.
+"""
+
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from os.path import isdir
+from keras.models import load_model
+
+from utils.custom_loss import CUSTOM_OBJECTS
+from utils.load_data_raw import get_column_idx, load_raw_npy
+from utils.scaler import StreamingScaler
+
+
+def open_features(database, key_f='feature_data', key_t='target_data'):
+    """
+    Open the feature data of a raw database for chunked reading.
+    Returns a function reading rows start:stop as array, the number of
+    feature rows, the number of subjects and the feature column labels.
+    """
+    if isdir(database):
+        feature_data, target_data, column_labels = load_raw_npy(database)
+        return (lambda start, stop: feature_data[start:stop],
+                feature_data.shape[0], target_data.shape[1], column_labels)
+    with pd.HDFStore(database, mode='r') as store:
+        n_rows = store.get_storer(key_f).nrows
+        n_subjects = store.select(key_t, start=0, stop=1).shape[1]
+        column_labels = store.select(key_f, start=0,
+                                     stop=1).columns.tolist()
+    def read(start, stop):
+        return pd.read_hdf(database, key=key_f, start=start,
+                           stop=stop).values
+    return read, n_rows, n_subjects, column_labels
+
+
+def select_scaler(scaler, column_labels, idx=None):
+    """
+    Reduce scaler to the feature columns idx, by label if the scaler
+    knows its column labels and by index otherwise, as DataGenerator_raw
+    does for its batches.
+    """
+    labels = list(column_labels)
+    if idx is not None:
+        labels = [labels[i] for i in idx]
+    if scaler.columns is not None:
+        if scaler.columns == labels:
+            return scaler
+        return scaler.subset(get_column_idx(scaler.columns, labels))
+    n_scaler = len(scaler.scale)
+    if idx is not None and n_scaler == len(column_labels):
+        return scaler.subset(idx)
+    if n_scaler == len(labels):
+        return scaler
+    raise ValueError('Scaler of {} features does not match {} feature '
+                     'columns.'.format(n_scaler, len(labels)))
+
+
+def parse_columns(columns):
+    """Convert command line column selection, indices given as digits."""
+    if columns is None:
+        return None
+    return [int(c) if c.isdigit() else c for c in columns]
+
+
+def predict_raw(model, database, output, chunksize=100000, batch_size=8192,
+                start=0, stop=None, verbose=True, scaler=None, columns=None):
+    """
+    Predict on model for all feature rows start:stop of the raw database
+    and write the predictions per global ID to output.
+
+    Parameters
+    ----------
+    model : Keras model
+        The model to predict on.
+    database : str
+        Raw HDF5 file or directory of the .npy database.
+    output : str
+        Output file, either '.npy' or '.h5'.
+    chunksize : int, optional
+        Number of feature rows read and predicted at once. Defaults to
+        100000.
+    batch_size : int, optional
+        Batch size for model.predict. Defaults to 8192.
+    start : int, optional
+        First feature row to predict. Defaults to 0.
+    stop : int, optional
+        Feature row to stop at (exclusive). Defaults to all rows.
+    verbose : bool, optional
+        Print throughput per chunk. Defaults to True.
+    scaler : StreamingScaler object, optional
+        Scaler applied to each chunk of features, reduced to columns if
+        given. Defaults to None.
+    columns : str, int or list, optional
+        Feature columns the model takes, by label, index or feature
+        group, see load_data_raw.get_column_idx. Defaults to None, i.e.
+        all columns.
+
+    Returns
+    -------
+    rows_per_s : float
+        Predicted feature rows per second.
+    """
+    read, n_rows, n_subjects, column_labels = open_features(database)
+    idx = None
+    if columns is not None:
+        idx = get_column_idx(column_labels, columns)
+    if scaler is not None:
+        scaler = select_scaler(scaler, column_labels, idx)
+    stop = n_rows if stop is None else min(stop, n_rows)
+    n_IDs = (stop - start) * n_subjects
+
+    if output.endswith('.npy'):
+        out = np.lib.format.open_memmap(output, mode='w+', dtype=np.float32,
+                                        shape=(stop * n_subjects,))
+        # IDs not predicted stay NaN instead of a valid looking 0 deg
+        out[:] = np.nan
+        store = None
+    else:
+        out = None
+        store = pd.HDFStore(output, mode='w')
+
+    t0 = time.time()
+    n_written = 0
+    for c_start in range(start, stop, chunksize):
+        c_stop = min(c_start + chunksize, stop)
+        X = read(c_start, c_stop)
+        if idx is not None:
+            X = X[:, idx]
+        if scaler is not None:
+            X = scaler.transform(X)
+        pred = np.ravel(model.predict(X, batch_size=batch_size))
+        if len(pred) != c_stop - c_start:
+            raise ValueError('Model returned {} predictions for {} feature '
+                             'rows.'.format(len(pred), c_stop - c_start))
+        pred = pred.astype(np.float32)
+        # fan out to all subjects sharing the feature row
+        pred = np.repeat(pred, n_subjects)
+        id_start = c_start * n_subjects
+        if out is not None:
+            out[id_start:id_start+len(pred)] = pred
+        else:
+            IDs = np.arange(id_start, id_start+len(pred), dtype=np.uint32)
+            store.append('prediction', pd.DataFrame({'global_id': IDs,
+                                                     'prediction': pred}),
+                         format='table', index=False,
+                         data_columns=['global_id'])
+        n_written += len(pred)
+        if verbose:
+            rate = (c_stop - start) / max(time.time() - t0, 1e-9)
+            print('{}/{} feature rows, {:.0f} rows/s'.format(
+                c_stop - start, stop - start, rate))
+
+    if n_written != n_IDs:
+        raise RuntimeError('Wrote {} of {} global IDs.'.format(n_written,
+                                                               n_IDs))
+    if out is not None:
+        out.flush()
+        del out
+    else:
+        store.create_table_index('prediction', columns=['global_id'])
+        store.close()
+    elapsed = max(time.time() - t0, 1e-9)
+    rows_per_s = (stop - start) / elapsed
+    if verbose:
+        print('Predicted {} feature rows ({} global IDs) in {:.1f} s, '
+              '{:.0f} rows/s'.format(stop - start, n_IDs, elapsed,
+                                     rows_per_s))
+    return rows_per_s
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('model', help='trained model (.h5)')
+    parser.add_argument('database', help='raw HDF5 file or .npy directory')
+    parser.add_argument('output', help='output file (.npy or .h5)')
+    parser.add_argument('--chunksize', type=int, default=100000,
+                        help='feature rows per chunk')
+    parser.add_argument('--batch-size', type=int, default=8192,
+                        help='batch size for model.predict')
+    parser.add_argument('--start', type=int, default=0,
+                        help='first feature row')
+    parser.add_argument('--stop', type=int, default=None,
+                        help='feature row to stop at (exclusive)')
+    parser.add_argument('--scaler', default=None,
+                        help='scaler json sidecar applied to the features')
+    parser.add_argument('--columns', nargs='+', default=None,
+                        help='feature columns by label, index or group')
+    args = parser.parse_args()
+
+    model = load_model(args.model, custom_objects=CUSTOM_OBJECTS)
+    scaler = None
+    if args.scaler is not None:
+        scaler = StreamingScaler.load(args.scaler)
+    predict_raw(model, args.database, args.output, args.chunksize,
+                args.batch_size, args.start, args.stop, scaler=scaler,
+                columns=parse_columns(args.columns))
+
+
+if __name__ == '__main__':
+    main()
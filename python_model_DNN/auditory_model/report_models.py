@@ -0,0 +1,424 @@
+"""
+Headless generation of the model comparison figures of the prediction
+review for a set of trained models.
+
+For each model of the model directory (filtered by a substring of the
+filename, e.g. 'toptest'), the train history figure and, for each test
+subset (condition name, e.g. NFCHOA_R006), the all-position overview
+and the per-position figures incl. ground truth are rendered with the
+Agg backend on a process pool and written to OUTPUT_DIR/<model>/.
+
+A content hash of every task's inputs (model, history and test
+partition files, the scaler sidecar, path, size and modification time
+of the database, the render settings and the evaluation, loss and
+plotting code) is stored in OUTPUT_DIR/report_cache.json together with
+the written figures. Tasks whose hash is unchanged and whose figures
+exist are skipped, so adding one model to the directory only renders
+that model's figures.
+
+Usage (from this directory):
+    python report_models.py DATABASE OUTPUT_DIR [--contains toptest] ...
+
+DATABASE is either a raw HDF5 file or a directory containing the .npy
+database written by utils.file_conversion.raw2npy (trailing slash). The
+.npy database is preferred, as it is memory-mapped and shared by all
+worker processes. Of a HDF5 database, each worker reads the small ID
+tables and only the feature and target rows spanned by a test subset.
+"""
+
+import matplotlib
+matplotlib.use('Agg')
+
+import argparse
+import hashlib
+import json
+import os
+import time
+import warnings
+import multiprocessing as mp
+import numpy as np
+import matplotlib.pyplot as plt
+from os.path import isdir, isfile
+
+from utils.dataset_split import SubsetIndex
+from utils.eval import model_eval_all, create_test_params, get_ref_column
+from utils.load_data_raw import (RawDatabase, load_raw_npy,
+                                 load_raw_IDs_npy)
+from utils.model_zoo import ModelZoo
+from utils.plot import plot_history, plot_locaz, plot_locaz_all
+from utils.scaler import StreamingScaler, scaler_filename
+from utils.utils import open_json
+
+# increase to invalidate all cached figures, e.g. after layout changes
+REPORT_VERSION = 1
+CACHE_NAME = 'report_cache.json'
+# code the figures depend on, relative to this directory
+CODE_FILES = ['report_models.py', 'utils/plot.py', 'utils/eval.py',
+              'utils/custom_loss.py', 'utils/load_data_raw.py',
+              'utils/scaler.py']
+
+# per-process state of the pool workers, see _init_worker
+_state = {}
+
+
+def hash_files(filenames, extra=None, chunksize=1<<20):
+    """
+    Return sha256 hex digest of the contents of filenames and of the
+    json serializable object extra.
+    """
+    h = hashlib.sha256()
+    for name in filenames:
+        h.update(name.encode())
+        with open(name, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunksize), b''):
+                h.update(chunk)
+    h.update(json.dumps(extra, sort_keys=True).encode())
+    return h.hexdigest()
+
+
+def database_signature(database):
+    """
+    Return cheap signature of a database (path, size and modification
+    time of its data files) instead of hashing several GB of data.
+    """
+    if isdir(database):
+        files = [database+x for x in ['feature_data.npy', 'target_data.npy',
+                                      'ID_reference_table.npy']]
+    else:
+        files = [database]
+    return [[os.path.abspath(x), os.path.getsize(x),
+             os.stat(x).st_mtime_ns] for x in files]
+
+
+def create_tasks(zoo, names, database, output, subsets, settings, cache):
+    """
+    Create the render tasks of models names of zoo and their content
+    hashes. Returns list of tasks to run and number of skipped tasks.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    code = [os.path.join(here, x) for x in CODE_FILES]
+    db_sig = database_signature(database)
+    sc_file = scaler_filename(database, 'minmax')
+    sc_files = [sc_file] if isfile(sc_file) else []
+    tasks = []
+    skipped = 0
+    for name in names:
+        info = zoo.get_info(name)
+        base = os.path.splitext(name)[0]
+        out_dir = os.path.join(output, base)
+        files = [zoo.model_dir+name]
+        for col in ['history', 'partition']:
+            if info[col] is not None:
+                files.append(zoo.model_dir+info[col])
+        kinds = list(subsets)
+        if info['history'] is not None:
+            kinds.insert(0, 'history')
+        for kind in kinds:
+            key = base+'/'+kind
+            extra = {'version': REPORT_VERSION, 'settings': settings,
+                     'kind': kind, 'database': db_sig}
+            digest = hash_files(files+sc_files+code, extra)
+            entry = cache.get(key)
+            if (entry is not None and entry['hash'] == digest and
+                    all(isfile(f) for f in entry['figures'])):
+                skipped += 1
+                continue
+            tasks.append({'key': key, 'hash': digest, 'name': name,
+                          'kind': kind, 'info': info, 'out_dir': out_dir})
+    return tasks, skipped
+
+
+def _init_worker(model_dir, database, settings):
+    """Initialize worker process; the database is opened on first use."""
+    warnings.filterwarnings('ignore', message='.*non-interactive.*')
+    _state.update({'model_dir': model_dir, 'database': database,
+                   'settings': settings, 'zoo': None, 'data': None,
+                   'subset': None})
+
+
+def _get_zoo():
+    """Return model zoo of the worker process."""
+    if _state['zoo'] is None:
+        _state['zoo'] = ModelZoo(_state['model_dir'], max_models=1)
+    return _state['zoo']
+
+
+def _get_data():
+    """
+    Return dict of the database handles, column labels, parameter
+    table, subset index and scaler of the worker process, opening them
+    on first use. The feature and target data of a .npy database are
+    memory-mapped; of a HDF5 database, only the ID tables are read
+    here, see _get_subset.
+    """
+    if _state['data'] is None:
+        database = _state['database']
+        data = {'db': None, 'feat': None, 'targ': None}
+        if isdir(database):
+            data['feat'], data['targ'], labels = load_raw_npy(database)
+            ID_ref, _, cond_t, par = load_raw_IDs_npy(database)
+        else:
+            data['db'] = RawDatabase(database)
+            labels = data['db'].columns('feature_data')
+            ID_ref, _, cond_t, par = data['db'].load_IDs()
+        scaler = None
+        sc_file = scaler_filename(database, 'minmax')
+        if isfile(sc_file):
+            scaler = StreamingScaler.load(sc_file)
+        data.update({'labels': labels, 'par': par, 'scaler': scaler,
+                     'index': SubsetIndex(ID_ref, cond_t)})
+        _state['data'] = data
+    return _state['data']
+
+
+def _get_subset(kind):
+    """
+    Return features, targets and global IDs of test subset kind, and
+    the global ID of the first feature row returned. Of a HDF5
+    database, only the feature and target rows spanned by the subset
+    are read; the last subset is kept for the next task.
+    """
+    if _state['subset'] is not None and _state['subset'][0] == kind:
+        return _state['subset'][1]
+    data = _get_data()
+    IDs = data['index'].query([kind]).astype(np.int64)
+    if len(IDs) == 0:
+        raise ValueError('Empty test subset: '+kind)
+    if data['db'] is None:
+        feat, targ, offset = data['feat'], data['targ'], 0
+    else:
+        db = data['db']
+        n_subjects = len(db.columns('target_data'))
+        n_frames = int(np.ravel(data['par']['nFrames'].values)[0])
+        # start at a target row, so target rows stay feature rows // n_frames
+        t_start = IDs[0] // (n_subjects*n_frames)
+        t_stop = IDs[-1] // (n_subjects*n_frames) + 1
+        f_start = t_start * n_frames
+        f_stop = IDs[-1] // n_subjects + 1
+        feat = db.select('feature_data', f_start, f_stop).values
+        targ = db.select('target_data', t_start, t_stop).values
+        offset = f_start * n_subjects
+    _state['subset'] = (kind, (feat, targ, IDs, offset))
+    return feat, targ, IDs, offset
+
+
+def get_model_params(name, feat, targ, labels, par, scaler, batch_size):
+    """
+    Return generator parameters of model name, following the naming of
+    data/models_trained/: 'nsc' models use unscaled features, 'no-ic'
+    models the ILD and ITD features only.
+    """
+    columns = ['ILD', 'ITD'] if 'no-ic' in name else None
+    if 'nsc' in name:
+        scaler = None
+    return create_test_params(feat, targ, par, batch_size=batch_size,
+                              shuffle=False, scaler=scaler, columns=columns,
+                              column_labels=labels)
+
+
+def get_title(info, test_data=None):
+    """Return figure title from the model info of the model zoo index."""
+    title = 'Model: {}{} | Loss: {}'.format(info['model'], info['special'],
+                                             info['loss'])
+    if test_data is not None:
+        title += ' | Test-Data: {}'.format(test_data)
+    return title
+
+
+def render_history(task):
+    """Render train history figure of a model. Returns figure filenames."""
+    zoo = _get_zoo()
+    hist = zoo.get_history(task['name'])
+    fig = plt.figure()
+    plot_history(hist['loss'], hist['val_loss'], task['info']['loss'])
+    fig.suptitle(get_title(task['info']))
+    fig.set_size_inches(8, 5)
+    filename = os.path.join(task['out_dir'], 'history.png')
+    fig.savefig(filename, dpi=_state['settings']['dpi'])
+    plt.close(fig)
+    return [filename]
+
+
+def render_subset(task):
+    """
+    Render all-position and per-position figures of a test subset.
+    Returns figure filenames.
+    """
+    settings = _state['settings']
+    data = _get_data()
+    feat, targ, IDs, offset = _get_subset(task['kind'])
+    model = _get_zoo().get_model(task['name'])
+    params = get_model_params(task['name'], feat, targ, data['labels'],
+                              data['par'], data['scaler'],
+                              settings['batch_size'])
+    # IDs relative to the first feature row of the subset data
+    _, pred, y, _ = model_eval_all(model, IDs - offset, params,
+                                   data['index'],
+                                   batch_size=settings['batch_size'],
+                                   by=[], workers=0)
+    pos = get_ref_column(data['index'], 'pos_id', IDs)
+    pos_ids = np.unique(pos)
+    pred_p = [pred[pos == i] for i in pos_ids]
+    y_p = [y[pos == i] for i in pos_ids]
+
+    title = get_title(task['info'], task['kind'])
+    prefix = os.path.join(task['out_dir'], task['kind'])
+    figures = [prefix+'_all.png']
+    fig = plot_locaz_all(pred_p, l=True, title=title, mode=settings['mode'],
+                         overlay=settings['overlay'])
+    fig.set_size_inches(20, 12)
+    fig.savefig(figures[0], dpi=settings['dpi'])
+    plt.close(fig)
+    for i, pos_id in enumerate(pos_ids):
+        fig, _, _ = plot_locaz(pred_p[i], y_p[i], l=True,
+                               mode=settings['mode'],
+                               overlay=settings['overlay'])
+        fig.suptitle(title+'\n Position: {}'.format(pos_id))
+        fig.set_size_inches(10.5, 5)
+        figures.append(prefix+'_pos{}.png'.format(pos_id))
+        fig.savefig(figures[-1], dpi=settings['dpi'])
+        plt.close(fig)
+    return figures
+
+
+def _run_task(task):
+    """Run one render task in a worker process."""
+    t0 = time.time()
+    figures = []
+    err = None
+    try:
+        os.makedirs(task['out_dir'], exist_ok=True)
+        if task['kind'] == 'history':
+            figures = render_history(task)
+        else:
+            figures = render_subset(task)
+    except Exception as e:
+        err = '{}: {}'.format(type(e).__name__, e)
+    return task['key'], task['hash'], figures, time.time() - t0, err
+
+
+def read_cache(output):
+    """Read task hashes and figures of previous runs."""
+    if isfile(os.path.join(output, CACHE_NAME)):
+        return open_json(output+os.sep, CACHE_NAME)
+    return {}
+
+
+def write_cache(output, cache):
+    """Write task hashes and figures, replacing the file atomically."""
+    filename = os.path.join(output, CACHE_NAME)
+    with open(filename+'.tmp', 'w') as f:
+        json.dump(cache, f, indent=1, sort_keys=True)
+    os.replace(filename+'.tmp', filename)
+
+
+def report_models(model_dir, database, output, contains=None,
+                  subsets=['NFCHOA_R006', 'NFCHOA_M027'], processes=4,
+                  mode='density', overlay=True, batch_size=1000,
+                  dpi=100, verbose=True):
+    """
+    Render the comparison figures of all models in model_dir whose
+    filename contains contains, skipping unchanged ones.
+
+    Parameters
+    ----------
+    model_dir : str
+        Directory of the trained models, e.g. '../data/models_trained/'.
+    database : str
+        Raw HDF5 file or directory of the .npy database.
+    output : str
+        Output directory.
+    contains : str, optional
+        Only report models whose filename contains this substring.
+        Defaults to all models.
+    subsets : list of str, optional
+        Test subsets (condition names) to render. Defaults to
+        ['NFCHOA_R006', 'NFCHOA_M027'].
+    processes : int, optional
+        Number of worker processes. Defaults to 4.
+    mode : {'scatter', 'density'}, optional
+        Rendering mode of plot_locaz. Defaults to 'density'.
+    overlay : bool, optional
+        Overlay mean and spread per head rotation. Defaults to True.
+    batch_size : int, optional
+        Batch size for prediction. Defaults to 1000.
+    dpi : int, optional
+        Resolution of the figures. Defaults to 100.
+    verbose : bool, optional
+        Print progress. Defaults to True.
+
+    Returns
+    -------
+    n_done : int
+        Number of rendered tasks.
+    n_skipped : int
+        Number of tasks skipped as unchanged.
+    errors : dict
+        Error message by task key of failed tasks.
+    """
+    zoo = ModelZoo(model_dir)
+    os.makedirs(output, exist_ok=True)
+    settings = {'mode': mode, 'overlay': overlay,
+                'batch_size': batch_size, 'dpi': dpi,
+                'subsets': list(subsets)}
+    cache = read_cache(output)
+    tasks, n_skipped = create_tasks(zoo, zoo.names(contains), database,
+                                    output, subsets, settings, cache)
+    if verbose:
+        print('{} tasks, {} unchanged'.format(len(tasks), n_skipped))
+
+    errors = {}
+    n_done = 0
+    if not tasks:
+        return n_done, n_skipped, errors
+    # spawn: TensorFlow is not fork-safe
+    ctx = mp.get_context('spawn')
+    with ctx.Pool(processes, initializer=_init_worker,
+                  initargs=(model_dir, database, settings)) as pool:
+        for key, digest, figures, elapsed, err in pool.imap_unordered(
+                _run_task, tasks):
+            if err is not None:
+                errors[key] = err
+                cache.pop(key, None)
+            else:
+                n_done += 1
+                cache[key] = {'hash': digest, 'figures': figures}
+            write_cache(output, cache)
+            if verbose:
+                print('{} ({:.1f} s){}'.format(key, elapsed,
+                                                ' FAILED: '+err if err
+                                                else ''))
+    return n_done, n_skipped, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('database', help='raw HDF5 file or .npy directory')
+    parser.add_argument('output', help='output directory')
+    parser.add_argument('--model-dir', default='../data/models_trained/',
+                        help='directory of the trained models')
+    parser.add_argument('--contains', default=None,
+                        help='only models whose filename contains this')
+    parser.add_argument('--subsets', nargs='+',
+                        default=['NFCHOA_R006', 'NFCHOA_M027'],
+                        help='test subsets (condition names)')
+    parser.add_argument('--processes', type=int, default=4,
+                        help='number of worker processes')
+    parser.add_argument('--mode', choices=['scatter', 'density'],
+                        default='density', help='rendering mode')
+    parser.add_argument('--no-overlay', action='store_true',
+                        help='do not overlay mean and spread')
+    parser.add_argument('--dpi', type=int, default=100,
+                        help='resolution of the figures')
+    args = parser.parse_args()
+
+    _, _, errors = report_models(args.model_dir, args.database, args.output,
+                                 args.contains, args.subsets,
+                                 args.processes, args.mode,
+                                 not args.no_overlay, dpi=args.dpi)
+    if errors:
+        raise SystemExit('{} tasks failed.'.format(len(errors)))
+
+
+if __name__ == '__main__':
+    main()
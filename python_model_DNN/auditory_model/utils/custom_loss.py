@@ -4,13 +4,14 @@ A python module that provides different custom loss functions.
 
 import tensorflow as tf
 from keras import backend as K
-from numpy import pi, sin, cos, rad2deg, deg2rad, arctan2
+from numpy import pi, sin, cos, rad2deg, deg2rad, arctan2, mod, absolute, square
 
 
 def mse_wrap_angle(y_true, y_pred):
     """
     Custom loss function based on MSE but with angles wrapped to 360 degree.
-    Tensorflows atan2 is used. Therefore conversion to radiant and back is performed.
+    The angle difference is wrapped with floor-mod arithmetic, see
+    tf_angle_diff_deg.
     """
     diff = tf_angle_diff_deg(y_pred, y_true)
     return K.mean(K.square(diff), axis=-1)
@@ -19,14 +20,85 @@ def mse_wrap_angle(y_true, y_pred):
 def mae_wrap_angle(y_true, y_pred):
     """
     Custom loss function based on MAE but with angles wrapped to 360 degree.
-    Tensorflows atan2 is used. Therefore conversion to radiant and back is performed.
+    The angle difference is wrapped with floor-mod arithmetic, see
+    tf_angle_diff_deg.
     """
     diff = tf_angle_diff_deg(y_pred, y_true)
     return K.mean(K.abs(diff), axis=-1)
 
 
+def mse_wrap_angle_multi(y_true, y_pred):
+    """
+    Multi-target version of mse_wrap_angle for the deduplicated training
+    mode of DataGenerator_raw. y_true holds the targets of all subjects
+    per feature row, missing targets are NaN. The batch mean of the
+    returned per-row losses equals the mean squared error over all
+    valid targets of the batch, i.e. the per-sample loss.
+    """
+    diff, mask = tf_angle_diff_deg_masked(y_pred, y_true)
+    return masked_row_loss(K.square(diff), mask)
+
+
+def mae_wrap_angle_multi(y_true, y_pred):
+    """
+    Multi-target version of mae_wrap_angle for the deduplicated training
+    mode of DataGenerator_raw. y_true holds the targets of all subjects
+    per feature row, missing targets are NaN. The batch mean of the
+    returned per-row losses equals the mean absolute error over all
+    valid targets of the batch, i.e. the per-sample loss.
+    """
+    diff, mask = tf_angle_diff_deg_masked(y_pred, y_true)
+    return masked_row_loss(K.abs(diff), mask)
+
+
+# custom_objects to load models trained with these losses, e.g.
+# keras.models.load_model(filename, custom_objects=CUSTOM_OBJECTS)
+CUSTOM_OBJECTS = {'mse_wrap_angle': mse_wrap_angle,
+                  'mae_wrap_angle': mae_wrap_angle,
+                  'mse_wrap_angle_multi': mse_wrap_angle_multi,
+                  'mae_wrap_angle_multi': mae_wrap_angle_multi}
+
+
+def masked_row_loss(err, mask):
+    """
+    Per-row sums of the masked errors err, scaled by the number of rows
+    over the number of valid entries of the batch. Keras averages the
+    rows, so every valid target gets the same weight, however many
+    valid targets its row has.
+    """
+    n_rows = K.cast(K.shape(mask)[0], K.floatx())
+    return K.sum(err, axis=-1) * n_rows / K.maximum(K.sum(mask), 1)
+
+
+def tf_angle_diff_deg_masked(a, b):
+    """
+    Calculates angle differences in degrees in tensorflow, ignoring NaN
+    entries in b. Returns differences (zero where b is NaN) and float
+    mask of valid entries.
+    """
+    valid = tf.logical_not(tf.math.is_nan(b))
+    # replace NaNs before differentiation to keep gradients finite
+    b = tf.where(valid, b, tf.zeros_like(b))
+    a = a + tf.zeros_like(b)
+    diff = tf.where(valid, tf_angle_diff_deg(a, b), tf.zeros_like(b))
+    return diff, K.cast(valid, K.floatx())
+
+
 def tf_angle_diff_deg(a,b):
-    """Calculates angle differences in degrees in tensorflow."""
+    """
+    Calculates angle differences in degrees in tensorflow, wrapped to
+    [-180, 180) with floor-mod arithmetic. Equals tf_angle_diff_deg_atan2
+    except for a difference of exactly +180 degree, which is mapped to
+    -180 (same absolute and squared error).
+    """
+    return tf.math.floormod(a - b + 180., 360.) - 180.
+
+
+def tf_angle_diff_deg_atan2(a,b):
+    """
+    Calculates angle differences in degrees in tensorflow with atan2.
+    Reference implementation for tf_angle_diff_deg.
+    """
     a = tf_deg2rad(a)
     b = tf_deg2rad(b)
     diff = tf.atan2(tf.sin(a - b), tf.cos(a - b))
@@ -44,7 +116,28 @@ def tf_rad2deg(a):
 
 
 def angle_diff_deg(a,b):
-    """Calculates angle differences in degrees with numpy for evaluation outside tensorflow."""
+    """
+    Calculates angle differences in degrees with numpy for evaluation
+    outside tensorflow, wrapped to [-180, 180) with floor-mod arithmetic
+    (see tf_angle_diff_deg).
+    """
+    return mod(a - b + 180., 360.) - 180.
+
+
+def angle_errors_deg(a,b):
+    """
+    Calculates absolute and squared angle differences in degrees with
+    numpy from a single angle difference. Returns tuple (abs_err, sq_err).
+    """
+    diff = angle_diff_deg(a, b)
+    return absolute(diff), square(diff)
+
+
+def angle_diff_deg_atan2(a,b):
+    """
+    Calculates angle differences in degrees with numpy using arctan2.
+    Reference implementation for angle_diff_deg.
+    """
     a = deg2rad(a)
     b = deg2rad(b)
     diff = arctan2(sin(a - b), cos(a - b))
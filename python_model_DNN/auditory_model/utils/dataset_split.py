@@ -4,11 +4,153 @@ Python module that provides functions to split the dataset for training.
 
 import numpy as np
 import pandas as pd
+from os.path import splitext, exists
 from sklearn.model_selection import train_test_split
+from utils.utils import open_json
+
+
+class SubsetIndex(object):
+    """
+    Inverted index on the ID reference table. Built once, it holds the
+    sorted global IDs per pos_id, cond_id and subject_id and answers
+    subset queries with bitmaps and sorted-array intersections instead
+    of scanning the complete table for each requested id.
+
+    Attributes
+    ----------
+    ID_ref : pandas DataFrame object
+        DataFrame object containing the global ID reference list.
+    cond_t : pandas DataFrame object
+        DataFrame object containing all conditions and corresponding
+        indexes.
+    n_IDs : int
+        Size of the global ID space (maximum ID + 1).
+    """
+    columns = ['pos_id', 'cond_id', 'subject_id']
+
+    def __init__(self, ID_ref, cond_t):
+        """Initialization."""
+        if not ID_ref.index.is_monotonic_increasing:
+            ID_ref = ID_ref.sort_index()
+        self.ID_ref = ID_ref
+        self.cond_t = cond_t
+        IDs = ID_ref.index.values.astype(np.uint32)
+        self.n_IDs = int(IDs[-1]) + 1 if len(IDs) else 0
+        self._ids = {}
+        self._cond_cache = {}
+        for col in self.columns:
+            values = ID_ref[col].values
+            # stable sort keeps the IDs sorted within each value
+            order = np.argsort(values, kind='stable')
+            uniq, starts = np.unique(values[order], return_index=True)
+            stops = np.append(starts[1:], len(values))
+            sorted_IDs = IDs[order]
+            # views into the index are handed out read-only, see _view
+            sorted_IDs.setflags(write=False)
+            self._ids[col] = {int(v): sorted_IDs[i:j]
+                              for v, i, j in zip(uniq, starts, stops)}
+
+    def ids(self, col, value):
+        """Return sorted array of global IDs with ID_ref[col] == value."""
+        return self._view(col, value).copy()
+
+    def _view(self, col, value):
+        """Read-only view of the indexed IDs with ID_ref[col] == value."""
+        return self._ids[col].get(int(value), np.array([], dtype=np.uint32))
+
+    def values(self, col):
+        """Return sorted list of values present in column col."""
+        return sorted(self._ids[col].keys())
+
+    def union(self, col, values):
+        """Return sorted global IDs matching any of values in col."""
+        return self._or([(col, v) for v in values])
+
+    def select(self, cond_ids=[], pos_ids=[], subject_ids=[], mode='or'):
+        """
+        Select the global IDs of a subset by condition, position and
+        subject ids.
+
+        Parameters
+        ----------
+        cond_ids : list of int
+            List of condition ids of a subset to select.
+        pos_ids : list of int
+            List of position ids of a subset to select.
+        subject_ids : list of int
+            List of subject ids of a subset to select.
+        mode : {'or', 'and'}, optional
+            With 'or', select samples matching any of the ids, as
+            get_subset_sample_idx does. With 'and', select samples
+            matching any of the ids of each non-empty category, e.g.
+            condition AND position. Defaults to 'or'.
+
+        Returns
+        -------
+        idx_list : ndarray of uint32
+            Sorted array containing the selected sample indices.
+        """
+        queries = [(c, v) for c, v in zip(['cond_id', 'pos_id',
+                                            'subject_id'],
+                                           [cond_ids, pos_ids, subject_ids])
+                   if len(v)]
+        if not queries:
+            return np.array([], dtype=np.uint32)
+        if mode == 'or':
+            return self._or([(c, x) for c, v in queries for x in v])
+        elif mode == 'and':
+            idx_list = self.union(*queries[0])
+            for c, v in queries[1:]:
+                idx_list = np.intersect1d(idx_list, self.union(c, v),
+                                          assume_unique=True)
+            return idx_list
+        raise ValueError("mode must be either 'or' or 'and'.")
+
+    def _or(self, pairs):
+        """Union of the IDs of (column, value) pairs via a bitmap."""
+        if len(pairs) == 1:
+            return self.ids(*pairs[0])
+        mask = np.zeros(self.n_IDs, dtype=bool)
+        for c, v in pairs:
+            mask[self._view(c, v)] = True
+        return np.flatnonzero(mask).astype(np.uint32)
+
+    def get_subset_ids(self, subset_list):
+        """
+        Cached version of get_subset_ids for this index' condition
+        table. Returns cond_ids, pos_ids and subject_ids.
+        """
+        key = tuple(subset_list)
+        if key not in self._cond_cache:
+            self._cond_cache[key] = get_subset_ids(subset_list, self.cond_t)
+        return self._cond_cache[key]
+
+    def query(self, subset_list, mode='or'):
+        """
+        Select global IDs of the subset specified by subset_list, e.g.
+        ['NFCHOA', 'pos1', 'subject_1']. See get_subset_ids.
+        """
+        cond_ids, pos_ids, subject_ids = self.get_subset_ids(subset_list)
+        return self.select(cond_ids, pos_ids, subject_ids, mode=mode)
+
+    def column(self, col, IDs):
+        """Look up column of the ID reference table for global IDs."""
+        return self.ID_ref[col].values[np.searchsorted(
+            self.ID_ref.index.values, IDs)]
+
+    def pos_IDs(self, part):
+        """
+        Return list of sorted arrays of IDs in partition part for each
+        position, and the position ids.
+        """
+        part = np.sort(np.asarray(part, dtype=np.uint32))
+        pos = self.values('pos_id')
+        return [np.intersect1d(part, self._view('pos_id', p),
+                               assume_unique=True) for p in pos], pos
 
 
 def create_split(ID_ref_t, cond_t, test_subset=[], valid_subset=[],
-                 test_split=0.2, valid_split=0.2):
+                 test_split=0.2, valid_split=0.2, index=None):
     """
     Create data set split based on the specified subsets. If either one
     or both subsets are empty or unspecified, split the remaining dataset
@@ -36,6 +178,10 @@ def create_split(ID_ref_t, cond_t, test_subset=[], valid_subset=[],
     valid_split : float, int or None, optional
         Proportion of the data set to include in the validation set,
         if no valid_subset is provided.
+    index : SubsetIndex, optional
+        Inverted index on ID_ref_t and cond_t. Pass a prebuilt index
+        when creating several splits. Built from ID_ref_t and cond_t if
+        not provided.
         
     Returns
     -------
@@ -45,20 +191,14 @@ def create_split(ID_ref_t, cond_t, test_subset=[], valid_subset=[],
 
     # Initialization
     partition = {'train':[], 'validation':[], 'test':[]}
+    if index is None:
+        index = SubsetIndex(ID_ref_t, cond_t)
     # only test on samples specified by test_subset
-    cond_ids_test, pos_ids_test, sub_ids_test = get_subset_ids(test_subset,
-                                                                   cond_t)
-    # extract repective samples from ID_ref table
-    list_IDs_test = get_subset_sample_idx(ID_ref_t, cond_ids_test,
-                                          pos_ids_test, sub_ids_test)
+    list_IDs_test = index.query(test_subset)
     # only validate on samples specified by valid_subset
-    cond_ids_valid, pos_ids_valid, sub_ids_valid = get_subset_ids(valid_subset,
-                                                                  cond_t)
-    # extract repective samples from ID_ref table
-    list_IDs_valid = get_subset_sample_idx(ID_ref_t, cond_ids_valid,
-                                           pos_ids_valid, sub_ids_valid)
+    list_IDs_valid = index.query(valid_subset)
     # only train on samples not part of test_subset or valid_subset
-    idx_list = np.unique(np.concatenate((list_IDs_valid, list_IDs_test)))
+    idx_list = np.union1d(list_IDs_valid, list_IDs_test)
     list_IDs = ID_ref_t.index.values.astype(np.uint32)
     list_IDs_train = np.delete(list_IDs, idx_list)
     
@@ -81,6 +221,188 @@ def create_split(ID_ref_t, cond_t, test_subset=[], valid_subset=[],
     return partition
 
 
+def generate_folds(ID_ref_t, cond_t, group='cond_id', k=None,
+                   valid_split=0.2, seed=None, index=None):
+    """
+    Lazily generate grouped folds of the data set, e.g.
+    leave-one-condition-out or leave-one-position-out. For each fold,
+    the samples of the held-out group(s) form the test set and the
+    remaining samples are randomly split into training and validation
+    set as in create_split.
+
+    Parameters
+    ----------
+    ID_ref_t : pandas DataFrame object
+        DataFrame object containing the global ID reference list.
+    cond_t : pandas.DataFrame object
+        DataFrame object containing all conditions and corresponding
+        indexes.
+    group : {'cond_id', 'pos_id', 'subject_id'}, optional
+        Column of ID_ref_t to group by. Defaults to 'cond_id'.
+    k : int, optional
+        Number of folds. If None, leave one group out per fold.
+        Otherwise distribute the groups randomly over k folds.
+    valid_split : float, optional
+        Proportion of the remaining samples to include in the
+        validation set. Defaults to 0.2.
+    seed : int, optional
+        Seed of the random number generator, for reproducible folds.
+    index : SubsetIndex, optional
+        Inverted index on ID_ref_t and cond_t. Built if not provided.
+
+    Yields
+    ------
+    name : str
+        Name of the fold, e.g. 'NFCHOA_R006', 'pos1' or 'subject_1', or
+        the names of the held-out groups joined by '+' if k is given.
+    partition : dict
+        Dictionary that contains train, validation and test sets as
+        sorted uint32 arrays.
+    """
+    if index is None:
+        index = SubsetIndex(ID_ref_t, cond_t)
+    rng = np.random.RandomState(seed)
+    values = index.values(group)
+    if k is None:
+        fold_values = [[v] for v in values]
+    else:
+        fold_values = np.array_split(rng.permutation(values), k)
+
+    all_IDs = np.zeros(index.n_IDs, dtype=bool)
+    all_IDs[index.ID_ref.index.values] = True
+    for vals in fold_values:
+        list_IDs_test = index.union(group, vals)
+        mask = all_IDs.copy()
+        mask[list_IDs_test] = False
+        list_IDs_train, list_IDs_valid = train_test_split(
+            np.flatnonzero(mask).astype(np.uint32), shuffle=True,
+            test_size=valid_split, random_state=rng)
+        partition = {'train': np.sort(list_IDs_train),
+                     'validation': np.sort(list_IDs_valid),
+                     'test': list_IDs_test}
+        name = '+'.join(get_group_name(index.cond_t, group, v) for v in vals)
+        yield name, partition
+
+
+def get_group_name(cond_t, group, value):
+    """
+    Name of a condition, position or subject id in the naming
+    convention of get_subset_ids, e.g. 'NFCHOA_R006', 'pos1' or
+    'subject_1'.
+    """
+    if group == 'cond_id':
+        return cond_t.loc[value, 'sfs_method']
+    elif group == 'pos_id':
+        return 'pos' + str(int(value)+1)
+    return 'subject_' + str(int(value))
+
+
+def save_fold(partition, out_dir, name, encoding='raw'):
+    """
+    Save each set of a partition with save_partition to a file named
+    name+'_partition_'+set+ext, following the naming of the
+    '*_partition_test.json' files. Returns dict of the filenames.
+    """
+    filenames = {}
+    for part, IDs in partition.items():
+        filenames[part] = save_partition(IDs, out_dir+name+'_partition_'
+                                         +part, encoding=encoding)
+    return filenames
+
+
+def load_fold(out_dir, name, mmap_mode='r'):
+    """
+    Load partition saved by save_fold. Returns dict of uint32 arrays,
+    memory-mapped for raw encoding.
+    """
+    partition = {}
+    for part in ['train', 'validation', 'test']:
+        base = out_dir+name+'_partition_'+part
+        ext = '.npy' if exists(base+'.npy') else '.npz'
+        partition[part] = load_partition(base+ext, mmap_mode=mmap_mode)
+    return partition
+
+
+def save_partition(IDs, filename, encoding='auto'):
+    """
+    Save partition, i.e. array of global IDs, in a compact binary
+    format instead of a JSON list.
+
+    Parameters
+    ----------
+    IDs : array_like of int
+        Global IDs of the partition.
+    filename : str
+        Filename without extension. '.npy' is appended for raw
+        encoding, '.npz' otherwise.
+    encoding : {'auto', 'raw', 'delta', 'rle'}, optional
+        'raw' stores a uint32 .npy file that is memory-mapped on
+        loading. 'delta' stores the first ID and the differences in the
+        smallest sufficient integer type, compressed. 'rle' stores
+        start and length of each run of consecutive IDs and requires
+        sorted unique IDs, as returned by get_subset_sample_idx. 'auto'
+        uses 'rle' if IDs are sorted and mostly contiguous and 'raw'
+        otherwise. Defaults to 'auto'.
+
+    Returns
+    -------
+    filename : str
+        Filename including extension.
+    """
+    IDs = np.asarray(IDs, dtype=np.uint32)
+    diff = np.diff(IDs.astype(np.int64))
+    if encoding == 'auto':
+        n_runs = np.count_nonzero(diff != 1) + 1
+        encoding = 'rle' if np.all(diff > 0) and 4*n_runs < len(IDs) \
+                   else 'raw'
+
+    if encoding == 'raw':
+        filename += '.npy'
+        np.save(filename, IDs)
+    elif encoding == 'delta':
+        filename += '.npz'
+        dtype = np.result_type(np.min_scalar_type(diff.min(initial=0)),
+                               np.min_scalar_type(diff.max(initial=0)))
+        np.savez_compressed(filename, encoding='delta', first=IDs[:1],
+                            data=diff.astype(dtype))
+    elif encoding == 'rle':
+        if not np.all(diff > 0):
+            raise ValueError('rle encoding requires sorted unique IDs.')
+        filename += '.npz'
+        breaks = np.flatnonzero(diff != 1) + 1
+        starts = np.concatenate(([0], breaks)) if len(IDs) else breaks
+        lengths = np.diff(np.append(starts, len(IDs)))
+        np.savez_compressed(filename, encoding='rle', starts=IDs[starts],
+                            lengths=lengths.astype(np.uint32))
+    else:
+        raise ValueError('Unknown encoding: '+str(encoding))
+    return filename
+
+
+def load_partition(filename, mmap_mode='r'):
+    """
+    Load partition saved by save_partition, or a legacy JSON list of
+    IDs. Returns uint32 array, memory-mapped for '.npy' files.
+    """
+    ext = splitext(filename)[1]
+    if ext == '.json':
+        return np.asarray(open_json('', filename), dtype=np.uint32)
+    if ext == '.npy':
+        return np.load(filename, mmap_mode=mmap_mode)
+    with np.load(filename) as data:
+        encoding = str(data['encoding'])
+        if encoding == 'delta':
+            IDs = np.concatenate((data['first'].astype(np.int64),
+                                  data['data'].astype(np.int64)))
+            return np.cumsum(IDs).astype(np.uint32)
+        starts = data['starts'].astype(np.int64)
+        lengths = data['lengths'].astype(np.int64)
+    # ID = start of run + position within run
+    offsets = np.cumsum(lengths) - lengths
+    IDs = np.repeat(starts - offsets, lengths) + np.arange(lengths.sum())
+    return IDs.astype(np.uint32)
+
+
 def get_subset_ids(subset_list, cond_lookup_df, pos_lookup_df=None,
                    subject_lookup_df=None):
     """
@@ -143,8 +465,9 @@ def get_subset_sample_idx(ID_ref, cond_ids, pos_ids, subject_ids):
     
     Parameters
     ----------
-    ID_ref : pandas DataFrame object
-        DataFrame object containing the global ID reference list.
+    ID_ref : pandas DataFrame object or SubsetIndex
+        DataFrame object containing the global ID reference list or
+        inverted index on it.
     cond_ids : list of int
         List of condition ids of a subset to select.
     pos_ids : list of int
@@ -157,34 +480,43 @@ def get_subset_sample_idx(ID_ref, cond_ids, pos_ids, subject_ids):
     idx_list : ndarray of uint32
         Numpy array containing the selected sample indices.
     """
-    idx_list = np.array([],dtype=np.uint32)
-    for pos in pos_ids:
-        idx = ID_ref[(ID_ref.pos_id==pos)].index.values.astype(np.uint32)
-        idx_list = np.concatenate((idx_list, idx))
-    for cond in cond_ids:
-        idx = ID_ref[(ID_ref.cond_id==cond)].index.values.astype(np.uint32)
-        idx_list = np.concatenate((idx_list, idx))
-    for sub in subject_ids:
-        idx = ID_ref[(ID_ref.subject_id==sub)].index.values.astype(np.uint32)
-        idx_list = np.concatenate((idx_list, idx))
+    if isinstance(ID_ref, SubsetIndex):
+        return ID_ref.select(cond_ids, pos_ids, subject_ids)
+    # one scan per column
+    mask = np.zeros(len(ID_ref), dtype=bool)
+    for col, ids in [('pos_id', pos_ids), ('cond_id', cond_ids),
+                     ('subject_id', subject_ids)]:
+        if len(ids):
+            mask |= np.isin(ID_ref[col].values, ids)
     # Return unique idx list
-    return np.unique(idx_list)
+    return np.unique(ID_ref.index.values[mask].astype(np.uint32))
 
 
 def get_pos_IDs(part, ID_ref, dictn=False):
     """
     Get list or dictionary containing all IDs in partition
-    corresponding to one position.
+    corresponding to one position. ID_ref may be the ID reference
+    table or a SubsetIndex on it.
     """
 
+    if isinstance(ID_ref, SubsetIndex):
+        list_ID_x, pos_ids = ID_ref.pos_IDs(part)
+    else:
+        # single pass over the partition, grouped by position
+        IDs = ID_ref.index.values[part]
+        pos_part = ID_ref['pos_id'].values[part]
+        order = np.argsort(pos_part, kind='stable')
+        found, starts = np.unique(pos_part[order], return_index=True)
+        groups = dict(zip(found, np.split(IDs[order], starts[1:])))
+        # every position of ID_ref, empty if not in the partition
+        pos_ids = np.unique(ID_ref['pos_id'].values)
+        list_ID_x = [groups.get(i, IDs[:0]) for i in pos_ids]
+
     if dictn:
-        list_ID_x = {}
         pos = ['pos1','pos2','pos3','pos4','pos5','pos6','pos7','pos8','pos9','pos10']
-        for i,s in enumerate(pos):
-            list_ID_x[s] = ID_ref.iloc[part].loc[ID_ref['pos_id'] == i].index.values
+        empty = np.array([], dtype=np.uint32)
+        list_ID_x = {s: list_ID_x[list(pos_ids).index(i)]
+                     if i in pos_ids else empty for i,s in enumerate(pos)}
     else:
-        pos = np.unique(ID_ref['pos_id'].values)
-        list_ID_x = []
-        for i in pos:
-            list_ID_x.append(ID_ref.iloc[part].loc[ID_ref['pos_id'] == i].index.values)
+        pos = np.asarray(pos_ids)
     return list_ID_x, pos
\ No newline at end of file
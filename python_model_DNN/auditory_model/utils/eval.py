@@ -5,9 +5,10 @@ Various functions for model evaluation.
 import numpy as np
 import pandas as pd
 
-from utils.load_data_raw import DataGenerator_raw
-from utils.custom_loss import angle_diff_deg
+from utils.load_data_raw import DataGenerator_raw, get_column_idx
+from utils.custom_loss import angle_diff_deg, angle_errors_deg
 from utils.plot import plot_history
+from utils.dataset_split import SubsetIndex
 
 
 def model_complete_eval(model, history, part_test, params, batch_size=1024,
@@ -70,6 +71,8 @@ def model_eval_pos(model, history, part_test, params, ID_ref, batch_size=1000, w
     """
     Evaluate a specified model over for each position individually.
     Show model topology, training history and loss on test data set.
+    Runs a single prediction pass over the test set, see
+    model_eval_all.
 
     Parameters
     ----------
@@ -94,47 +97,118 @@ def model_eval_pos(model, history, part_test, params, ID_ref, batch_size=1000, w
     Returns
     -------
     mae_p : ndarray
-        Array containing the mean absolute error (or the loss metric)
-        per position.
+        Array containing the wrapped mean absolute error per position.
     mse_p : ndarray
-        Array containing the mean squared error (or the first metric)
-        per position.
-    loc_pred : ndarray
-        Array containing model predictions per position.
+        Array containing the wrapped mean squared error per position.
+    loc_pred : list of ndarrays
+        List containing model predictions per position. Positions may
+        have different numbers of test IDs.
     """
 
-    # get metrics from history dict
-    metrics, _, _ = get_history_metrics(history)
     # show model/net topology
     model.summary()
     
     il = np.min(part_test)
     iu = np.max(part_test)
-    ID = {}
-    pos_str = ['pos0', 'pos1', 'pos2', 'pos3', 'pos4', 'pos5', 'pos6', 'pos7',
-               'pos8', 'pos9']
-    n_pos = len(pos_str)
-    for i,s in enumerate(pos_str):
-        ID[s] = ID_ref[il:iu+1].loc[ID_ref['pos_id'] == i].index.values
-    
-    mae_p = np.zeros(n_pos)
-    mse_p = np.zeros(n_pos)
-    loc_pred = np.zeros([n_pos,len(ID[pos_str[0]])])
-    for i,s in enumerate(pos_str):
-        params['batch_size'] = batch_size
-        b_gen = DataGenerator_raw(ID[s], **params)
-        mae_p[i], mse_p[i] = model.evaluate_generator(b_gen, verbose=0, 
-                                                     use_multiprocessing=True,
-                                                      workers=4)
-        lpred = model.predict_generator(b_gen,verbose=0,
-                                        use_multiprocessing=True,
-                                        workers=4)
-        loc_pred[i] = lpred.T
-        print(s+' : ')
+    n_pos = 10
+    ref = ID_ref.ID_ref if isinstance(ID_ref, SubsetIndex) else ID_ref
+    IDs = ref.index.values[il:iu+1]
+    scores, pred, _, IDs = model_eval_all(model, IDs, params, ID_ref,
+                                          batch_size=batch_size,
+                                          by=['pos_id'], workers=workers)
+    pos = get_ref_column(ID_ref, 'pos_id', IDs)
+    per_pos = scores['pos_id'].reindex(np.arange(n_pos))
+    mae_p = per_pos['mae_w'].values
+    mse_p = per_pos['mse_w'].values
+    loc_pred = [pred[pos == i] for i in range(n_pos)]
+    for i in range(n_pos):
+        print('pos{} : '.format(i))
         print(mae_p[i])
     return mae_p, mse_p, loc_pred
 
 
+def model_eval_all(model, part_test, params, ID_ref, batch_size=1000,
+                   by=['pos_id', 'cond_id', 'subject_id'], verbose=0,
+                   workers=4):
+    """
+    Evaluate a specified model on the complete test set with a single
+    prediction pass. The wrapped MAE and MSE are computed from the
+    predictions with angle_errors_deg, overall and per group of each
+    column of ID_ref in by (e.g. per position, condition and subject).
+    Unlike predict_generator alone, all IDs are predicted, including
+    the ones not filling a complete batch.
+
+    Parameters
+    ----------
+    model : Keras model
+        The model to evaluate.
+    part_test : list or ndarray
+        List containing the test set/partition.
+    params : dict
+        Dictionary containing the parameters for the DataGenerator
+        object.
+    ID_ref : pandas DataFrame object
+        DataFrame object containing the global ID reference list.
+    batch_size : int, optional
+        Batch size. Defaults to 1000.
+    by : list of str, optional
+        Columns of ID_ref to compute grouped scores for. Defaults to
+        ['pos_id', 'cond_id', 'subject_id'].
+    verbose : int, optional
+        Verbose parameter for Keras model methods. Defaults to 0.
+    workers : int, optional
+        Number of workers for the multiprocessing functionalities of
+        the Keras model methods. Defauts to 4.
+
+    Returns
+    -------
+    scores : dict
+        Overall 'mae_w' and 'mse_w' and for each column in by a
+        DataFrame with columns mae_w, mse_w and n indexed by group.
+    pred : ndarray
+        Predictions in order of IDs.
+    y : ndarray
+        Targets in order of IDs.
+    IDs : ndarray
+        Global IDs of the test set.
+    """
+    IDs = np.asarray(part_test, dtype=np.int64)
+    params = dict(params, batch_size=batch_size, shuffle=False)
+    b_gen = DataGenerator_raw(IDs, **params)
+    pred = model_predict_all(model, b_gen, verbose, workers)
+    y = b_gen.get_targets(IDs)
+
+    abs_err, sq_err = angle_errors_deg(pred, y)
+    scores = {'mae_w': np.mean(abs_err), 'mse_w': np.mean(sq_err)}
+    for col in by:
+        codes, groups = pd.factorize(get_ref_column(ID_ref, col, IDs),
+                                     sort=True)
+        n = np.bincount(codes)
+        scores[col] = pd.DataFrame({
+            'mae_w': np.bincount(codes, weights=abs_err) / n,
+            'mse_w': np.bincount(codes, weights=sq_err) / n,
+            'n': n}, index=pd.Index(groups, name=col))
+    return scores, pred, y, IDs
+
+
+def model_predict_all(model, b_gen, verbose=0, workers=4):
+    """
+    Predict on model for all IDs of a non-shuffling DataGenerator_raw
+    object, including the remainder not filling a complete batch.
+    Returns one-dimensional array of predictions in order of IDs.
+    """
+    n_full = len(b_gen) * b_gen.batch_size
+    pred = []
+    if len(b_gen):
+        pred.append(model.predict_generator(b_gen, verbose=verbose,
+                                            use_multiprocessing=True,
+                                            workers=workers))
+    if n_full < len(b_gen.IDs):
+        X, _ = b_gen.get_data(b_gen.IDs[n_full:])
+        pred.append(model.predict(X, batch_size=b_gen.batch_size))
+    return np.ravel(np.concatenate(pred))
+
+
 def model_eval(model, b_gen, metric_str, workers=4):
     """
     Evaluate model on data generator.
@@ -182,7 +256,9 @@ def model_pred_on_gen_batch(model, b_gen, b_idx=0):
 
 def calc_errors_m(model, part_x, params, pos_ids, verbose=0, workers=4):
     """
-    Error analysis based on mean squared error.
+    Error analysis based on mean squared error. All positions are
+    predicted in a single pass over the concatenated partitions, see
+    model_predict_all, and decomposed with calc_error_decomp.
 
     Parameters
     ----------
@@ -212,82 +288,178 @@ def calc_errors_m(model, part_x, params, pos_ids, verbose=0, workers=4):
         Systematic deviations a.k.a. bias for each position.
     sigma_sq_m : float
         Stochastic variations / variance.
-    delta_x : float
-        delta_x.
-    delta_mean_x : float
-        delta_mean_x.
+    delta_x : list of ndarray
+        Angle differences per position.
+    delta_mean_x : ndarray
+        Mean angle difference per position.
     """
 
-    # initialization
-    L = 20 # 20 subjects
-    B = 3600 # 360 angle * 10 repitions
-    X = pos_ids.shape[0] # 10 positions
-    delta_x = []
-    b_gen = []
-    delta_mean_x = np.zeros(X)
-    sigma_sq_m = []
-    
     # DELTA_l,m_b(x)
-    for x in pos_ids:
-        b_gen.append(DataGenerator_raw(part_x[x], **params))
-        y_x = get_y_gen(b_gen[x])
-        pred_x = model.predict_generator(b_gen[x], verbose=verbose,
-                                         use_multiprocessing=True,
-                                         workers=workers,
-                                         max_queue_size=1000)
-        delta = np.zeros(part_x[x].shape[0])
-        for i in np.arange(part_x[x].shape[0]):
-            delta[i] = angle_diff_deg(pred_x[i], y_x[i])
-        delta_x.append(delta)
-
-    # DELTA_MEAN_m(x)
-    for x in pos_ids:
-        delta_mean_x[x] = np.sum(delta_x[x]) / (L * B)
-        # delta_mean_x[x] = np.mean(delta_x[x])
-    
-    # mean Square Error of particular method
-    MSE_m = np.sum(np.square(delta_x)) / (L * B * X)
-    # systematic deviations a.k.a. bias for each position
-    tau_sq_m = np.sum(np.square(delta_mean_x)) / X
-    # stochastic variations / variance
-    for x in pos_ids:
-        sigma_sq_m.append(delta_x[x] - delta_mean_x[x])
-    sigma_sq_m = np.sum(np.square(sigma_sq_m)) / (L * B * X)
-    return MSE_m, tau_sq_m, sigma_sq_m, delta_x, delta_mean_x
+    IDs = np.concatenate([np.asarray(x, dtype=np.int64) for x in part_x])
+    # position index of each ID in order of pos_ids
+    pos = np.repeat(np.arange(len(pos_ids)), [len(x) for x in part_x])
+    b_gen = DataGenerator_raw(IDs, **dict(params, shuffle=False))
+    pred = model_predict_all(model, b_gen, verbose, workers)
+    y = b_gen.get_targets(IDs)
+
+    MSE_m, tau_sq_m, sigma_sq_m, delta, delta_mean = calc_error_decomp(
+        pred, y, groups=pos)
+    delta_x = [delta[pos == i] for i in range(len(pos_ids))]
+    return MSE_m, tau_sq_m, sigma_sq_m, delta_x, delta_mean.values
+
+
+def calc_error_decomp(pred, y, IDs=None, ID_ref=None, by='pos_id',
+                      groups=None, n_frames=100, n_angles=360):
+    """
+    Decompose the wrapped angle error of predictions into mean squared
+    error (MSE), systematic deviations (bias, tau^2) and stochastic
+    variations (variance, sigma^2) for an arbitrary grouping of the
+    samples, e.g. per position, condition, subject or head rotation.
+    All sums are computed with one vectorized grouped reduction. The
+    number of samples per group is derived from the data, so that
+    MSE = tau^2 + sigma^2 holds for groups of equal size.
+
+    Parameters
+    ----------
+    pred : ndarray
+        Predicted localization azimuth per sample.
+    y : ndarray
+        Target localization azimuth per sample.
+    IDs : ndarray, optional
+        Global IDs of the samples. Required if groups is None.
+    ID_ref : pandas DataFrame object, optional
+        DataFrame object containing the global ID reference list.
+        Required if groups is None.
+    by : str or list of str, optional
+        Column(s) of ID_ref to group by. The pseudo-column
+        'head_rotation' groups by angle index. Defaults to 'pos_id'.
+    groups : ndarray, optional
+        Group label per sample. Overrides IDs, ID_ref and by.
+    n_frames : int, optional
+        Number of frames/repititions. Used for 'head_rotation' only.
+    n_angles : int, optional
+        Number of angles. Used for 'head_rotation' only.
+
+    Returns
+    -------
+    MSE : float
+        Mean squared error.
+    tau_sq : float
+        Systematic deviations a.k.a. bias, i.e. mean of squared group
+        means.
+    sigma_sq : float
+        Stochastic variations / variance around the group means.
+    delta : ndarray
+        Angle difference per sample.
+    delta_mean : pandas Series object
+        Mean angle difference per group, indexed by group.
+    """
+    delta = angle_diff_deg(np.ravel(pred), np.ravel(y))
+    if groups is None:
+        groups = get_group_keys(IDs, ID_ref, by, n_frames, n_angles)
+    if isinstance(groups, pd.DataFrame):
+        index = pd.MultiIndex.from_frame(groups)
+        codes, uniques = pd.factorize(index, sort=True)
+        uniques = pd.MultiIndex.from_tuples(uniques, names=index.names)
+    else:
+        codes, uniques = pd.factorize(np.ravel(groups), sort=True)
+
+    n_g = np.bincount(codes)
+    delta_mean = np.bincount(codes, weights=delta) / n_g
+    MSE = np.mean(np.square(delta))
+    tau_sq = np.mean(np.square(delta_mean))
+    sigma_sq = np.mean(np.square(delta - delta_mean[codes]))
+    return MSE, tau_sq, sigma_sq, delta, pd.Series(delta_mean, index=uniques)
+
+
+def get_group_keys(IDs, ID_ref, by, n_frames=100, n_angles=360):
+    """
+    Get group labels of global IDs from the ID reference table. Returns
+    an array for a single column and a DataFrame for a list of columns.
+    The pseudo-column 'head_rotation' is the angle index of the ID.
+    """
+    cols = [by] if isinstance(by, str) else list(by)
+    IDs = np.asarray(IDs, dtype=np.int64)
+    keys = {}
+    for c in cols:
+        if c == 'head_rotation':
+            n_subjects = int(ID_ref['subject_id'].max()
+                             - ID_ref['subject_id'].min() + 1)
+            n_frames = int(np.ravel(n_frames)[0])
+            keys[c] = (IDs // (n_subjects*n_frames)) % int(np.ravel(n_angles)[0])
+        else:
+            keys[c] = get_ref_column(ID_ref, c, IDs)
+    if isinstance(by, str):
+        return keys[by]
+    return pd.DataFrame(keys)
+
+
+def get_ref_column(ID_ref, col, IDs):
+    """
+    Look up column of the ID reference table for global IDs. Uses
+    positional indexing if the table is indexed by contiguous global
+    IDs starting at 0, as is the complete raw database. ID_ref may
+    also be a SubsetIndex.
+    """
+    if isinstance(ID_ref, SubsetIndex):
+        return ID_ref.column(col, IDs)
+    index = ID_ref.index
+    if len(index) and index[0] == 0 and index[-1] == len(index)-1 \
+       and index.is_monotonic_increasing:
+        return ID_ref[col].values[IDs]
+    return ID_ref.loc[IDs, col].values
 
 
 def get_y_gen(b_gen):
     """
-    Gets and returns all targets from data generator.
+    Gets and returns all targets from data generator. Targets of
+    DataGenerator_raw objects are gathered directly without generating
+    the features, other generators are iterated batch by batch.
     """
     
+    if hasattr(b_gen, 'get_targets'):
+        return b_gen.get_targets()
     l = b_gen.__len__()
-    y = np.array([])
-    for b_idx in range(l):
-        _,y_t = b_gen.__getitem__(b_idx)
-        y = np.append(y,y_t)
-    return y
+    y = [b_gen.__getitem__(b_idx)[1] for b_idx in range(l)]
+    return np.concatenate(y) if y else np.array([])
 
 
 def create_test_params(feature_data, target_data, par, batch_size=1024,
-                       shuffle=False):
+                       shuffle=False, dtype=np.float64, scaler=None,
+                       columns=None, column_labels=None):
     """
     Create and return a parameter dict for a DataGenerator object.
+    Feature and target data may be DataFrames or arrays; arrays,
+    including memory-mapped ones from load_raw_npy, are used as they
+    are without copying. An optional scaler (see utils.scaler) is
+    applied to the feature batches on the fly, with its parameters
+    selected by column label. Optionally restrict the features to
+    columns, selected by label, index or feature group (see
+    load_data_raw.get_column_idx); labels of array feature data are
+    given by column_labels.
     """
     
     # check if data is a pandas DataFrame object
     if isinstance(feature_data, pd.DataFrame):
+        column_labels = feature_data.columns.tolist()
         feature_data = feature_data.values
     if isinstance(target_data, pd.DataFrame):
         target_data = target_data.values
+    if columns is not None:
+        columns = get_column_idx(column_labels, columns)
     # create params dict
-    params = {'dim': feature_data.shape[1],
+    params = {'dim': feature_data.shape[1] if columns is None
+                     else len(columns),
               'batch_size': batch_size,
               'feature_data': feature_data,
               'target_data' : target_data,
               'shuffle': shuffle,
               'n_frames': par['nFrames'].values,
-              'n_angles': par['nAngles'].values
+              'n_angles': par['nAngles'].values,
+              'dtype': dtype,
+              'scaler': scaler,
+              'columns': columns,
+              'column_labels': column_labels
              }
     return params
 
@@ -1,11 +1,20 @@
 """
-Convert CSV files to HDF5 files containing pandas DataFrame objects.
+Convert CSV files to HDF5 files containing pandas DataFrame objects or
+to memory-mappable NumPy (.npy) files.
 """
 
+import io
+import json
+import time
 import numpy as np
 import pandas as pd
-from os.path import splitext
+from collections import deque
+from itertools import islice
+from multiprocessing import Pool
+from os import replace
+from os.path import splitext, exists, getsize
 from utils.utils import get_metadata_from_filename
+from utils.manifest import create_manifest, write_manifest
 
 
 def csv2hdf_sep(data_dir, filelist, export_dir):
@@ -49,7 +58,133 @@ def hdf_sep2hdf_single_append(data_dir, filelist, export_dir,
     h5_file.close()
 
 
-def csv_raw2hdf_single(data_dir, export_dir, out_name='database_raw.h5'):
+def imap_bounded(pool, func, iterable, max_pending):
+    """
+    Ordered pool.imap with backpressure. At most max_pending tasks are
+    submitted but not yet consumed, so a slow consumer (e.g. the single
+    HDF5 writer) bounds the number of parsed DataFrames held in memory.
+    """
+    pending = deque()
+    for arg in iterable:
+        if len(pending) >= max_pending:
+            yield pending.popleft().get()
+        pending.append(pool.apply_async(func, (arg,)))
+    while pending:
+        yield pending.popleft().get()
+
+
+def csv2hdf_sep_parallel(data_dir, filelist, export_dir, processes=4,
+                         manifest_name='manifest.json', max_pending=None):
+    """
+    Parallel version of csv2hdf_sep. CSV files are parsed on a process
+    pool and written to seperate HDF5 files by a single writer in
+    sorted filelist order, the order get_ID_list is based on. Writes a
+    manifest with per-file row counts and offsets to export_dir.
+
+    Parameters
+    ----------
+    data_dir : str
+        Directory to load the CSV files from.
+    filelist : list of str
+        List of CSV filenames.
+    export_dir : str
+        Directory to export the HDF5 files and the manifest to.
+    processes : int, optional
+        Number of parsing processes. Defaults to 4.
+    manifest_name : str, optional
+        Filename of the manifest. Defaults to 'manifest.json'.
+    max_pending : int, optional
+        Maximum number of files parsed or being parsed ahead of the
+        writer. Defaults to 2*processes.
+
+    Returns
+    -------
+    manifest : dict
+        Manifest as returned by manifest.create_manifest.
+    """
+    filelist = sorted(filelist)
+    out_list = [splitext(name)[0]+'.h5' for name in filelist]
+    if max_pending is None:
+        max_pending = 2*processes
+    n_rows = []
+    with Pool(processes) as pool:
+        dfs = imap_bounded(pool, pd.read_csv,
+                           [data_dir+name for name in filelist], max_pending)
+        for name, df in zip(out_list, dfs):
+            df.to_hdf(export_dir+name, key='data', mode='w', format='table')
+            n_rows.append(len(df))
+    n_bytes = [getsize(data_dir+name) for name in filelist]
+    manifest = create_manifest(out_list, n_rows, n_bytes)
+    write_manifest(export_dir+manifest_name, manifest)
+    return manifest
+
+
+def hdf_sep2hdf_single_parallel(data_dir, filelist, export_dir,
+                                out_name='database.h5', append=True,
+                                processes=4, manifest_name=None,
+                                max_pending=None):
+    """
+    Parallel version of hdf_sep2hdf_single_append (append=True) and
+    hdf_sep2hdf_single (append=False). Files are read on a process pool
+    and written by a single writer in sorted filelist order, as HDF5
+    appends can not be concurrent. Writes a manifest with per-file row
+    counts and offsets to export_dir.
+
+    Parameters
+    ----------
+    data_dir : str
+        Directory to load the seperate HDF5 files from.
+    filelist : list of str
+        List of HDF5 filenames.
+    export_dir : str
+        Directory to export the HDF5 database and the manifest to.
+    out_name : str, optional
+        Filename of the HDF5 database. Defaults to 'database.h5'.
+    append : bool, optional
+        If True, append all DataFrames to a single table with key
+        'database'. Otherwise store each with individual key.
+        Defaults to True.
+    processes : int, optional
+        Number of reading processes. Defaults to 4.
+    manifest_name : str, optional
+        Filename of the manifest. Defaults to out_name with extension
+        '_manifest.json'.
+    max_pending : int, optional
+        Maximum number of files read or being read ahead of the writer.
+        Defaults to 2*processes.
+
+    Returns
+    -------
+    manifest : dict
+        Manifest as returned by manifest.create_manifest.
+    """
+    filelist = sorted(filelist)
+    if manifest_name is None:
+        manifest_name = splitext(out_name)[0]+'_manifest.json'
+    if max_pending is None:
+        max_pending = 2*processes
+    n_rows = []
+    with Pool(processes) as pool, \
+         pd.HDFStore(export_dir+out_name, mode='a') as h5_file:
+        dfs = imap_bounded(pool, pd.read_hdf,
+                           [data_dir+name for name in filelist], max_pending)
+        for counter, (name, df) in enumerate(zip(filelist, dfs)):
+            if append:
+                print('Appending Table {}'.format(counter+1))
+                df = df.astype({'x':'float64', 'y':'float64'})
+                h5_file.append('database', df)
+            else:
+                m, _, p, _ = get_metadata_from_filename(name)
+                h5_file.put(m+'_'+p, df, format='table')
+            n_rows.append(len(df))
+    n_bytes = [getsize(data_dir+name) for name in filelist]
+    manifest = create_manifest(filelist, n_rows, n_bytes)
+    write_manifest(export_dir+manifest_name, manifest)
+    return manifest
+
+
+def csv_raw2hdf_single(data_dir, export_dir, out_name='database_raw.h5',
+                       feature_dtype=None, target_dtype=None):
     """
     Convert non-redundant (raw) CSV database to singel HDF5 file.
 
@@ -61,29 +196,185 @@ def csv_raw2hdf_single(data_dir, export_dir, out_name='database_raw.h5'):
         Directory to export the HDF5 file to.
     out_names : str, optional
         Filename of the HDF5 database. Defaults to 'database_raw.h5'
+    feature_dtype : dtype, optional
+        Compact dtype to store the features as, see load_csv_raw.
+    target_dtype : dtype, optional
+        Compact dtype to store the targets as, see load_csv_raw.
     """
     # load data
-    f_df, t_df, ID_ref_df, pos_df, cond_df, par_df = load_csv_raw(data_dir)
+    f_df, t_df, ID_ref_df, pos_df, cond_df, par_df = load_csv_raw(
+        data_dir, feature_dtype=feature_dtype, target_dtype=target_dtype)
 
     # write data
-    pos_df.to_hdf(export_dir+out_name, 'position_table', mode='a',
+    pos_df.to_hdf(export_dir+out_name, key='position_table', mode='a',
                   format='table')
-    cond_df.to_hdf(export_dir+out_name, 'condition_table', mode='a',
+    cond_df.to_hdf(export_dir+out_name, key='condition_table', mode='a',
                    format='table')
-    par_df.to_hdf(export_dir+out_name, 'feature_par', mode='a',
+    par_df.to_hdf(export_dir+out_name, key='feature_par', mode='a',
                   format='table')
-    ID_ref_df.to_hdf(export_dir+out_name, 'ID_reference_table', mode='a',
-                     format='table')
-    t_df.to_hdf(export_dir+out_name, 'target_data', mode='a', format='table')
-    f_df.to_hdf(export_dir+out_name, 'feature_data', mode='a', format='table')
+    ID_ref_df.to_hdf(export_dir+out_name, key='ID_reference_table',
+                     mode='a', format='table')
+    t_df.to_hdf(export_dir+out_name, key='target_data', mode='a',
+                format='table')
+    f_df.to_hdf(export_dir+out_name, key='feature_data', mode='a',
+                format='table')
 
 
-def load_csv_raw(data_dir, filelist=None):
+def csv_raw2hdf_stream(data_dir, export_dir, out_name='database_raw.h5',
+                       chunksize=1000000, feature_dtype=np.float64,
+                       target_dtype=np.float64, verbose=True):
+    """
+    Convert non-redundant (raw) CSV database to single HDF5 file like
+    csv_raw2hdf_single, but stream the large tables (ID reference
+    table, target and feature data) in chunks of chunksize rows with
+    explicit dtypes. Peak memory is bounded by the chunk size.
+
+    After each appended chunk, the number of rows and the byte offset
+    in the CSV file are stored in the sidecar file
+    out_name+'.progress.json'. Calling the function again after an
+    interruption resumes from the last completed chunk.
+
+    Parameters
+    ----------
+    data_dir : str
+        Directory to load the CSV database from.
+    export_dir : str
+        Directory to export the HDF5 file to.
+    out_name : str, optional
+        Filename of the HDF5 database. Defaults to 'database_raw.h5'
+    chunksize : int, optional
+        Number of rows read and appended at once. Defaults to 1000000.
+    feature_dtype : dtype, optional
+        Dtype to store the features as. Defaults to np.float64.
+    target_dtype : dtype, optional
+        Dtype to store the targets as. Defaults to np.float64.
+    verbose : bool, optional
+        Print progress and throughput per chunk. Defaults to True.
+
+    Returns
+    -------
+    n_rows : dict
+        Number of rows written per table.
+    """
+    out_file = export_dir+out_name
+    progress_file = out_file+'.progress.json'
+    progress = {}
+    if exists(progress_file):
+        with open(progress_file) as f:
+            progress = json.load(f)
+
+    # small metadata tables are loaded at once
+    with pd.HDFStore(out_file, mode='a') as store:
+        # same dtypes as load_csv_raw
+        for key, index, dtype in [
+                ('position_table', 'pos_id', {'pos_id': np.uint8}),
+                ('condition_table', 'cond_id', {'cond_id': np.uint8}),
+                ('feature_par', None, {'cond_id': np.uint8})]:
+            if '/'+key in store.keys():
+                continue
+            df = pd.read_csv(data_dir+key+'.csv', dtype=dtype)
+            if index:
+                df.set_index(index, drop=True, inplace=True)
+            store.put(key, df, format='table')
+
+    # large tables are streamed
+    ID_dtype = {'global_id': np.uint32, 'pos_id': np.uint8,
+                'cond_id': np.uint8, 'subject_id': np.uint8}
+    tables = [('ID_reference_table', ID_dtype, 'global_id'),
+              ('target_data', target_dtype, None),
+              ('feature_data', feature_dtype, None)]
+    n_rows = {}
+    for key, dtype, index in tables:
+        filename = data_dir+key+'.csv'
+        state = progress.get(key, {'rows': 0, 'offset': None})
+        with pd.HDFStore(out_file, mode='a') as store:
+            stored = store.get_storer(key).nrows if '/'+key in store.keys() \
+                     else 0
+            # drop rows appended after the last recorded chunk
+            if stored > state['rows']:
+                store.remove(key, start=state['rows'], stop=stored)
+            elif stored < state['rows']:
+                raise RuntimeError('Progress file {} does not match {}.'
+                                   .format(progress_file, out_file))
+
+            n_bytes = float(max(1, getsize(filename)))
+            t0 = time.time()
+            rows0 = state['rows']
+            for df, offset in _csv_chunks(filename, chunksize,
+                                          state['offset'], dtype):
+                if index:
+                    df.set_index(index, drop=True, inplace=True)
+                else:
+                    # continue the RangeIndex of csv_raw2hdf_single
+                    df.index = pd.RangeIndex(state['rows'],
+                                             state['rows']+len(df))
+                store.append(key, df, format='table')
+                store.flush()
+                state = {'rows': state['rows']+len(df), 'offset': offset}
+                progress[key] = state
+                _write_progress(progress_file, progress)
+                if verbose:
+                    rate = (state['rows']-rows0) / max(time.time()-t0, 1e-9)
+                    print('{}: {} rows ({:.1f}%), {:.0f} rows/s'.format(
+                        key, state['rows'], 100*offset/n_bytes, rate))
+        n_rows[key] = state['rows']
+    return n_rows
+
+
+def _write_progress(progress_file, progress):
+    """
+    Write the progress sidecar atomically, so an interruption while
+    writing leaves the previous progress in place.
+    """
+    tmp_file = progress_file+'.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(progress, f)
+    replace(tmp_file, progress_file)
+
+
+def _csv_chunks(filename, chunksize, offset=None, dtype=None):
+    """
+    Read CSV file in chunks of chunksize rows, starting at the byte
+    offset of a data row (or after the header if offset is None).
+    Yields each chunk as DataFrame together with the byte offset of the
+    row following it. Compact dtypes are parsed as float64 and cast
+    afterwards like in _read_csv_compact, see cast_compact.
+    """
+    parse_dtype = dtype
+    if dtype is not None and not isinstance(dtype, dict):
+        parse_dtype = np.float64
+    with open(filename, 'rb') as f:
+        header = f.readline()
+        names = header.decode().strip().split(',')
+        if offset is not None:
+            f.seek(offset)
+        offset = f.tell()
+        while True:
+            lines = list(islice(f, chunksize))
+            if not lines:
+                break
+            data = b''.join(lines)
+            offset += len(data)
+            df = pd.read_csv(io.BytesIO(data), header=None, names=names,
+                             dtype=parse_dtype)
+            if parse_dtype is not dtype:
+                df = cast_compact(df, dtype)
+            yield df, offset
+
+
+def load_csv_raw(data_dir, filelist=None, feature_dtype=None,
+                 target_dtype=None):
     """
     Load non-redundant (raw) CSV database from specified directory.
     Returns feature data. target data, global id reference list,
     position reference list, condition reference list and
     additional parameter list seperately.
+
+    Feature and target data are float64 by default. Optionally they
+    are kept in a compact dtype, e.g. feature_dtype=np.float32 or
+    np.float16 and target_dtype=np.float16 or np.int16 (angles rounded
+    to full degrees). Use check_dtype_precision to quantify the error
+    with respect to float64.
     """
     # load metadata
     pos_table = pd.read_csv(data_dir+'position_table.csv',
@@ -99,6 +390,214 @@ def load_csv_raw(data_dir, filelist=None):
                                       'subject_id':np.uint8})
     ID_ref_table.set_index('global_id', drop=True, inplace=True)
     # load data
-    target_data = pd.read_csv(data_dir+'target_data.csv')
-    feature_data = pd.read_csv(data_dir+'feature_data.csv')
+    target_data = _read_csv_compact(data_dir+'target_data.csv', target_dtype)
+    feature_data = _read_csv_compact(data_dir+'feature_data.csv',
+                                     feature_dtype)
     return feature_data, target_data, ID_ref_table, pos_table, cond_table, par
+
+
+def _read_csv_compact(filename, dtype=None, chunksize=100000):
+    """
+    Read numeric CSV table. With a compact dtype, the table is parsed
+    in chunks of chunksize rows, each cast with cast_compact, so only
+    one chunk is held in float64 and the values equal a cast of the
+    float64 table (see check_dtype_precision).
+    """
+    if dtype is None:
+        return pd.read_csv(filename)
+    chunks = [cast_compact(chunk, dtype) for chunk in
+              pd.read_csv(filename, dtype=np.float64, chunksize=chunksize)]
+    return pd.concat(chunks, ignore_index=True)
+
+
+def cast_compact(data, dtype):
+    """
+    Cast DataFrame or array to a compact dtype. Values are rounded to
+    the nearest integer if dtype is an integer type. Raises ValueError
+    if a value is not representable in an integer dtype, e.g. negative
+    angles in an unsigned dtype, instead of silently wrapping around.
+    """
+    if dtype is None:
+        return data
+    dtype = np.dtype(dtype)
+    if dtype.kind in 'iu':
+        data = np.rint(data)
+        values = np.asarray(data)
+        if values.size:
+            info = np.iinfo(dtype)
+            if not np.all(np.isfinite(values)) or values.min() < info.min \
+               or values.max() > info.max:
+                raise ValueError('Values not representable as {}, range '
+                                 '[{}, {}].'.format(dtype, info.min,
+                                                    info.max))
+    return data.astype(dtype)
+
+
+def check_dtype_precision(feature_data, target_data, feature_dtype=np.float32,
+                          target_dtype=np.float16):
+    """
+    Compare a compact representation of the raw database with the
+    float64 one. Returns the maximum absolute error of features and
+    targets when cast to feature_dtype and target_dtype, respectively.
+
+    For features min-max scaled to [-1, 1], float32 has a maximum error
+    of about 3e-8 and float16 of about 2.5e-4. For azimuths within
+    [-180, 180] degrees, float16 has a maximum error of 0.0625 degrees
+    and int16 of 0.5 degrees (zero if all targets are full degrees).
+
+    Parameters
+    ----------
+    feature_data : pandas DataFrame object or ndarray
+        Feature data in float64.
+    target_data : pandas DataFrame object or ndarray
+        Target data in float64.
+    feature_dtype : dtype, optional
+        Compact feature dtype. Defaults to np.float32.
+    target_dtype : dtype, optional
+        Compact target dtype. Defaults to np.float16.
+
+    Returns
+    -------
+    f_err : float
+        Maximum absolute feature error.
+    t_err : float
+        Maximum absolute target error in degrees.
+    """
+    f_err = _max_abs_cast_error(np.asarray(feature_data), feature_dtype)
+    t_err = _max_abs_cast_error(np.asarray(target_data), target_dtype)
+    return f_err, t_err
+
+
+def _max_abs_cast_error(data, dtype, chunksize=1000000):
+    """Maximum absolute error of casting data to dtype, in row chunks."""
+    err = 0.0
+    for start in range(0, data.shape[0], chunksize):
+        chunk = np.asarray(data[start:start+chunksize], dtype=np.float64)
+        diff = cast_compact(chunk, dtype).astype(np.float64) - chunk
+        if diff.size:
+            err = max(err, float(np.max(np.abs(diff))))
+    return err
+
+
+def csv_raw2npy(data_dir, export_dir, feature_dtype=None, target_dtype=None):
+    """
+    Convert non-redundant (raw) CSV database to memory-mappable .npy
+    files. See raw2npy for the files written.
+
+    Parameters
+    ----------
+    data_dir : str
+        Directory to load the CSV database from.
+    export_dir : str
+        Directory to export the .npy files to.
+    feature_dtype : dtype, optional
+        Compact dtype to store the features as, see load_csv_raw.
+    target_dtype : dtype, optional
+        Compact dtype to store the targets as, see load_csv_raw.
+    """
+    raw2npy(*load_csv_raw(data_dir, feature_dtype=feature_dtype,
+                          target_dtype=target_dtype), export_dir)
+
+
+def hdf_raw2npy(filename, export_dir, key_f='feature_data',
+                key_t='target_data', key_ID='ID_reference_table',
+                key_p='position_table', key_c='condition_table',
+                key_fp='feature_par', feature_dtype=None, target_dtype=None):
+    """
+    Convert non-redundant (raw) HDF5 database to memory-mappable .npy
+    files. See raw2npy for the files written.
+
+    Parameters
+    ----------
+    filename : str
+        Name of the HDF5 file containing the raw database.
+    export_dir : str
+        Directory to export the .npy files to.
+    key_* : str, optional
+        Keys identifying the tables in the HDF5 file.
+    feature_dtype : dtype, optional
+        Compact dtype to store the features as, see load_csv_raw.
+    target_dtype : dtype, optional
+        Compact dtype to store the targets as, see load_csv_raw.
+    """
+    tables = [pd.read_hdf(filename, key=k) for k in
+              [key_f, key_t, key_ID, key_p, key_c, key_fp]]
+    raw2npy(*tables, export_dir, feature_dtype=feature_dtype,
+            target_dtype=target_dtype)
+
+
+def raw2npy(f_df, t_df, ID_ref_df, pos_df, cond_df, par_df, export_dir,
+            chunksize=1000000, feature_dtype=None, target_dtype=None):
+    """
+    Write non-redundant (raw) database to export_dir. Feature and target
+    data are written as contiguous (C-ordered) two-dimensional arrays to
+    'feature_data.npy' and 'target_data.npy', the ID reference table as
+    structured array with fields global_id, pos_id, cond_id and
+    subject_id to 'ID_reference_table.npy'. The small metadata tables
+    are written as CSV files and the column labels to 'columns.json'.
+
+    Parameters
+    ----------
+    f_df : pandas DataFrame object
+        DataFrame containing all features.
+    t_df : pandas DataFrame object
+        DataFrame containing all targets.
+    ID_ref_df : pandas DataFrame object
+        DataFrame containing ID reference table.
+    pos_df : pandas DataFrame object
+        DataFrame containing position table.
+    cond_df : pandas DataFrame object
+        DataFrame containing condition table.
+    par_df : pandas DataFrame object
+        DataFrame containing feature parameter data.
+    export_dir : str
+        Directory to export the files to.
+    chunksize : int, optional
+        Number of rows copied at once. Defaults to 1000000.
+    feature_dtype : dtype, optional
+        Compact dtype to store the features as. Defaults to the dtype
+        of f_df.
+    target_dtype : dtype, optional
+        Compact dtype to store the targets as. Defaults to the dtype
+        of t_df.
+    """
+    _write_npy(export_dir+'feature_data.npy', f_df, dtype=feature_dtype,
+               chunksize=chunksize)
+    _write_npy(export_dir+'target_data.npy', t_df, dtype=target_dtype,
+               chunksize=chunksize)
+
+    # ID reference table as structured array
+    ID_dtype = np.dtype([('global_id', np.uint32), ('pos_id', np.uint8),
+                         ('cond_id', np.uint8), ('subject_id', np.uint8)])
+    ID_ref = np.lib.format.open_memmap(export_dir+'ID_reference_table.npy',
+                                       mode='w+', dtype=ID_dtype,
+                                       shape=(len(ID_ref_df),))
+    ID_ref['global_id'] = ID_ref_df.index.values
+    for name in ID_dtype.names[1:]:
+        ID_ref[name] = ID_ref_df[name].values
+    ID_ref.flush()
+    del ID_ref
+
+    # small metadata tables
+    pos_df.to_csv(export_dir+'position_table.csv')
+    cond_df.to_csv(export_dir+'condition_table.csv')
+    par_df.to_csv(export_dir+'feature_par.csv', index=False)
+    with open(export_dir+'columns.json', 'w') as f:
+        json.dump({'feature_data': f_df.columns.tolist(),
+                   'target_data': t_df.columns.tolist()}, f)
+
+
+def _write_npy(filename, df, dtype=None, chunksize=1000000):
+    """
+    Write DataFrame values to a C-ordered .npy file in row chunks,
+    avoiding a full contiguous copy of the data in memory.
+    """
+    if dtype is None:
+        dtype = np.result_type(*df.dtypes)
+    out = np.lib.format.open_memmap(filename, mode='w+', dtype=dtype,
+                                    shape=df.shape)
+    for start in range(0, df.shape[0], chunksize):
+        out[start:start+chunksize] = cast_compact(
+            df.iloc[start:start+chunksize].values, dtype)
+    out.flush()
+    del out
@@ -0,0 +1,99 @@
+"""
+A python module that provides a pool of open HDF5 file handles for the
+data generators of the redundant database.
+"""
+
+import os
+import pandas as pd
+from collections import OrderedDict
+
+
+class HDFStorePool(object):
+    """
+    Least recently used (LRU) pool of open pandas HDFStore handles,
+    keyed by file path. Avoids opening the file and parsing its metadata
+    on every read. The pool is fork-safe: handles are only used by the
+    process that opened them, any other process (e.g. a Keras
+    multiprocessing worker) opens its own.
+
+    Attributes
+    ----------
+    max_open : int, optional
+        Maximum number of open files. Defaults to 32.
+    mode : str, optional
+        Mode to open the files in. Defaults to 'r'.
+    hits : int
+        Number of reads served by an open handle.
+    misses : int
+        Number of reads that had to open the file.
+    evictions : int
+        Number of handles closed to stay within max_open.
+    """
+    def __init__(self, max_open=32, mode='r'):
+        """Initialization."""
+        self.max_open = max_open
+        self.mode = mode
+        self._reset()
+
+    def _reset(self):
+        """Forget all handles and counters, e.g. after a fork."""
+        self._pid = os.getpid()
+        self._stores = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, path):
+        """
+        Return open HDFStore for path and mark it as most recently used.
+        """
+        if self._pid != os.getpid():
+            # inherited handles belong to the parent process
+            self._reset()
+        store = self._stores.get(path)
+        if store is not None:
+            self._stores.move_to_end(path)
+            self.hits += 1
+            return store
+        self.misses += 1
+        while len(self._stores) >= self.max_open:
+            _, old = self._stores.popitem(last=False)
+            old.close()
+            self.evictions += 1
+        store = pd.HDFStore(path, mode=self.mode)
+        self._stores[path] = store
+        return store
+
+    def select(self, path, key=None, **kwargs):
+        """
+        Read from HDF5 file like pandas.read_hdf, using an open handle.
+        If key is None, the file must contain exactly one key.
+        """
+        store = self.get(path)
+        if key is None:
+            keys = store.keys()
+            if len(keys) != 1:
+                raise ValueError('key must be provided for HDF5 files '
+                                 'containing multiple keys.')
+            key = keys[0]
+        return store.select(key, **kwargs)
+
+    def stats(self):
+        """Return dict of hit, miss and eviction counters."""
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'open': len(self._stores)}
+
+    def close(self):
+        """Close all handles opened by this process."""
+        if self._pid == os.getpid():
+            for store in self._stores.values():
+                store.close()
+        self._stores = OrderedDict()
+
+    def __getstate__(self):
+        """Pickle settings only; handles are reopened on demand."""
+        return {'max_open': self.max_open, 'mode': self.mode}
+
+    def __setstate__(self, state):
+        """Restore settings with an empty pool."""
+        self.__init__(**state)
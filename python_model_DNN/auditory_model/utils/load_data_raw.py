@@ -2,9 +2,12 @@
 A python module that provides functions and classes to load data for training.
 """
 
+import os
+import json
 import numpy as np
 import pandas as pd
 from keras.utils import Sequence
+from utils.file_conversion import cast_compact
 
 
 class DataGenerator_raw(Sequence):
@@ -33,9 +36,42 @@ class DataGenerator_raw(Sequence):
         Number of frames/repititions in feature computation.
     n_angles : int, optional
         Number of angles. Defaults to 360.
+    vectorized : bool, optional
+        If True, assemble each batch with integer index arithmetic and
+        a single fancy-index gather for features and targets instead of
+        a per-sample loop. Both paths return identical batches.
+        Defaults to True.
+    dtype : dtype, optional
+        Data type of the generated batches. Use np.float32 together
+        with compact feature and target data to avoid upcasting.
+        Defaults to np.float64.
+    dedup : bool, optional
+        If True, emit each unique feature row of list_IDs once together
+        with the targets of all subjects, y : (n_samples, n_subjects).
+        Targets of subjects whose IDs are not in list_IDs are NaN. Use
+        with the multi-target losses of custom_loss, e.g.
+        mae_wrap_angle_multi. Batches then hold batch_size feature
+        rows. Defaults to False.
+    scaler : StreamingScaler object, optional
+        Fitted scaler (see utils.scaler) applied to each feature batch
+        after the gather, so the unscaled database can be used for
+        scaled models. Defaults to None, i.e. no scaling.
+    columns : array_like of int, optional
+        Indices of the feature columns to use, e.g. as returned by
+        get_column_idx. Batches are gathered from these columns of
+        feature_data only, without copying the feature matrix. Defaults
+        to None, i.e. all columns.
+    column_labels : list of str, optional
+        Column labels of feature_data. If given, the scaler parameters
+        of the batch columns are selected by label, and a scaler
+        lacking any of them raises a KeyError. Otherwise, the scaler
+        must cover either all columns of feature_data or exactly the
+        selected columns. Defaults to None.
     """
     def __init__(self, list_IDs, feature_data, target_data, batch_size=32,
-                 dim=96, shuffle=True, n_frames=100, n_angles=360):
+                 dim=96, shuffle=True, n_frames=100, n_angles=360,
+                 vectorized=True, dtype=np.float64, dedup=False,
+                 scaler=None, columns=None, column_labels=None):
         """Initialization."""
         self.list_IDs = list_IDs
         self.feature_data = feature_data
@@ -46,11 +82,58 @@ class DataGenerator_raw(Sequence):
         self.n_subjects = target_data.shape[1]
         self.n_frames = n_frames
         self.n_angles = n_angles
+        self.vectorized = vectorized
+        self.dtype = dtype
+        self.columns = None
+        if columns is not None:
+            self.columns = np.asarray(columns, dtype=np.int64)
+            self.dim = len(self.columns)
+        self.scaler = None
+        if scaler is not None:
+            self.scaler = self.__select_scaler(scaler, column_labels)
+        # integer copies of the ID list and of the ID layout for the
+        # vectorized batch path; n_frames may be passed as a length-1
+        # array, e.g. par['nFrames'].values
+        self.IDs = np.asarray(list_IDs, dtype=np.int64)
+        self.n_rows_target = self.n_subjects * int(np.ravel(n_frames)[0])
+        self.dedup = dedup
+        self.n_samples = len(self.list_IDs)
+        if dedup:
+            self.__init_dedup()
         self.on_epoch_end() #trigger once at beginning
 
+    def __init_dedup(self):
+        """Find unique feature rows and the subjects present per row."""
+        feature_idx, subject_idx = np.divmod(self.IDs, self.n_subjects)
+        self.feature_rows, inv = np.unique(feature_idx, return_inverse=True)
+        self.n_samples = len(self.feature_rows)
+        self.subject_mask = np.zeros((self.n_samples, self.n_subjects),
+                                     dtype=bool)
+        self.subject_mask[inv, subject_idx] = True
+        if self.subject_mask.all():
+            # all subjects present, no masking required
+            self.subject_mask = None
+
+    def __select_scaler(self, scaler, column_labels):
+        """Reduce scaler to the batch columns, by label if known."""
+        if column_labels is not None and scaler.columns is not None:
+            labels = list(column_labels)
+            if self.columns is not None:
+                labels = [labels[i] for i in self.columns]
+            if scaler.columns == labels:
+                return scaler
+            return scaler.subset(get_column_idx(scaler.columns, labels))
+        n_scaler = len(scaler.scale)
+        if self.columns is not None and n_scaler == self.feature_data.shape[1]:
+            return scaler.subset(self.columns)
+        if n_scaler == self.dim:
+            return scaler
+        raise ValueError('Scaler of {} features does not match {} feature '
+                         'columns.'.format(n_scaler, self.dim))
+
     def __len__(self):
         """Denotes the number of batches per epoch."""
-        return int(np.floor(len(self.list_IDs) / self.batch_size))
+        return int(np.floor(self.n_samples / self.batch_size))
 
     def __getitem__(self, index):
         """Generate one batch of data."""
@@ -58,27 +141,126 @@ class DataGenerator_raw(Sequence):
         indexes = self.indexes[index*self.batch_size:(index+1)
                                *self.batch_size]
 
-        # Find list of IDs
-        list_IDs_temp = [self.list_IDs[k] for k in indexes]
-
         # Generate data
-        X, y = self.__data_generation(list_IDs_temp)
+        if self.dedup:
+            X, y = self.__data_generation_dedup(indexes)
+        elif self.vectorized:
+            X, y = self.__data_generation_vec(self.IDs[indexes])
+        else:
+            # Find list of IDs
+            list_IDs_temp = [self.list_IDs[k] for k in indexes]
+            X, y = self.__data_generation(list_IDs_temp)
         return X, y
 
     def on_epoch_end(self):
         """Updates indexes after each epoch."""
-        self.indexes = np.arange(len(self.list_IDs))
+        self.indexes = np.arange(self.n_samples)
         if self.shuffle == True:
             np.random.shuffle(self.indexes)
 
+    def get_data(self, IDs):
+        """
+        Generate features and targets for arbitrary global IDs, e.g. the
+        remainder of IDs not covered by full batches.
+        """
+        return self.__data_generation_vec(np.asarray(IDs, dtype=np.int64))
+
+    def get_targets(self, list_IDs=None):
+        """
+        Get targets by a direct gather from target_data without
+        generating the features.
+
+        Parameters
+        ----------
+        list_IDs : array_like of int, optional
+            Global IDs to get the targets for. If None, return the
+            targets of the batches served in the current epoch, i.e.
+            floor(len(list_IDs)/batch_size) batches in index order,
+            aligned with the output of predict_generator.
+
+        Returns
+        -------
+        y : ndarray
+            One-dimensional array of targets. In dedup mode without
+            list_IDs, two-dimensional array of targets per feature row
+            and subject.
+        """
+        if list_IDs is None and self.dedup:
+            n = len(self) * self.batch_size
+            return self.__data_generation_dedup(self.indexes[:n],
+                                                features=False)[1]
+        if list_IDs is None:
+            n = len(self) * self.batch_size
+            IDs = self.IDs[self.indexes[:n]]
+        else:
+            IDs = np.asarray(list_IDs, dtype=np.int64)
+        _, target_idx, subject_idx = self.get_data_idx(IDs)
+        return np.asarray(self.target_data[target_idx, subject_idx],
+                          dtype=self.dtype)
+
+    def get_data_idx(self, IDs):
+        """
+        Map global IDs to feature row, target row and subject column
+        indices of the non-redundant (raw) database.
+
+        Parameters
+        ----------
+        IDs : ndarray of int
+            Array of global IDs or sample IDs.
+
+        Returns
+        -------
+        feature_idx : ndarray of int
+            Row indices into feature_data.
+        target_idx : ndarray of int
+            Row indices into target_data.
+        subject_idx : ndarray of int
+            Column indices into target_data.
+        """
+        # one feature row for all 20 subjects 0...19 -> f=0
+        feature_idx, subject_idx = np.divmod(IDs, self.n_subjects)
+        # one target row for 100 frames for each subject 0...1999 -> t=0
+        target_idx = IDs // self.n_rows_target
+        return feature_idx, target_idx, subject_idx
+
+    def __data_generation_vec(self, IDs_temp):
+        """
+        Generates data containing batch_size samples with one gather
+        for features and one for targets.
+        X : (n_samples, dim)
+        """
+        feature_idx, target_idx, subject_idx = self.get_data_idx(IDs_temp)
+        X = np.asarray(self.__gather(feature_idx), dtype=self.dtype)
+        y = np.asarray(self.target_data[target_idx, subject_idx],
+                       dtype=self.dtype)
+        return self.__scale(X), y
+
+    def __data_generation_dedup(self, indexes, features=True):
+        """
+        Generates data containing batch_size unique feature rows and the
+        targets of all subjects
+        X : (n_samples, dim)
+        y : (n_samples, n_subjects)
+        """
+        rows = self.feature_rows[indexes]
+        X = None
+        if features:
+            X = self.__scale(np.asarray(self.__gather(rows),
+                                        dtype=self.dtype))
+        target_idx = rows // (self.n_rows_target // self.n_subjects)
+        y = np.array(self.target_data[target_idx], dtype=self.dtype)
+        if self.subject_mask is not None:
+            y[~self.subject_mask[indexes]] = np.nan
+        return X, y
+
     def __data_generation(self, list_IDs_temp):
         """
         Generates data containing batch_size samples
         X : (n_samples, dim)
         """
         # Initialization
-        X = np.empty((self.batch_size, self.dim))
-        y = np.empty((self.batch_size))
+        X = np.empty((self.batch_size, self.dim), dtype=self.dtype)
+        y = np.empty((self.batch_size), dtype=self.dtype)
         # Generate data
         for i, ID in enumerate(list_IDs_temp):
             # one feature row for all 20 subjects 0...19 -> f=0
@@ -88,17 +270,208 @@ class DataGenerator_raw(Sequence):
             subject_idx = ID - feature_idx*self.n_subjects 
            
             # Store sample
-            X[i,] = self.feature_data[int(feature_idx)]
+            X[i,] = self.__gather(int(feature_idx))
 
             # Store targets
             y[i] = self.target_data[int(target_idx),int(subject_idx)]
-        return X, y
+        return self.__scale(X), y
+
+    def __gather(self, rows):
+        """Gather feature rows, restricted to the selected columns."""
+        if self.columns is None:
+            return self.feature_data[rows]
+        if np.ndim(rows) == 0:
+            return self.feature_data[rows][self.columns]
+        return self.feature_data[np.ix_(rows, self.columns)]
+
+    def __scale(self, X):
+        """Scale gathered feature batch X in place, if a scaler is set."""
+        if self.scaler is None:
+            return X
+        return self.scaler.transform(X, copy=False)
+
+
+class RawDatabase(object):
+    """
+    Lazy handle of a non-redundant (raw) database in a single HDF5 file.
+    The file is opened once and each table is read on first access of
+    the corresponding attribute and cached, so e.g. split-only or
+    eval-only jobs read the small metadata tables only. Row ranges and
+    column subsets of the feature and target data can be read without
+    loading the complete tables. The handle is fork-safe and picklable
+    like utils.hdf_pool.HDFStorePool.
+
+    Attributes
+    ----------
+    filename : str
+        Name of a HDF5 file containing the data.
+    keys : dict, optional
+        Keys of the tables in the HDF5 file by attribute name, e.g.
+        {'feature_data': 'feature_data'}. Missing entries use the
+        default keys, i.e. the attribute names.
+    feature_dtype : dtype, optional
+        Data type to cast the features to. Defaults to stored dtype.
+    target_dtype : dtype, optional
+        Data type to cast the targets to. Defaults to stored dtype.
+    feature_data, target_data, ID_reference_table, position_table,
+    condition_table, feature_par : pandas DataFrame object
+        Lazily loaded and cached tables.
+    """
+    TABLES = ['feature_data', 'target_data', 'ID_reference_table',
+              'position_table', 'condition_table', 'feature_par']
+
+    def __init__(self, filename, keys=None, feature_dtype=None,
+                 target_dtype=None):
+        """Initialization."""
+        self.filename = filename
+        self.keys = {name: name for name in self.TABLES}
+        if keys is not None:
+            self.keys.update(keys)
+        self.feature_dtype = feature_dtype
+        self.target_dtype = target_dtype
+        self._cache = {}
+        self._store = None
+        self._pid = None
+
+    @property
+    def store(self):
+        """Open HDFStore of this process."""
+        if self._store is None or self._pid != os.getpid():
+            # inherited handles belong to the parent process
+            self._store = pd.HDFStore(self.filename, mode='r')
+            self._pid = os.getpid()
+        return self._store
+
+    def get(self, name):
+        """Return table name, reading it on first access."""
+        if name not in self._cache:
+            df = self.store.select(self.keys[name])
+            self._cache[name] = self._cast(name, df)
+        return self._cache[name]
+
+    feature_data = property(lambda self: self.get('feature_data'))
+    target_data = property(lambda self: self.get('target_data'))
+    ID_reference_table = property(
+        lambda self: self.get('ID_reference_table'))
+    position_table = property(lambda self: self.get('position_table'))
+    condition_table = property(lambda self: self.get('condition_table'))
+    feature_par = property(lambda self: self.get('feature_par'))
+
+    def is_loaded(self, name):
+        """Return True if table name is cached."""
+        return name in self._cache
+
+    def n_rows(self, name='feature_data'):
+        """Number of rows of table name, read from the file metadata."""
+        if name in self._cache:
+            return len(self._cache[name])
+        return self.store.get_storer(self.keys[name]).nrows
+
+    def columns(self, name='feature_data'):
+        """Column labels of table name, read from its first row."""
+        if name in self._cache:
+            return self._cache[name].columns.tolist()
+        return self.store.select(self.keys[name], start=0,
+                                 stop=1).columns.tolist()
+
+    def select(self, name, start=None, stop=None, columns=None):
+        """
+        Read rows start:stop and optionally a subset of the columns of
+        table name. Served from the cache if the table is loaded.
+
+        Parameters
+        ----------
+        name : str
+            Table name, e.g. 'feature_data'.
+        start, stop : int, optional
+            Row range to read. Defaults to all rows.
+        columns : str, int or list, optional
+            Columns to read by label, index or feature group, see
+            get_column_idx. Only rows start:stop are read from disk, but
+            with all their columns, see load_raw_ft_h5. Defaults to
+            None, i.e. all columns.
 
+        Returns
+        -------
+        df : pandas DataFrame object
+            Selected rows and columns.
+        """
+        labels = None
+        if columns is not None:
+            all_labels = self.columns(name)
+            labels = [all_labels[i]
+                      for i in get_column_idx(all_labels, columns)]
+        if name in self._cache:
+            df = self._cache[name].iloc[start:stop]
+            return df if labels is None else df[labels]
+        df = self.store.select(self.keys[name], start=start, stop=stop,
+                               columns=labels)
+        return self._cast(name, df)
+
+    def load_ft(self):
+        """Return features, targets and feature column labels."""
+        return (self.feature_data, self.target_data,
+                self.feature_data.columns.tolist())
+
+    def load_IDs(self):
+        """Return ID reference, position, condition and parameter tables."""
+        return (self.ID_reference_table, self.position_table,
+                self.condition_table, self.feature_par)
+
+    def clear(self, name=None):
+        """Drop table name or all tables from the cache."""
+        if name is None:
+            self._cache = {}
+        else:
+            self._cache.pop(name, None)
+
+    def close(self):
+        """Close the file handle of this process and clear the cache."""
+        if self._store is not None and self._pid == os.getpid():
+            self._store.close()
+        self._store = None
+        self.clear()
+
+    def __enter__(self):
+        return self
 
-def load_raw_ft_h5(filename, key_f='feature_data', key_t='target_data'):
+    def __exit__(self, *args):
+        self.close()
+
+    def __getstate__(self):
+        """Pickle settings only; the file is reopened on demand."""
+        return {'filename': self.filename, 'keys': self.keys,
+                'feature_dtype': self.feature_dtype,
+                'target_dtype': self.target_dtype}
+
+    def __setstate__(self, state):
+        """Restore settings with an empty cache."""
+        self.__init__(**state)
+
+    def _cast(self, name, df):
+        """Cast features and targets to the compact dtypes, if set."""
+        if name == 'feature_data':
+            return cast_compact(df, self.feature_dtype)
+        if name == 'target_data':
+            return cast_compact(df, self.target_dtype)
+        return df
+
+
+def load_raw_ft_h5(filename, key_f='feature_data', key_t='target_data',
+                   feature_dtype=None, target_dtype=None, columns=None,
+                   chunksize=1000000):
     """
     Load raw feature and target data from single HDF5 file specified by
-    filename and key. If no keys provided, use default keys.
+    filename and key. If no keys provided, use default keys. Optionally
+    cast the data to a compact dtype, e.g. np.float32 for features and
+    np.float16 for targets, see file_conversion.check_dtype_precision.
+    Optionally load a subset of the feature columns only; the feature
+    table is then read in chunks and reduced to the selected columns
+    chunk by chunk, so the full feature matrix is never held in memory.
+    The saving is memory, not I/O: the feature table is written without
+    data_columns, so all features of a row are stored in one block and
+    every chunk is read from disk with all its columns. Storing data
+    columns would not change that, as table rows are stored as records.
     
     Parameters
     ----------
@@ -108,18 +481,40 @@ def load_raw_ft_h5(filename, key_f='feature_data', key_t='target_data'):
         Key identifying the feature data in HDF5 file.
     key_t : str, optional
         Key identifying the target data in HDF5 file.
+    feature_dtype : dtype, optional
+        Data type to cast the features to. Defaults to stored dtype.
+    target_dtype : dtype, optional
+        Data type to cast the targets to. Defaults to stored dtype.
+    columns : str, int or list, optional
+        Feature columns to load by label, index or feature group, see
+        get_column_idx. Full rows are still read from disk. Defaults to
+        None, i.e. all columns.
+    chunksize : int, optional
+        Number of rows per chunk when loading a subset of the columns,
+        i.e. the peak number of full rows in memory. Defaults to
+        1000000.
         
     Returns
     -------
     feature_df : pandas DataFrame object
-        DataFrame containing all features.
+        DataFrame containing the (selected) features.
     target_df : pandas DataFrame object
         DataFrame containing all targets.
     f_column_labels : list of strings
         Column labels of feature DataFrame.
     """
-    feature_df = pd.read_hdf(filename, key=key_f)
+    if columns is None:
+        feature_df = cast_compact(pd.read_hdf(filename, key=key_f),
+                                  feature_dtype)
+    else:
+        with pd.HDFStore(filename, mode='r') as store:
+            labels = store.select(key_f, start=0, stop=1).columns.tolist()
+            labels = [labels[i] for i in get_column_idx(labels, columns)]
+            feature_df = pd.concat(
+                [cast_compact(chunk, feature_dtype) for chunk in
+                 store.select(key_f, columns=labels, chunksize=chunksize)])
     target_df = pd.read_hdf(filename, key=key_t)
+    target_df = cast_compact(target_df, target_dtype)
     f_column_labels = feature_df.columns.tolist()
     return feature_df, target_df, f_column_labels
 
@@ -164,10 +559,11 @@ def load_raw_IDs_h5(filename, key_ID='ID_reference_table',
 
 
 def load_raw_all_h5(filename, key_f=None, key_t=None, key_ID=None, key_p=None,
-                    key_c=None, key_fp=None):
+                    key_c=None, key_fp=None, columns=None):
     """
     Load complete raw data from single HDF5 file specified by filename
-    and key. If no keys provided, use default keys.
+    and key. If no keys provided, use default keys. To load only some
+    of the tables, use RawDatabase.
     
     Parameters
     ----------
@@ -185,11 +581,14 @@ def load_raw_all_h5(filename, key_f=None, key_t=None, key_ID=None, key_p=None,
         Key identifying the condition reference table in HDF5 file.
     key_fp : str, optional
         Key identifying the feature parameter data in HDF5 file.
+    columns : str, int or list, optional
+        Feature columns to load by label, index or feature group, see
+        get_column_idx. Defaults to None, i.e. all columns.
         
     Returns
     -------
     feature_df : pandas DataFrame object
-        DataFrame containing all features.
+        DataFrame containing the (selected) features.
     target_df : pandas DataFrame object
         DataFrame containing all targets.
     ID_ref_df : pandas DataFrame object
@@ -202,6 +601,124 @@ def load_raw_all_h5(filename, key_f=None, key_t=None, key_ID=None, key_p=None,
         DataFrame containing feature parameter data.
     """
 
-    feature_df, target_df, _ = load_raw_ft_h5(filename)
-    ID_ref_df, pos_table_df, cond_table_df, par_df = load_raw_IDs_h5(filename)
-    return feature_df, target_df, ID_ref_df, pos_table_df, cond_table_df, par_df
\ No newline at end of file
+    keys_ft = {k: v for k, v in [('key_f', key_f), ('key_t', key_t)]
+               if v is not None}
+    keys_ID = {k: v for k, v in [('key_ID', key_ID), ('key_p', key_p),
+                                 ('key_c', key_c), ('key_fp', key_fp)]
+               if v is not None}
+    feature_df, target_df, _ = load_raw_ft_h5(filename, columns=columns,
+                                              **keys_ft)
+    ID_ref_df, pos_table_df, cond_table_df, par_df = load_raw_IDs_h5(filename,
+                                                                     **keys_ID)
+    return feature_df, target_df, ID_ref_df, pos_table_df, cond_table_df, par_df
+
+
+def load_raw_npy(data_dir, mmap_mode='r'):
+    """
+    Load raw feature and target data from the .npy files written by
+    file_conversion.raw2npy. The arrays are memory-mapped by default,
+    so loading is near-instant and several processes share one
+    page-cached copy of the data.
+
+    Parameters
+    ----------
+    data_dir : str
+        Directory containing the .npy database.
+    mmap_mode : {None, 'r', 'r+', 'c'}, optional
+        Memory-map mode as used by numpy.load. If None, read the data
+        into memory. Defaults to 'r'.
+
+    Returns
+    -------
+    feature_data : numpy.ndarray or numpy.memmap
+        Two-dimensional array containing all features.
+    target_data : numpy.ndarray or numpy.memmap
+        Two-dimensional array containing all targets.
+    f_column_labels : list of strings
+        Column labels of feature data.
+    """
+    feature_data = np.load(data_dir+'feature_data.npy', mmap_mode=mmap_mode)
+    target_data = np.load(data_dir+'target_data.npy', mmap_mode=mmap_mode)
+    with open(data_dir+'columns.json') as f:
+        f_column_labels = json.load(f)['feature_data']
+    return feature_data, target_data, f_column_labels
+
+
+def load_raw_IDs_npy(data_dir, mmap_mode='r', as_frame=True):
+    """
+    Load raw metadata from the files written by file_conversion.raw2npy.
+
+    Parameters
+    ----------
+    data_dir : str
+        Directory containing the .npy database.
+    mmap_mode : {None, 'r', 'r+', 'c'}, optional
+        Memory-map mode for the ID reference table. Defaults to 'r'.
+    as_frame : bool, optional
+        If True, return the ID reference table as DataFrame indexed by
+        global_id as returned by load_raw_IDs_h5. Otherwise return the
+        (memory-mapped) structured array. Defaults to True.
+
+    Returns
+    -------
+    ID_ref : pandas DataFrame object or numpy.ndarray
+        ID reference table.
+    pos_table_df : pandas DataFrame object
+        DataFrame containing position table.
+    cond_table_df : pandas DataFrame object
+        DataFrame containing condition table.
+    par_df : pandas DataFrame object
+        DataFrame containing feature parameter data.
+    """
+    ID_ref = np.load(data_dir+'ID_reference_table.npy', mmap_mode=mmap_mode)
+    if as_frame:
+        ID_ref = pd.DataFrame({'pos_id': ID_ref['pos_id'],
+                               'cond_id': ID_ref['cond_id'],
+                               'subject_id': ID_ref['subject_id']},
+                              index=pd.Index(ID_ref['global_id'],
+                                             name='global_id'))
+    pos_table_df = pd.read_csv(data_dir+'position_table.csv',
+                               index_col='pos_id', dtype={'pos_id': np.uint8})
+    cond_table_df = pd.read_csv(data_dir+'condition_table.csv',
+                                index_col='cond_id',
+                                dtype={'cond_id': np.uint8})
+    par_df = pd.read_csv(data_dir+'feature_par.csv',
+                         dtype={'cond_id': np.uint8})
+    return ID_ref, pos_table_df, cond_table_df, par_df
+
+
+def get_column_idx(column_labels, columns):
+    """
+    Resolve a feature column selection to column indices.
+
+    Parameters
+    ----------
+    column_labels : list of str
+        Column labels of the feature data, e.g. ILD_<cf>Hz, ITD_<cf>Hz
+        and IC_<cf>Hz (see generate_tabular_database_raw.m).
+    columns : str, int or list of str or int
+        Selection of columns. Strings are column labels or feature
+        groups, i.e. label prefixes such as 'ILD', 'ITD' or 'IC'.
+        Integers are column indices.
+
+    Returns
+    -------
+    idx : numpy.ndarray
+        Column indices in order of the selection, groups in order of
+        column_labels.
+    """
+    if isinstance(columns, (str, int, np.integer)):
+        columns = [columns]
+    idx = []
+    for col in columns:
+        if isinstance(col, (int, np.integer)):
+            idx.append(int(col))
+        elif col in column_labels:
+            idx.append(column_labels.index(col))
+        else:
+            group = [i for i, x in enumerate(column_labels)
+                     if x.startswith(col + '_')]
+            if not group:
+                raise KeyError('Feature column or group not found: '+col)
+            idx.extend(group)
+    return np.array(idx, dtype=np.int64)
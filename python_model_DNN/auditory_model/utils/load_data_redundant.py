@@ -7,13 +7,15 @@ import numpy as np
 import pandas as pd
 from keras.utils import Sequence
 from os.path import splitext
-from utils import get_metadata_from_filename
+from utils.utils import get_metadata_from_filename
+from utils.hdf_pool import HDFStorePool
 
 
 class DG_redundant_single_rows(Sequence):
     """
     Generates data for Keras. Based on a global ID list load radomized
     single rows of data from file ID + local row ID pairs. VERY slow.
+    Use DG_redundant_block instead.
     """
     def __init__(self, list_IDs, data_dir, filelist, feature_label,
                  target_label, n_rows=720000, batch_size=32, dim=96,
@@ -92,22 +94,28 @@ class DG_redundant_single_rows(Sequence):
 class DG_redundant_consec(Sequence):
     """
     Based on a global ID list load radomized batches of consecutive
-    rows of data from file ID + local row ID pairs. Slow.
+    rows of data from file ID + local row ID pairs. The IDs of a batch
+    are split into runs of consecutive rows per file, any number of
+    files per batch, and each run is fetched with one sliced read. HDF5
+    files are read through pool, a HDFStorePool of open file handles.
     """
     def __init__(self, list_IDs, data_dir, filelist, feature_label,
                  target_label, n_rows=720000, batch_size=32, dim=96,
-                 shuffle=True):
+                 shuffle=True, pool=None, manifest=None):
         """Initialization."""
-        self.list_IDs = list_IDs
+        self.list_IDs = np.asarray(list_IDs, dtype=np.int64)
         self.data_dir = data_dir
-        self.filelist = filelist
+        self.filelist = filelist if manifest is None else manifest.filelist
         self.feature_label = feature_label
         self.target_label = target_label
         self.n_rows = n_rows
         self.batch_size = batch_size
         self.dim = dim
         self.shuffle = shuffle
+        self.pool = pool if pool is not None else HDFStorePool()
+        self.manifest = manifest
         _, self.file_ext = splitext(self.filelist[0])
+        self.columns = {}
         self.on_epoch_end() #trigger once at beginning
 
     def __len__(self):
@@ -138,53 +146,45 @@ class DG_redundant_consec(Sequence):
         # Initialization
         X = np.empty((self.batch_size, self.dim))
         y = np.empty((self.batch_size))
-        
-        # get name of file to read from
-        file_idx = np.floor(np.divide(list_IDs_temp,self.n_rows))
-        file_idx = file_idx.astype(int)
-        multifile = np.argmax(file_idx>file_idx[0])
-        # get local row index from ID (global index)
-        local_idx = np.mod(list_IDs_temp,self.n_rows)
-            
-        if self.file_ext == '.h5':
-            # load data from HDF5 file
-            if not multifile:
-                local_idx = local_idx.tolist()
-                data = pd.read_hdf(self.data_dir+self.filelist[file_idx[0]],
-                                   where=local_idx)
-            else:
-                local_idx1 = local_idx[:multifile].tolist()
-                local_idx2 = local_idx[multifile:].tolist()
-                df1 = pd.read_hdf(self.data_dir+self.filelist[file_idx[0]],
-                                  where=local_idx1)
-                df2 = pd.read_hdf(self.data_dir
-                                  +self.filelist[file_idx[multifile]],
-                                  where=local_idx2)
-                data = pd.concat([df1, df2])
+
+        # get file and local row index from ID (global index)
+        if self.manifest is not None:
+            file_idx, local_idx = self.manifest.locate(list_IDs_temp)
         else:
-            # determine rows not to read
-            local_rows = np.arange(self.n_rows,dtype='int32')
-            skip_rows = np.delete(local_rows, local_idx)
-            # load data from csv file
-            data = pd.read_csv(self.data_dir+self.filelist[file_idx[0]],
-                               skiprows=skip_rows)
-              
-        # Store sample
-        X = data[self.feature_label].values
+            file_idx, local_idx = np.divmod(list_IDs_temp, self.n_rows)
 
-        # Store targets
-        y = data[self.target_label].values
+        # read each run of consecutive rows with one sliced read
+        n = 0
+        for f, start, stop in split_runs(file_idx, local_idx):
+            filename = self.filelist[f]
+            if filename not in self.columns and self.file_ext != '.h5':
+                self.columns[filename] = pd.read_csv(self.data_dir+filename,
+                                                     nrows=0).columns
+            data = read_row_range(self.data_dir+filename, start, stop,
+                                  self.pool, self.columns.get(filename))
+            m = len(data)
+            X[n:n+m] = data[self.feature_label].values
+            y[n:n+m] = data[self.target_label].values
+            n += m
+            if m != stop-start:
+                break
+
+        if n != self.batch_size:
+            raise ValueError('Read {} rows for batch of size {}. Check '
+                             'n_rows or manifest against the data files.'
+                             .format(n, self.batch_size))
         return X, y
 
 
 class DG_redundant_single_table(Sequence):
     """
     Based on a global ID list load radomized rows of data from single
-    large table in single HDF5 file. Might be slow.
+    large table in single HDF5 file. Might be slow. The file is read
+    through pool, a HDFStorePool of open file handles.
     """
     def __init__(self, list_IDs, data_dir, filelist, feature_label,
                  target_label, n_rows=720000, batch_size=32, dim=96,
-                 shuffle=True):
+                 shuffle=True, pool=None):
         """Initialization."""
         self.list_IDs = list_IDs
         self.data_dir = data_dir
@@ -195,6 +195,7 @@ class DG_redundant_single_table(Sequence):
         self.batch_size = batch_size
         self.dim = dim
         self.shuffle = shuffle
+        self.pool = pool if pool is not None else HDFStorePool()
         self.on_epoch_end() #trigger once at beginning
 
     def __len__(self):
@@ -225,7 +226,7 @@ class DG_redundant_single_table(Sequence):
         X = np.empty((self.batch_size, self.dim))
         y = np.empty((self.batch_size))
             
-        data = pd.read_hdf(self.data_dir+self.filelist[0], mode='r', where=list_IDs_temp)
+        data = self.pool.select(self.data_dir+self.filelist[0], where=list_IDs_temp)
               
         # Store sample
         X = data[self.feature_label].values
@@ -235,7 +236,243 @@ class DG_redundant_single_table(Sequence):
         return X, y
 
 
-def get_ID_list(filelist, ignore_list, n_rows=[]):
+class DG_redundant_block(Sequence):
+    """
+    Based on a global ID list load randomized batches of single rows
+    from file ID + local row ID pairs. The IDs of a batch are grouped by
+    file and sorted by local row, neighbouring rows are coalesced into
+    contiguous ranges and each range is fetched with one sliced read.
+    The requested order is restored afterwards. Replaces
+    DG_redundant_single_rows.
+
+    Optionally, block-shuffle mode shuffles blocks of block_size
+    consecutive IDs and then shuffles within windows of window IDs,
+    trading randomness for sequential I/O.
+
+    Attributes
+    ----------
+    list_IDs : numpy.ndarray
+        A one-dimensional array containing global IDs.
+    data_dir : str
+        Directory containing the data files.
+    filelist : list of str
+        List of filenames in global ID order. Ignored if manifest is
+        provided.
+    feature_label : list of str
+        Column labels of the features.
+    target_label : str
+        Column label of the target.
+    n_rows : int, optional
+        Number of rows per file. Ignored if manifest is provided.
+    batch_size : int, optional
+        Batch size.
+    dim : int, optional
+        Input dimension or number of features. Defaults to 96.
+    shuffle : bool, optional
+        Optionally shuffle the data for each epoch.
+    block_size : int, optional
+        If provided, shuffle in blocks of block_size consecutive IDs.
+    window : int, optional
+        Number of IDs to shuffle within after block shuffling. Defaults
+        to block_size.
+    max_gap : int, optional
+        Rows in a file closer than max_gap are read within one range.
+        Defaults to 1024.
+    manifest : ManifestIndex, optional
+        Index over the data set manifest. Required for files of unequal
+        length.
+    pool : HDFStorePool, optional
+        Pool of open HDF5 file handles. Defaults to a new pool.
+    """
+    def __init__(self, list_IDs, data_dir, filelist, feature_label,
+                 target_label, n_rows=720000, batch_size=32, dim=96,
+                 shuffle=True, block_size=None, window=None, max_gap=1024,
+                 manifest=None, pool=None):
+        """Initialization."""
+        self.list_IDs = np.asarray(list_IDs, dtype=np.int64)
+        self.data_dir = data_dir
+        self.filelist = filelist if manifest is None else manifest.filelist
+        self.feature_label = feature_label
+        self.target_label = target_label
+        self.n_rows = n_rows
+        self.batch_size = batch_size
+        self.dim = dim
+        self.shuffle = shuffle
+        self.block_size = block_size
+        self.window = window if window is not None else block_size
+        self.max_gap = max_gap
+        self.manifest = manifest
+        self.pool = pool if pool is not None else HDFStorePool()
+        _, self.file_ext = splitext(self.filelist[0])
+        self.columns = {}
+        self.on_epoch_end() #trigger once at beginning
+
+    def __len__(self):
+        """Denotes the number of batches per epoch."""
+        return int(np.floor(len(self.list_IDs) / self.batch_size))
+
+    def __getitem__(self, index):
+        """Generate one batch of data."""
+        # Generate indexes of the batch
+        indexes = self.indexes[index*self.batch_size:(index+1)
+                               *self.batch_size]
+
+        # Generate data
+        X, y = self.__data_generation(self.list_IDs[indexes])
+        return X, y
+
+    def on_epoch_end(self):
+        """Updates indexes after each epoch."""
+        n = len(self.list_IDs)
+        self.indexes = np.arange(n)
+        if self.shuffle == True:
+            if self.block_size:
+                self.indexes = block_shuffle(n, self.block_size, self.window)
+            else:
+                np.random.shuffle(self.indexes)
+
+    def locate(self, IDs):
+        """Map global IDs to file indices and local row indices."""
+        if self.manifest is not None:
+            return self.manifest.locate(IDs)
+        return np.divmod(IDs, self.n_rows)
+
+    def __data_generation(self, list_IDs_temp):
+        """
+        Generates data containing batch_size samples
+        X : (n_samples, dim)
+        """
+        file_idx, local_idx = self.locate(list_IDs_temp)
+        # sort by file and local row
+        order = np.lexsort((local_idx, file_idx))
+        file_idx = file_idx[order]
+        local_idx = local_idx[order]
+
+        # one read per coalesced range of rows of each file
+        chunks = []
+        bounds = np.flatnonzero(np.diff(file_idx)) + 1
+        for rows, f in zip(np.split(local_idx, bounds),
+                           file_idx[np.concatenate(([0], bounds))]):
+            for start, stop, sel in coalesce_rows(rows, self.max_gap):
+                data = self.read_rows(self.filelist[f], start, stop)
+                chunks.append(data.iloc[sel - start])
+        data = pd.concat(chunks) if len(chunks) > 1 else chunks[0]
+
+        # restore requested order
+        X = np.empty((len(order), self.dim))
+        y = np.empty(len(order))
+        X[order] = data[self.feature_label].values
+        y[order] = data[self.target_label].values
+        return X, y
+
+    def read_rows(self, filename, start, stop):
+        """Read contiguous range of rows start:stop from a data file."""
+        path = self.data_dir+filename
+        if filename not in self.columns and self.file_ext != '.h5':
+            self.columns[filename] = pd.read_csv(path, nrows=0).columns
+        return read_row_range(path, start, stop, self.pool,
+                              self.columns.get(filename))
+
+
+def read_row_range(path, start, stop, pool=None, names=None):
+    """
+    Read contiguous range of rows start:stop from a HDF5 or CSV file
+    with a single sliced read.
+
+    Parameters
+    ----------
+    path : str
+        Path of the data file.
+    start : int
+        First row to read.
+    stop : int
+        Row to stop reading at (exclusive).
+    pool : HDFStorePool, optional
+        Pool of open HDF5 file handles to read through.
+    names : list of str, optional
+        Column labels of CSV file. Read from its header if None.
+
+    Returns
+    -------
+    data : pandas DataFrame object
+        DataFrame containing the rows.
+    """
+    if splitext(path)[1] == '.h5':
+        if pool is None:
+            return pd.read_hdf(path, start=start, stop=stop)
+        return pool.select(path, start=start, stop=stop)
+    if names is None:
+        names = pd.read_csv(path, nrows=0).columns
+    return pd.read_csv(path, header=None, skiprows=start+1, nrows=stop-start,
+                       names=names)
+
+
+def split_runs(file_idx, local_idx):
+    """
+    Split file and local row indices into runs of consecutive rows
+    within one file.
+
+    Returns
+    -------
+    runs : list of tuple
+        List of (file index, start row, stop row) tuples in input order.
+    """
+    if len(file_idx) == 0:
+        return []
+    breaks = np.flatnonzero((np.diff(file_idx) != 0)
+                            | (np.diff(local_idx) != 1)) + 1
+    first = np.concatenate(([0], breaks))
+    last = np.concatenate((breaks, [len(file_idx)]))
+    return [(int(file_idx[i]), int(local_idx[i]), int(local_idx[i])+int(j-i))
+            for i, j in zip(first, last)]
+
+
+def coalesce_rows(rows, max_gap):
+    """
+    Group sorted row indices into contiguous ranges. Rows closer than
+    max_gap end up in the same range.
+
+    Parameters
+    ----------
+    rows : ndarray of int
+        Sorted row indices.
+    max_gap : int
+        Maximum gap between rows read within one range.
+
+    Returns
+    -------
+    ranges : list of tuple
+        List of (start, stop, rows) tuples, with rows the row indices
+        within start:stop.
+    """
+    splits = np.flatnonzero(np.diff(rows) > max_gap) + 1
+    return [(int(r[0]), int(r[-1])+1, r) for r in np.split(rows, splits)]
+
+
+def block_shuffle(n, block_size, window=None):
+    """
+    Permutation of n indices that shuffles blocks of block_size
+    consecutive indices and then shuffles within windows of window
+    indices of the result.
+
+    Returns
+    -------
+    indexes : ndarray of int
+        Shuffled indices.
+    """
+    if window is None:
+        window = block_size
+    idx = np.arange(n)
+    n_blocks = int(np.ceil(n / block_size))
+    rank = np.empty(n_blocks)
+    rank[np.random.permutation(n_blocks)] = np.arange(n_blocks)
+    idx = idx[np.argsort(rank[idx // block_size], kind='stable')]
+    # shuffle within windows
+    key = np.arange(n) // window + np.random.random_sample(n)
+    return idx[np.argsort(key)]
+
+
+def get_ID_list(filelist, ignore_list, n_rows=[], manifest=None):
     """
     Generate IDs each corresponding to exactly one row/sample of an
     entire data set. Returns list of numeric IDs. If specified,
@@ -252,6 +489,11 @@ def get_ID_list(filelist, ignore_list, n_rows=[]):
     n_rows : list, optional
         Number of rows per file. If not specified, the number of rows
         will be determined by the first file in the sorted filelist.
+    manifest : ManifestIndex, optional
+        Index over the data set manifest as written at conversion time.
+        If provided, filelist and n_rows are ignored and the IDs are
+        based on the per-file row counts of the manifest, which may be
+        unequal. No data file is opened.
     
         
     Returns
@@ -261,21 +503,24 @@ def get_ID_list(filelist, ignore_list, n_rows=[]):
         the complete data set. If specific files are ignored
         (corresponding to specific conditions/metadata), the
         corresponding row IDs are missing in this list.
+    n_rows : int or ndarray
+        Number of rows per file. Array of per-file row counts if
+        manifest is provided.
     """
-    
+    if manifest is not None:
+        return manifest.get_ID_list(ignore_list), manifest.n_rows
+
     # sort filelist
     filelist.sort()
     
     # get number of files and rows per file (optional)
     n_files = len(filelist)
     if not n_rows:
-        with open(filelist[0]) as file:
-            n_rows = len(file.readlines())-1 #skip column label
-    
-    # initialize variables
-    ID_list = np.array([], dtype='int32')
+        with open(filelist[0], 'rb') as file:
+            n_rows = sum(1 for _ in file)-1 #skip column label
     
     # generate ID list for each file
+    ID_list = []
     for file_idx,name in enumerate(filelist):
         m, s, p, _ = get_metadata_from_filename(name)
         
@@ -284,7 +529,9 @@ def get_ID_list(filelist, ignore_list, n_rows=[]):
         start_idx = file_idx * n_rows
         stop_idx = (file_idx+1) * n_rows
         
-        # concatenate IDs for each file
+        # collect IDs for each file
         if not ignore:
-            ID_list = np.concatenate((ID_list, np.arange(start=start_idx, stop=stop_idx, dtype='int32')))
-    return ID_list, n_rows
\ No newline at end of file
+            ID_list.append(np.arange(start=start_idx, stop=stop_idx, dtype='int32'))
+    # concatenate once
+    ID_list = np.concatenate(ID_list) if ID_list else np.array([], dtype='int32')
+    return ID_list, n_rows
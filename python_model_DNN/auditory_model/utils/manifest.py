@@ -0,0 +1,162 @@
+"""
+A python module that provides functions to write and read the manifest
+of the redundant database. The manifest lists all files of a data set
+in the sorted order the global IDs are based on, together with their
+row counts, offsets and the metadata contained in their filenames.
+"""
+
+import json
+import numpy as np
+import pandas as pd
+from os.path import getsize, splitext
+from utils.utils import get_metadata_from_filename
+
+
+class ManifestIndex(object):
+    """
+    Index over the files of a data set listed in a manifest. Maps
+    global IDs to file and local row indices with a binary search on
+    the cumulative row offsets, without touching the data files. Files
+    may have unequal lengths.
+
+    Attributes
+    ----------
+    manifest : dict
+        Manifest as returned by create_manifest or read_manifest.
+    filelist : list of str
+        List of filenames in global ID order.
+    n_rows : numpy.ndarray
+        Number of rows per file.
+    offsets : numpy.ndarray
+        Prefix sum of n_rows with leading zero, i.e. global ID of the
+        first row of each file. offsets[-1] is the total number of rows.
+    """
+    def __init__(self, manifest):
+        """Initialization."""
+        self.manifest = manifest
+        self.filelist = [f['filename'] for f in manifest['files']]
+        self.n_rows = np.array([f['n_rows'] for f in manifest['files']],
+                               dtype=np.int64)
+        self.offsets = np.concatenate(([0], np.cumsum(self.n_rows)))
+
+    @classmethod
+    def from_file(cls, filename):
+        """Create index from manifest json file."""
+        return cls(read_manifest(filename))
+
+    def __len__(self):
+        """Total number of rows of the data set."""
+        return int(self.offsets[-1])
+
+    def locate(self, IDs):
+        """
+        Map global IDs to file indices and local row indices.
+
+        Parameters
+        ----------
+        IDs : int or array_like of int
+            Global IDs.
+
+        Returns
+        -------
+        file_idx : ndarray of int
+            Index of the file in filelist containing each ID.
+        local_idx : ndarray of int
+            Row index of each ID within its file.
+        """
+        IDs = np.asarray(IDs, dtype=np.int64)
+        if np.any(IDs < 0) or np.any(IDs >= self.offsets[-1]):
+            raise IndexError('Global ID out of range.')
+        file_idx = np.searchsorted(self.offsets, IDs, side='right') - 1
+        local_idx = IDs - self.offsets[file_idx]
+        return file_idx, local_idx
+
+    def get_ID_list(self, ignore_list=[]):
+        """
+        Generate IDs of all rows of the data set, optionally ignoring
+        files whose method, setup or position contains an element of
+        ignore_list (see load_data_redundant.get_ID_list).
+
+        Returns
+        -------
+        ID_list : ndarray of int64
+            Array of global IDs.
+        """
+        keep = np.array([not any(elem in x for elem in ignore_list
+                                 for x in [f['method'], f['setup'],
+                                           f['position']])
+                         for f in self.manifest['files']], dtype=bool)
+        if not keep.any():
+            return np.array([], dtype=np.int64)
+        starts = self.offsets[:-1][keep]
+        lengths = self.n_rows[keep]
+        # global ID = file start + position within run of kept files
+        run_starts = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        return run_starts + np.arange(lengths.sum(), dtype=np.int64)
+
+
+def create_manifest(filelist, n_rows, n_bytes=None):
+    """
+    Create manifest from per-file row counts and source file sizes.
+
+    Parameters
+    ----------
+    filelist : list of str
+        List of filenames in global ID order.
+    n_rows : list of int
+        Number of rows/samples per file.
+    n_bytes : list of int, optional
+        Size of each source file in bytes, e.g. of the CSV file an
+        HDF5 file was converted from. Only informational, it is not a
+        position within the converted files.
+
+    Returns
+    -------
+    manifest : dict
+        Dictionary with key 'files' containing one dict per file with
+        keys filename, n_rows, row_offset, n_bytes, method, setup,
+        position and dataset_name.
+    """
+    if n_bytes is None:
+        n_bytes = [0 for _ in filelist]
+    files = []
+    row_offset = 0
+    for name, rows, size in zip(filelist, n_rows, n_bytes):
+        m, s, p, d = get_metadata_from_filename(name)
+        files.append({'filename': name, 'n_rows': int(rows),
+                      'row_offset': row_offset, 'n_bytes': int(size),
+                      'method': m, 'setup': s, 'position': p,
+                      'dataset_name': d})
+        row_offset += int(rows)
+    return {'files': files}
+
+
+def create_manifest_from_files(data_dir, filelist):
+    """
+    Create manifest for existing CSV or HDF5 files by counting their
+    rows once. Prefer the manifests written at conversion time.
+    """
+    filelist = sorted(filelist)
+    n_rows = []
+    for name in filelist:
+        if splitext(name)[1] == '.h5':
+            with pd.HDFStore(data_dir+name, mode='r') as store:
+                n_rows.append(store.get_storer(store.keys()[0]).nrows)
+        else:
+            with open(data_dir+name, 'rb') as f:
+                n_rows.append(sum(1 for _ in f) - 1) #skip column label
+    n_bytes = [getsize(data_dir+name) for name in filelist]
+    return create_manifest(filelist, n_rows, n_bytes)
+
+
+def write_manifest(filename, manifest):
+    """Write manifest to json file."""
+    with open(filename, 'w') as f:
+        json.dump(manifest, f, indent=1)
+
+
+def read_manifest(filename):
+    """Read manifest from json file."""
+    with open(filename) as f:
+        manifest = json.load(f)
+    return manifest
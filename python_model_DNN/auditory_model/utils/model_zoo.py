@@ -0,0 +1,162 @@
+"""
+A python module that provides a registry of the trained models in a
+directory, e.g. data/models_trained/.
+"""
+
+import pandas as pd
+from collections import OrderedDict
+from os.path import splitext
+from keras import backend as K
+from keras.models import load_model
+
+from utils.custom_loss import CUSTOM_OBJECTS
+from utils.dataset_split import load_partition
+from utils.plot import get_model_info
+from utils.utils import get_filelist, open_json
+
+
+class ModelZoo(object):
+    """
+    Registry of trained Keras models. Indexes a model directory by the
+    metadata parsed from the filenames (see plot.get_model_info)
+    without loading any weights and resolves the matching history and
+    test partition files. Models are loaded on first access into a
+    least recently used (LRU) cache of bounded size.
+
+    Evicting a model only drops the reference of the cache. Keras keeps
+    the layers and weights of all loaded models in its global state, so
+    memory is released by keras.backend.clear_session, which the cache
+    calls whenever it runs empty, i.e. on clear() and, for
+    max_models=1, on every eviction. clear_session also resets models
+    loaded outside the cache; use a small max_models or call clear()
+    between groups of models in long-running reviews.
+
+    Attributes
+    ----------
+    model_dir : str
+        Directory containing the '.h5' model files and the
+        corresponding '*_history.json' and '*_partition_test.*' files.
+    max_models : int, optional
+        Maximum number of models kept in memory. Defaults to 4.
+    custom_objects : dict, optional
+        Custom objects for keras.models.load_model. Defaults to
+        custom_loss.CUSTOM_OBJECTS.
+    index : pandas DataFrame object
+        One row per model, indexed by model filename, with columns
+        model, loss, tdata, special, bs, optim, test, history and
+        partition.
+    """
+    def __init__(self, model_dir, max_models=4, custom_objects=None):
+        """Initialization."""
+        self.model_dir = model_dir
+        self.max_models = max_models
+        if custom_objects is None:
+            custom_objects = dict(CUSTOM_OBJECTS)
+        self.custom_objects = custom_objects
+        self._cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.index = self.build_index(get_filelist(model_dir))
+
+    @staticmethod
+    def build_index(filelist):
+        """Build model index from the filelist of a model directory."""
+        m_flist = [x for x in filelist if x.endswith('.h5')
+                   and ('history' not in x) and ('partition_test' not in x)]
+        rows = []
+        for name in m_flist:
+            base = splitext(name)[0]
+            try:
+                model, loss, tdata, special, bs, optim = get_model_info(base)
+            except IndexError:
+                model, loss, tdata, special, bs, optim = (base, '', [], '',
+                                                          '', '')
+            rows.append({'filename': name, 'model': model, 'loss': loss,
+                         'tdata': '+'.join(tdata), 'special': special,
+                         'bs': bs, 'optim': optim,
+                         'test': base.split('_')[-1],
+                         'history': None, 'partition': None})
+        index = pd.DataFrame(rows, columns=['filename', 'model', 'loss',
+                                            'tdata', 'special', 'bs',
+                                            'optim', 'test', 'history',
+                                            'partition'])
+        index.set_index('filename', inplace=True)
+        for file in filelist:
+            if '_history' in file:
+                name = file.split('_history')[0] + '.h5'
+                col = 'history'
+            elif '_partition_test' in file:
+                name = file.split('_partition_test')[0] + '.h5'
+                col = 'partition'
+            else:
+                continue
+            if name in index.index:
+                index.loc[name, col] = file
+        return index
+
+    def __len__(self):
+        """Number of models in the index."""
+        return len(self.index)
+
+    def __getitem__(self, name):
+        """Return model name, loading it on first access."""
+        return self.get_model(name)
+
+    def names(self, contains=None):
+        """
+        Return list of model filenames, optionally only those containing
+        the substring contains, e.g. 'toptest'.
+        """
+        names = self.index.index.tolist()
+        if contains is not None:
+            names = [x for x in names if contains in x]
+        return names
+
+    def get_model(self, name):
+        """
+        Return Keras model from the LRU cache or load it from file,
+        evicting the least recently used model if the cache is full.
+        Clears the Keras session if the eviction empties the cache.
+        """
+        if name in self._cache:
+            self._cache.move_to_end(name)
+            self.hits += 1
+            return self._cache[name]
+        if name not in self.index.index:
+            raise KeyError('Model not found in '+self.model_dir+': '+name)
+        self.misses += 1
+        if len(self._cache) >= self.max_models:
+            while len(self._cache) >= self.max_models:
+                self._cache.popitem(last=False)
+            if not self._cache:
+                K.clear_session()
+        model = load_model(self.model_dir+name,
+                           custom_objects=self.custom_objects)
+        self._cache[name] = model
+        return model
+
+    get = get_model
+
+    def get_history(self, name):
+        """Return train history dict of model name, or None."""
+        file = self.index.loc[name, 'history']
+        if file is None:
+            return None
+        return open_json(self.model_dir, file)
+
+    def get_partition(self, name):
+        """Return test partition of model name as uint32 array, or None."""
+        file = self.index.loc[name, 'partition']
+        if file is None:
+            return None
+        return load_partition(self.model_dir+file)
+
+    def get_info(self, name):
+        """Return dict of parsed metadata of model name."""
+        return self.index.loc[name].to_dict()
+
+    def clear(self):
+        """Drop all models from the cache and clear the Keras session."""
+        if self._cache:
+            self._cache = OrderedDict()
+            K.clear_session()
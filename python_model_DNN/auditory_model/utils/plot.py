@@ -4,6 +4,8 @@ Various functions for plotting.
 import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.gridspec as gridspec
+from matplotlib.colors import LinearSegmentedColormap, LogNorm, to_rgb
+from matplotlib.patches import Patch
 
 
 def plot_history(hist, val_hist, metric_str):
@@ -17,7 +19,8 @@ def plot_history(hist, val_hist, metric_str):
     plt.show()
     
 
-def plot_locaz_all(pred, y=None, l=False, title=None):
+def plot_locaz_all(pred, y=None, l=False, title=None, mode='scatter',
+                   overlay=False, bins=200):
     """
     Plot localization azimuth prediction for all positions and
     optionally also corresponding ground truth for comparison.
@@ -34,6 +37,13 @@ def plot_locaz_all(pred, y=None, l=False, title=None):
         Defaults to False.
     title : string, optional
         Figure title.
+    mode : {'scatter', 'density'}, optional
+        Rendering mode, see plot_locaz. Defaults to 'scatter'.
+    overlay : bool, optional
+        Overlay mean and standard deviation per head rotation, see
+        plot_locaz. Defaults to False.
+    bins : int, optional
+        Number of azimuth bins in density mode. Defaults to 200.
     """
     n_pos = len(pred)
     
@@ -46,23 +56,29 @@ def plot_locaz_all(pred, y=None, l=False, title=None):
             gs00 = gs0[i].subgridspec(1, 21)
             _, _, _ = plot_locaz(pred[i], y[i], fig=fig, l=l,
                                  title='Position '+str(i), gs=(gs00[:,:9],
-                                 gs00[:,10:19], gs00[:,20]))
+                                 gs00[:,10:19], gs00[:,20]), mode=mode,
+                                 overlay=overlay, bins=bins)
     else:
         gs0 = gridspec.GridSpec(3, 4, figure=fig)
         for i in range(n_pos):
             gs00 = gs0[i].subgridspec(21, 21)
             _, ax, _ = plot_locaz(pred[i], fig=fig, l=l,
                                   title='Position '+str(i),
-                                  gs=(gs00[:20,:20], gs00[0,0], gs00[0,0]))
+                                  gs=(gs00[:20,:20], gs00[0,0], gs00[0,0]),
+                                  mode=mode, overlay=overlay, bins=bins)
             ax.set_xlabel('')
             ax.set_ylabel('')
-            fig.legend(ax.get_children()[0:1],['predictions'],
+            if mode == 'density':
+                handles = [Patch(color='b')]
+            else:
+                handles = ax.get_children()[0:1]
+            fig.legend(handles,['predictions'],
                        loc='upper right', bbox_to_anchor=(0.8, 0.3))
     return fig
     
 
 def plot_locaz(pred, y=None, l=False, title=None, fig=None, gs=None, b=10,
-               s=20):
+               s=20, mode='scatter', overlay=False, bins=200):
     """
     Plot localization azimuth prediction for one position and
     optionally also corresponding ground truth for comparison.
@@ -86,6 +102,17 @@ def plot_locaz(pred, y=None, l=False, title=None, fig=None, gs=None, b=10,
         Number of repititions. Defaults to 10.
     s : int, optional
         Number of subjects. Defaults to 20.
+    mode : {'scatter', 'density'}, optional
+        Rendering mode. 'scatter' draws every value as a marker.
+        'density' bins the values into a 2-D histogram of head rotation
+        and azimuth and draws it as one image, which renders much
+        faster for large data. Defaults to 'scatter'.
+    overlay : bool, optional
+        If True, overlay the mean and standard deviation of the values
+        per head rotation. Defaults to False.
+    bins : int, optional
+        Number of azimuth bins between -200 and 200 deg in density
+        mode. Defaults to 200.
         
     Returns
     -------
@@ -123,26 +150,26 @@ def plot_locaz(pred, y=None, l=False, title=None, fig=None, gs=None, b=10,
     else:
         ax_y = 0
     
-    # optionally change range
+    # head rotation per value; optionally change range
+    n_angles = len(pred) // n
+    x = get_head_rotation(n_angles, n, l)
     if l:
-        xl = np.kron(np.arange(180), np.ones(n))
-        xu = np.kron(np.arange(-180,0), np.ones(n))
-        x = np.concatenate((xl,xu))
         plt.xlim(-200,200)
         plt.ylim(-200,200)
     else:
-        x =  np.kron(np.arange(360), np.ones(n))
         plt.xlim(-10,380)
         plt.ylim(-200,200)
         
     # plotting    
-    ax_p.scatter(x,pred, color='b', marker='.', label='predictions')
+    plot_locaz_data(ax_p, x, pred, n, 'b', 'predictions', mode, overlay,
+                    bins)
     ax_p.set_ylabel('Localization Azimuth / deg')
     ax_p.set_xlabel('Head Rotation / deg')
     if title:
         ax_p.set_title(title)
     if y is not None:
-        ax_y.scatter(x,y, color='c', marker = '.', label='human / gt')
+        plot_locaz_data(ax_y, x, y, n, 'c', 'human / gt', mode, overlay,
+                        bins)
         ax_y.set_xlabel('Head Rotation / deg')
         if title:
             ax_y.set_title(title)
@@ -171,6 +198,86 @@ def plot_locaz(pred, y=None, l=False, title=None, fig=None, gs=None, b=10,
     return fig, ax_p, ax_y
 
 
+def get_head_rotation(n_angles, n, l=False):
+    """
+    Return head rotation in degree for each of n_angles*n values,
+    ordered by angle with n consecutive values per angle. If l is True,
+    angles >= 180 are mapped to -180<x<0.
+    """
+    x = np.repeat(np.arange(n_angles), n)
+    if l:
+        x[x >= 180] -= 360
+    return x
+
+
+def plot_locaz_data(ax, x, data, n, color, label, mode='scatter',
+                    overlay=False, bins=200):
+    """
+    Plot localization azimuth data over head rotation x on axes ax as
+    scatter plot or as density image, optionally with mean and standard
+    deviation per head rotation. See plot_locaz.
+    """
+    data = np.ravel(data)
+    if mode == 'scatter':
+        ax.scatter(x, data, color=color, marker='.', label=label)
+    elif mode == 'density':
+        counts, x_min = get_density_counts(x, data, bins)
+        n_x = counts.shape[1]
+        counts = np.ma.masked_equal(counts, 0)
+        # light tint for single values up to the full marker color
+        rgb = np.array(to_rgb(color))
+        cmap = LinearSegmentedColormap.from_list(label,
+                                                 [0.6 + 0.4*rgb, rgb])
+        ax.imshow(counts, cmap=cmap, origin='lower', aspect='auto',
+                  interpolation='nearest',
+                  norm=LogNorm(vmin=1, vmax=max(counts.max(), 2)),
+                  extent=(x_min-0.5, x_min+n_x-0.5, -200, 200))
+    else:
+        raise ValueError("mode must be 'scatter' or 'density'.")
+    if overlay:
+        # values are ordered by angle, n values per angle
+        data_a = data[:len(data)//n*n].reshape(-1, n)
+        x_a = x[::n][:len(data_a)]
+        order = np.argsort(x_a)
+        mean, std = get_circular_mean_std(data_a[order])
+        # break the lines where the mean wraps around +-180 deg
+        mean[1:][np.abs(np.diff(mean)) > 180] = np.nan
+        ax.plot(x_a[order], mean, color='r', linewidth=1)
+        ax.fill_between(x_a[order], mean-std, mean+std, color='r',
+                        alpha=0.2, linewidth=0)
+
+
+def get_density_counts(x, data, bins=200, y_range=(-200, 200)):
+    """
+    Return 2-D histogram of shape (bins, n_x) of data over the integer
+    head rotations x in 1 deg bins, and the smallest head rotation.
+    Values outside y_range are dropped, as by np.histogram2d, instead of
+    being piled up in the edge bins.
+    """
+    x_min = x.min()
+    n_x = x.max() - x_min + 1
+    y_edges = np.linspace(y_range[0], y_range[1], bins+1)
+    y_idx = np.searchsorted(y_edges, data, side='right') - 1
+    # last bin includes its right edge
+    y_idx[data == y_range[1]] = bins-1
+    valid = (y_idx >= 0) & (y_idx < bins)
+    counts = np.bincount(y_idx[valid]*n_x + (x[valid]-x_min),
+                         minlength=bins*n_x)
+    return counts.reshape(bins, n_x), x_min
+
+
+def get_circular_mean_std(data):
+    """
+    Return circular mean and standard deviation in degree of the wrapped
+    angle differences to the mean along the last axis of data.
+    """
+    rad = np.deg2rad(data)
+    mean = np.rad2deg(np.arctan2(np.sin(rad).mean(axis=-1),
+                                 np.cos(rad).mean(axis=-1)))
+    diff = np.mod(data - mean[..., None] + 180., 360.) - 180.
+    return mean, np.sqrt(np.mean(np.square(diff), axis=-1))
+
+
 def get_model_info(filename):
     """
     Get model info from filename for pretty plotting.
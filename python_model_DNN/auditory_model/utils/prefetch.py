@@ -0,0 +1,264 @@
+"""
+A python module that provides a multi-process prefetching wrapper for
+the data generators of this project.
+"""
+
+import time
+import traceback
+import numpy as np
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from queue import Empty
+from keras.utils import Sequence
+
+
+class PrefetchLoader(Sequence):
+    """
+    Wraps any of the project's Sequence generators (DataGenerator_raw,
+    DG_redundant_*) and prefetches batches in worker processes. Each
+    batch is written to one of queue_depth shared memory buffers and
+    handed to the consumer as a zero-copy view, so nothing but the
+    batch index is sent between processes.
+
+    The returned arrays stay valid until the next batch is requested.
+    Use with Keras fit_generator/evaluate_generator/predict_generator
+    with workers=0, as the loader already runs its own processes. The
+    shared memory is released by close, by leaving a with block, or
+    when a worker fails, after which the loader can not be used again.
+
+    Attributes
+    ----------
+    generator : Sequence
+        Data generator to prefetch batches from. All batches must have
+        the shape of its first batch.
+    workers : int, optional
+        Number of worker processes. Defaults to 4.
+    queue_depth : int, optional
+        Number of shared memory buffers, i.e. maximum number of batches
+        in flight plus the one held by the consumer. Defaults to 8.
+    context : str, optional
+        Multiprocessing start method, e.g. 'fork' or 'spawn'. Defaults
+        to the platform default.
+    """
+    def __init__(self, generator, workers=4, queue_depth=8, context=None):
+        """Initialization."""
+        if queue_depth < 2:
+            raise ValueError('queue_depth must be at least 2.')
+        self.generator = generator
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self._ctx = mp.get_context(context)
+        self._procs = []
+        self._next = None
+
+        # allocate one X and one y buffer per slot based on first batch
+        X, y = generator[0]
+        X = np.asarray(X)
+        y = np.asarray(y)
+        self._layout = (X.shape, X.dtype.str, y.shape, y.dtype.str)
+        self._shm = []
+        self._X = []
+        self._y = []
+        try:
+            for _ in range(queue_depth):
+                slot = []
+                self._shm.append(slot)
+                for data, views in ((X, self._X), (y, self._y)):
+                    shm = shared_memory.SharedMemory(
+                        create=True, size=max(data.nbytes, 1))
+                    slot.append(shm)
+                    views.append(np.ndarray(data.shape, data.dtype,
+                                            buffer=shm.buf))
+        except BaseException:
+            # do not leak the buffers allocated so far
+            self.close()
+            raise
+        self.reset_stats()
+
+    def __len__(self):
+        """Denotes the number of batches per epoch."""
+        return len(self.generator)
+
+    def __getitem__(self, index):
+        """
+        Return one batch as views into shared memory. Sequential access
+        is served from the prefetch queue, any other index restarts the
+        pipeline at that index.
+        """
+        if not self._shm:
+            raise RuntimeError('PrefetchLoader is closed.')
+        if not 0 <= index < len(self):
+            # no worker would ever produce this batch
+            raise IndexError('Batch index {} out of range.'.format(index))
+        if index != self._next:
+            self._start(index)
+        # the previously returned batch is no longer in use
+        if self._held is not None:
+            self._free.append(self._held)
+            self._held = None
+        self._submit()
+
+        t0 = time.time()
+        while index not in self._ready:
+            self._receive()
+        self._stats['consumer_stall'] += time.time() - t0
+        if self._stats['t_start'] is None:
+            self._stats['t_start'] = t0
+
+        slot = self._ready.pop(index)
+        self._held = slot
+        self._next = index + 1
+        self._stats['batches'] += 1
+        self._stats['t_last'] = time.time()
+        return self._X[slot], self._y[slot]
+
+    def on_epoch_end(self):
+        """Stop workers and update the wrapped generator after each epoch."""
+        self._stop()
+        self.generator.on_epoch_end()
+
+    def stats(self):
+        """
+        Return throughput counters since the last reset_stats call.
+
+        Returns
+        -------
+        stats : dict
+            batches : number of batches served.
+            batches_per_s : batches served per second of wall time.
+            consumer_stall : seconds the consumer waited for batches.
+            worker_busy : seconds spent producing batches, summed over
+            workers.
+            worker_stall : seconds workers waited for a free buffer,
+            summed over workers.
+        """
+        s = self._stats
+        wall = 0.0
+        if s['t_start'] is not None:
+            wall = s['t_last'] - s['t_start']
+        rate = s['batches'] / wall if wall > 0 else 0.0
+        return {'batches': s['batches'], 'batches_per_s': rate,
+                'consumer_stall': s['consumer_stall'],
+                'worker_busy': s['worker_busy'],
+                'worker_stall': s['worker_stall']}
+
+    def reset_stats(self):
+        """Reset throughput counters."""
+        self._stats = {'batches': 0, 'consumer_stall': 0.0,
+                       'worker_busy': 0.0, 'worker_stall': 0.0,
+                       't_start': None, 't_last': None}
+
+    def close(self):
+        """Stop workers and release the shared memory buffers."""
+        self._stop()
+        self._X = []
+        self._y = []
+        for slot in self._shm:
+            for shm in slot:
+                shm.close()
+                shm.unlink()
+        self._shm = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __del__(self):
+        """Release resources on garbage collection."""
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def _start(self, index):
+        """(Re)start worker processes, serving batches from index on."""
+        self._stop()
+        self._task_q = self._ctx.Queue()
+        self._done_q = self._ctx.Queue()
+        names = [(shm_X.name, shm_y.name) for shm_X, shm_y in self._shm]
+        for _ in range(self.workers):
+            p = self._ctx.Process(target=_worker,
+                                  args=(self.generator, names, self._layout,
+                                        self._task_q, self._done_q))
+            p.daemon = True
+            p.start()
+            self._procs.append(p)
+        self._free = list(range(self.queue_depth))
+        self._held = None
+        self._ready = {}
+        self._submitted = index
+        self._next = index
+
+    def _stop(self):
+        """Shut down worker processes."""
+        if not self._procs:
+            return
+        for _ in self._procs:
+            self._task_q.put(None)
+        for p in self._procs:
+            p.join(timeout=5)
+            if p.is_alive():
+                p.terminate()
+        self._procs = []
+        self._next = None
+
+    def _submit(self):
+        """Hand out batch indices as long as free buffers are available."""
+        while self._free and self._submitted < len(self):
+            self._task_q.put((self._submitted, self._free.pop()))
+            self._submitted += 1
+
+    def _receive(self):
+        """Wait for one finished batch and register it as ready."""
+        while True:
+            try:
+                index, slot, busy, stall, err = self._done_q.get(timeout=1)
+                break
+            except Empty:
+                if not all(p.is_alive() for p in self._procs):
+                    self.close()
+                    raise RuntimeError('PrefetchLoader worker died.')
+        if err is not None:
+            self.close()
+            raise RuntimeError('Error in PrefetchLoader worker while '
+                               'generating batch {}:\n{}'.format(index, err))
+        self._stats['worker_busy'] += busy
+        self._stats['worker_stall'] += stall
+        self._ready[index] = slot
+
+
+def _worker(generator, names, layout, task_q, done_q):
+    """Worker process writing batches into the shared memory buffers."""
+    X_shape, X_dtype, y_shape, y_dtype = layout
+    shm = []
+    X_buf = []
+    y_buf = []
+    for name_X, name_y in names:
+        shm_X = shared_memory.SharedMemory(name=name_X)
+        shm_y = shared_memory.SharedMemory(name=name_y)
+        shm.extend([shm_X, shm_y])
+        X_buf.append(np.ndarray(X_shape, X_dtype, buffer=shm_X.buf))
+        y_buf.append(np.ndarray(y_shape, y_dtype, buffer=shm_y.buf))
+
+    while True:
+        t0 = time.time()
+        task = task_q.get()
+        stall = time.time() - t0
+        if task is None:
+            break
+        index, slot = task
+        t0 = time.time()
+        err = None
+        try:
+            X, y = generator[index]
+            X_buf[slot][...] = X
+            y_buf[slot][...] = y
+        except Exception:
+            err = traceback.format_exc()
+        done_q.put((index, slot, time.time() - t0, stall, err))
+
+    del X_buf, y_buf
+    for s in shm:
+        s.close()
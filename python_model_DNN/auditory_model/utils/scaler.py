@@ -0,0 +1,242 @@
+"""
+A python module that provides an out-of-core feature scaler for the
+non-redundant (raw) database. The scaler statistics are computed in one
+chunked pass over the feature data and stored in a small json sidecar
+next to the database, so no scaled copy of the database is required.
+"""
+
+import json
+import numpy as np
+import pandas as pd
+from os.path import isdir, splitext
+
+
+class StreamingScaler(object):
+    """
+    Feature scaler fitted in a single streaming pass over chunks of the
+    feature data. Equivalent to sklearn.preprocessing.MinMaxScaler
+    (method='minmax') or StandardScaler (method='standard'), but the
+    statistics are accumulated chunk by chunk and the transform is a
+    single multiply-add per feature, X * scale + offset.
+
+    Attributes
+    ----------
+    method : str, optional
+        'minmax' to scale each feature to feature_range or 'standard'
+        to remove the mean and scale to unit variance. Defaults to
+        'minmax'.
+    feature_range : tuple, optional
+        Desired range of the scaled features for method 'minmax'.
+        Defaults to (-1, 1).
+    columns : list of str
+        Feature column labels, if known.
+    n_samples : int
+        Number of samples seen.
+    data_min, data_max : numpy.ndarray
+        Per-feature minimum and maximum.
+    mean, var : numpy.ndarray
+        Per-feature mean and (population) variance.
+    scale, offset : numpy.ndarray
+        Per-feature transform parameters, set by finalize.
+    """
+    def __init__(self, method='minmax', feature_range=(-1, 1)):
+        """Initialization."""
+        if method not in ('minmax', 'standard'):
+            raise ValueError("method must be 'minmax' or 'standard'.")
+        self.method = method
+        self.feature_range = tuple(feature_range)
+        self.columns = None
+        self.n_samples = 0
+        self.data_min = None
+        self.data_max = None
+        self.mean = None
+        self.var = None
+        self.scale = None
+        self.offset = None
+
+    def partial_fit(self, X):
+        """
+        Update the statistics with chunk X of shape (n_samples, n_features).
+        Mean and variance are merged with the pairwise update of Chan et
+        al., which is numerically stable for large databases.
+        """
+        if isinstance(X, pd.DataFrame):
+            if self.columns is None:
+                self.columns = X.columns.tolist()
+            X = X.values
+        X = np.asarray(X, dtype=np.float64)
+        n = X.shape[0]
+        if n == 0:
+            return self
+        c_min = X.min(axis=0)
+        c_max = X.max(axis=0)
+        c_mean = X.mean(axis=0)
+        c_var = X.var(axis=0)
+        if self.n_samples == 0:
+            self.data_min, self.data_max = c_min, c_max
+            self.mean, self.var = c_mean, c_var
+        else:
+            n_a = self.n_samples
+            n_ab = n_a + n
+            delta = c_mean - self.mean
+            self.data_min = np.minimum(self.data_min, c_min)
+            self.data_max = np.maximum(self.data_max, c_max)
+            self.mean = self.mean + delta * n / n_ab
+            self.var = (self.var * n_a + c_var * n
+                        + delta**2 * n_a * n / n_ab) / n_ab
+        self.n_samples += n
+        return self
+
+    def finalize(self):
+        """
+        Compute scale and offset from the statistics. Features with
+        zero range or variance are not scaled, as in sklearn.
+        """
+        if self.method == 'minmax':
+            lo, hi = self.feature_range
+            data_range = self.data_max - self.data_min
+            data_range[data_range == 0.0] = 1.0
+            self.scale = (hi - lo) / data_range
+            self.offset = lo - self.data_min * self.scale
+        else:
+            std = np.sqrt(self.var)
+            std[std == 0.0] = 1.0
+            self.scale = 1.0 / std
+            self.offset = -self.mean * self.scale
+        return self
+
+    def fit(self, feature_data, chunksize=1000000):
+        """
+        Fit on feature data, a DataFrame or (memory-mapped) array, in
+        chunks of chunksize rows.
+        """
+        if isinstance(feature_data, pd.DataFrame):
+            self.columns = feature_data.columns.tolist()
+            feature_data = feature_data.values
+        for start in range(0, feature_data.shape[0], chunksize):
+            self.partial_fit(feature_data[start:start+chunksize])
+        return self.finalize()
+
+    def fit_h5(self, filename, key='feature_data', chunksize=1000000):
+        """
+        Fit on the feature table of a raw HDF5 database (table format),
+        reading chunks of chunksize rows without loading it completely.
+        """
+        with pd.HDFStore(filename, mode='r') as store:
+            for chunk in store.select(key, chunksize=chunksize):
+                self.partial_fit(chunk)
+        return self.finalize()
+
+    def transform(self, X, copy=True):
+        """
+        Scale features of X (n_samples, n_features). With copy=False, a
+        floating point array X is scaled in place.
+        """
+        if isinstance(X, pd.DataFrame):
+            return pd.DataFrame(self.transform(X.values), index=X.index,
+                                columns=X.columns)
+        X = np.array(X, copy=copy)
+        if not np.issubdtype(X.dtype, np.floating):
+            X = X.astype(np.float64)
+        X *= self.scale.astype(X.dtype)
+        X += self.offset.astype(X.dtype)
+        return X
+
+    def subset(self, columns):
+        """
+        Return scaler for a subset of the features, given as list of
+        column labels or integer column indices.
+        """
+        idx = [self.columns.index(c) if isinstance(c, str) else int(c)
+               for c in columns]
+        scaler = StreamingScaler(self.method, self.feature_range)
+        if self.columns is not None:
+            scaler.columns = [self.columns[i] for i in idx]
+        scaler.n_samples = self.n_samples
+        for key in ['data_min', 'data_max', 'mean', 'var', 'scale',
+                    'offset']:
+            value = getattr(self, key)
+            if value is not None:
+                setattr(scaler, key, value[idx])
+        return scaler
+
+    def inverse_transform(self, X):
+        """Undo the scaling of X."""
+        X = np.asarray(X, dtype=np.float64)
+        return (X - self.offset) / self.scale
+
+    def to_dict(self):
+        """Return scaler state as json serializable dict."""
+        state = {'method': self.method,
+                 'feature_range': list(self.feature_range),
+                 'columns': self.columns, 'n_samples': self.n_samples}
+        for key in ['data_min', 'data_max', 'mean', 'var', 'scale',
+                    'offset']:
+            value = getattr(self, key)
+            state[key] = None if value is None else value.tolist()
+        return state
+
+    @classmethod
+    def from_dict(cls, state):
+        """Create scaler from dict as returned by to_dict."""
+        scaler = cls(state['method'], state['feature_range'])
+        scaler.columns = state['columns']
+        scaler.n_samples = state['n_samples']
+        for key in ['data_min', 'data_max', 'mean', 'var', 'scale',
+                    'offset']:
+            if state[key] is not None:
+                setattr(scaler, key, np.array(state[key], dtype=np.float64))
+        return scaler
+
+    def save(self, filename):
+        """Write scaler state to json file."""
+        with open(filename, 'w') as f:
+            json.dump(self.to_dict(), f, indent=1)
+
+    @classmethod
+    def load(cls, filename):
+        """Read scaler from json file."""
+        with open(filename) as f:
+            state = json.load(f)
+        return cls.from_dict(state)
+
+
+def scaler_filename(database, method='minmax'):
+    """
+    Return the filename of the scaler sidecar of a raw database, i.e.
+    '<name>_scaler_<method>.json' next to an HDF5 file or
+    'scaler_<method>.json' in a .npy database directory.
+    """
+    if isdir(database):
+        return database + 'scaler_' + method + '.json'
+    return splitext(database)[0] + '_scaler_' + method + '.json'
+
+
+def fit_scaler(database, method='minmax', feature_range=(-1, 1),
+               chunksize=1000000, key_f='feature_data', save=True):
+    """
+    Fit a StreamingScaler in one chunked pass over the feature data of
+    a raw HDF5 database or .npy database directory and optionally write
+    it to the sidecar file given by scaler_filename.
+
+    Returns
+    -------
+    scaler : StreamingScaler object
+        Fitted scaler.
+    """
+    scaler = StreamingScaler(method, feature_range)
+    if isdir(database):
+        feature_data = np.load(database+'feature_data.npy', mmap_mode='r')
+        scaler.fit(feature_data, chunksize)
+        with open(database+'columns.json') as f:
+            scaler.columns = json.load(f)['feature_data']
+    else:
+        scaler.fit_h5(database, key_f, chunksize)
+    if save:
+        scaler.save(scaler_filename(database, method))
+    return scaler
+
+
+def load_scaler(database, method='minmax'):
+    """Load the scaler sidecar of a raw database."""
+    return StreamingScaler.load(scaler_filename(database, method))
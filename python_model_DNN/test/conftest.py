@@ -0,0 +1,10 @@
+"""
+Pytest configuration: make the modules of auditory_model importable as
+in the notebooks, e.g. from utils.load_data_raw import ...
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'auditory_model'))
@@ -0,0 +1,184 @@
+"""
+Tests of the inverted index on the ID reference table of
+utils.dataset_split.
+"""
+
+import json
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('sklearn')
+
+from utils.dataset_split import (SubsetIndex, generate_folds, get_pos_IDs,
+                                 load_fold, load_partition, save_fold,
+                                 save_partition)
+
+PARTITIONS = {
+    'runs': np.r_[3:1000, 2000:2500, 4000000000:4000000100],
+    'sorted': np.sort(np.random.RandomState(0).choice(10**6, 500,
+                                                      replace=False)),
+    'single': np.array([7]),
+    'empty': np.array([], dtype=np.int64)}
+
+
+@pytest.fixture
+def index():
+    """Index over 24 IDs, 3 positions, 2 conditions and 2 subjects."""
+    IDs = np.arange(24)
+    ID_ref = pd.DataFrame({'pos_id': IDs // 8, 'cond_id': IDs // 4 % 2,
+                           'subject_id': IDs % 2 + 1},
+                          index=pd.Index(IDs, name='global_id'))
+    cond_t = pd.DataFrame({'cond': ['A', 'B'],
+                           'sfs_method': ['NFCHOA_R006', 'LWFS_M006']})
+    return SubsetIndex(ID_ref, cond_t)
+
+
+def test_select(index):
+    np.testing.assert_array_equal(index.select(pos_ids=[1]), np.arange(8, 16))
+    np.testing.assert_array_equal(index.select(pos_ids=[0, 2]),
+                                  np.r_[0:8, 16:24])
+    np.testing.assert_array_equal(
+        index.select(cond_ids=[1], subject_ids=[2], mode='and'),
+        [5, 7, 13, 15, 21, 23])
+
+
+def test_results_do_not_alias_index(index):
+    ids = index.ids('pos_id', 1)
+    ids[:] = 0
+    sel = index.select(pos_ids=[1])
+    sel[:] = 0
+    np.random.shuffle(index.union('pos_id', [1]))
+    np.testing.assert_array_equal(index.ids('pos_id', 1), np.arange(8, 16))
+    np.testing.assert_array_equal(index.select(pos_ids=[1]), np.arange(8, 16))
+    assert not index._view('pos_id', 1).flags.writeable
+
+
+def test_get_pos_IDs_missing_position(index):
+    # partition without position 1
+    part = np.r_[20:24, 0:4]
+    list_df, pos_df = get_pos_IDs(part, index.ID_ref)
+    list_si, pos_si = get_pos_IDs(part, index)
+    np.testing.assert_array_equal(pos_df, [0, 1, 2])
+    np.testing.assert_array_equal(pos_si, [0, 1, 2])
+    assert [len(x) for x in list_df] == [len(x) for x in list_si] == [4, 0, 4]
+    for ids_df, ids_si in zip(list_df, list_si):
+        np.testing.assert_array_equal(np.sort(ids_df), ids_si)
+    dict_df, _ = get_pos_IDs(part, index.ID_ref, dictn=True)
+    np.testing.assert_array_equal(dict_df['pos1'], np.arange(4))
+    assert len(dict_df['pos2']) == 0
+    np.testing.assert_array_equal(dict_df['pos3'], np.arange(20, 24))
+
+
+def check_fold(partition, n_IDs):
+    """Sets of a fold are sorted uint32, disjoint and cover all IDs."""
+    for IDs in partition.values():
+        assert IDs.dtype == np.uint32
+        assert np.all(np.diff(IDs.astype(np.int64)) > 0)
+    all_IDs = np.concatenate(list(partition.values()))
+    np.testing.assert_array_equal(np.sort(all_IDs), np.arange(n_IDs))
+
+
+@pytest.mark.parametrize('group, names', [
+    ('pos_id', ['pos1', 'pos2', 'pos3']),
+    ('cond_id', ['NFCHOA_R006', 'LWFS_M006']),
+    ('subject_id', ['subject_1', 'subject_2'])])
+def test_generate_folds_leave_one_out(index, group, names):
+    folds = list(generate_folds(index.ID_ref, index.cond_t, group=group,
+                                valid_split=0.25, seed=0, index=index))
+    assert [name for name, _ in folds] == names
+    tests = []
+    for value, (_, partition) in zip(index.values(group), folds):
+        check_fold(partition, 24)
+        column = index.ID_ref[group].values
+        np.testing.assert_array_equal(partition['test'],
+                                      np.flatnonzero(column == value))
+        n_rest = 24 - len(partition['test'])
+        assert len(partition['validation']) == int(np.ceil(0.25 * n_rest))
+        tests.append(partition['test'])
+    # every ID is held out exactly once
+    np.testing.assert_array_equal(np.sort(np.concatenate(tests)),
+                                  np.arange(24))
+
+
+def test_generate_folds_k(index):
+    folds = list(generate_folds(index.ID_ref, index.cond_t, group='pos_id',
+                                k=2, seed=1, index=index))
+    assert len(folds) == 2
+    held_out = [name.split('+') for name, _ in folds]
+    assert sorted(sum(held_out, [])) == ['pos1', 'pos2', 'pos3']
+    for names, (_, partition) in zip(held_out, folds):
+        check_fold(partition, 24)
+        assert len(partition['test']) == 8 * len(names)
+
+
+def test_generate_folds_seeded(index):
+    def folds(seed):
+        return list(generate_folds(index.ID_ref, index.cond_t, k=2,
+                                   group='pos_id', seed=seed))
+    first, second = folds(3), folds(3)
+    for (name_a, part_a), (name_b, part_b) in zip(first, second):
+        assert name_a == name_b
+        for key in ['train', 'validation', 'test']:
+            np.testing.assert_array_equal(part_a[key], part_b[key])
+    others = [folds(seed) for seed in range(4, 9)]
+    assert any(not np.array_equal(f[0][1]['validation'],
+                                  first[0][1]['validation'])
+               for f in others)
+
+
+@pytest.mark.parametrize('encoding', ['raw', 'delta', 'rle', 'auto'])
+@pytest.mark.parametrize('name', list(PARTITIONS))
+def test_partition_round_trip(tmp_path, encoding, name):
+    IDs = PARTITIONS[name]
+    filename = save_partition(IDs, str(tmp_path / name), encoding=encoding)
+    loaded = load_partition(filename)
+    assert loaded.dtype == np.uint32
+    np.testing.assert_array_equal(loaded, IDs)
+    if encoding == 'raw':
+        assert filename.endswith('.npy')
+        assert isinstance(loaded, np.memmap)
+    elif encoding != 'auto':
+        assert filename.endswith('.npz')
+
+
+def test_partition_auto_encoding(tmp_path):
+    assert save_partition(PARTITIONS['runs'],
+                          str(tmp_path / 'runs')).endswith('.npz')
+    assert save_partition(PARTITIONS['sorted'],
+                          str(tmp_path / 'sorted')).endswith('.npy')
+    shuffled = np.random.RandomState(1).permutation(PARTITIONS['runs'])
+    filename = save_partition(shuffled, str(tmp_path / 'shuffled'))
+    assert filename.endswith('.npy')
+    np.testing.assert_array_equal(load_partition(filename), shuffled)
+
+
+@pytest.mark.parametrize('IDs', [[5, 3, 4], [1, 2, 2, 3]])
+def test_partition_rle_rejects_unsorted(tmp_path, IDs):
+    with pytest.raises(ValueError):
+        save_partition(IDs, str(tmp_path / 'part'), encoding='rle')
+    # delta encoding keeps any order
+    filename = save_partition(IDs, str(tmp_path / 'part'), encoding='delta')
+    np.testing.assert_array_equal(load_partition(filename), IDs)
+
+
+def test_partition_legacy_json(tmp_path):
+    IDs = PARTITIONS['sorted']
+    filename = str(tmp_path / 'NFCHOA_partition_test.json')
+    with open(filename, 'w') as f:
+        json.dump(IDs.tolist(), f)
+    loaded = load_partition(filename)
+    assert loaded.dtype == np.uint32
+    np.testing.assert_array_equal(loaded, IDs)
+
+
+@pytest.mark.parametrize('encoding', ['raw', 'rle'])
+def test_fold_round_trip(tmp_path, index, encoding):
+    _, partition = next(generate_folds(index.ID_ref, index.cond_t,
+                                       group='pos_id', seed=0, index=index))
+    out_dir = str(tmp_path)+'/'
+    filenames = save_fold(partition, out_dir, 'pos1', encoding=encoding)
+    assert filenames['test'].startswith(out_dir+'pos1_partition_test')
+    loaded = load_fold(out_dir, 'pos1')
+    for key in ['train', 'validation', 'test']:
+        np.testing.assert_array_equal(loaded[key], partition[key])
@@ -0,0 +1,83 @@
+"""
+Deduplicated training mode of DataGenerator_raw together with the
+multi-target losses equals the per-sample losses on the same IDs.
+"""
+
+import numpy as np
+import pytest
+
+pytest.importorskip('tensorflow')
+pytest.importorskip('keras')
+
+from utils.custom_loss import (mae_wrap_angle, mse_wrap_angle,
+                               mae_wrap_angle_multi, mse_wrap_angle_multi)
+from utils.load_data_raw import DataGenerator_raw
+
+N_SUBJECTS = 4
+N_FRAMES = 5
+N_TARGET_ROWS = 12
+
+
+def make_data(seed=0):
+    """Random features and targets of a small raw database."""
+    rng = np.random.RandomState(seed)
+    feature_data = rng.uniform(-180, 180, (N_TARGET_ROWS*N_FRAMES, 3))
+    target_data = rng.uniform(-180, 180, (N_TARGET_ROWS, N_SUBJECTS))
+    return feature_data.astype(np.float32), target_data.astype(np.float32)
+
+
+def predict(X):
+    """Stand-in for a model: prediction depends on the features only."""
+    return X[:, :1] * 1.7 + 20.
+
+
+def per_sample_loss(IDs, feature_data, target_data, loss):
+    gen = DataGenerator_raw(IDs, feature_data, target_data,
+                            batch_size=len(IDs), dim=3, shuffle=False,
+                            n_frames=N_FRAMES, dtype=np.float32)
+    X, y = gen[0]
+    return np.mean(loss(y[:, None], predict(X)).numpy())
+
+
+def dedup_loss(IDs, feature_data, target_data, loss):
+    n_rows = len(np.unique(IDs // N_SUBJECTS))
+    gen = DataGenerator_raw(IDs, feature_data, target_data,
+                            batch_size=n_rows, dim=3, shuffle=False,
+                            n_frames=N_FRAMES, dtype=np.float32, dedup=True)
+    X, y = gen[0]
+    return np.mean(loss(y, predict(X)).numpy())
+
+
+@pytest.mark.parametrize('losses', [(mse_wrap_angle, mse_wrap_angle_multi),
+                                    (mae_wrap_angle, mae_wrap_angle_multi)])
+@pytest.mark.parametrize('mask', ['full', 'partial'])
+def test_dedup_equals_per_sample(losses, mask):
+    feature_data, target_data = make_data()
+    IDs = np.arange(len(feature_data) * N_SUBJECTS)
+    if mask == 'partial':
+        # 1 or 2 of 4 subjects missing per feature row
+        rng = np.random.RandomState(1)
+        keep = np.ones(len(IDs), dtype=bool)
+        for row in range(len(feature_data)):
+            drop = rng.choice(N_SUBJECTS, 1 + row % 2, replace=False)
+            keep[row*N_SUBJECTS + drop] = False
+        IDs = IDs[keep]
+    loss, loss_multi = losses
+    expected = per_sample_loss(IDs, feature_data, target_data, loss)
+    actual = dedup_loss(IDs, feature_data, target_data, loss_multi)
+    np.testing.assert_allclose(actual, expected, rtol=1e-5)
+
+
+def test_dedup_mask_and_targets():
+    feature_data, target_data = make_data()
+    IDs = np.arange(len(feature_data) * N_SUBJECTS)
+    IDs = IDs[IDs % N_SUBJECTS != 2]
+    gen = DataGenerator_raw(IDs, feature_data, target_data, batch_size=10,
+                            dim=3, shuffle=False, n_frames=N_FRAMES,
+                            dedup=True)
+    X, y = gen[1]
+    rows = np.arange(10, 20)
+    np.testing.assert_array_equal(X, feature_data[rows])
+    assert np.isnan(y[:, 2]).all()
+    np.testing.assert_array_equal(y[:, [0, 1, 3]],
+                                  target_data[rows // N_FRAMES][:, [0, 1, 3]])
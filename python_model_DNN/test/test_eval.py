@@ -0,0 +1,221 @@
+"""
+Tests of the evaluation functions of utils.eval.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('keras')
+
+from utils.custom_loss import angle_diff_deg_atan2
+from utils.eval import (calc_error_decomp, calc_errors_m, create_test_params,
+                        get_y_gen, model_eval_pos, model_predict_all)
+from utils.load_data_raw import DataGenerator_raw
+
+
+class StubModel(object):
+    """Model predicting the first feature, without Keras."""
+    def summary(self):
+        pass
+
+    def predict(self, X, batch_size=None):
+        return np.asarray(X)[:, :1]
+
+    def predict_generator(self, gen, **kwargs):
+        self.n_passes = getattr(self, 'n_passes', 0) + 1
+        return np.concatenate([self.predict(gen[i][0])
+                               for i in range(len(gen))])
+
+
+def make_database(pos_per_target_row, n_subjects=2, n_frames=2):
+    """Small raw database with the given pos_id per target row."""
+    n_target_rows = len(pos_per_target_row)
+    n_feature_rows = n_target_rows * n_frames
+    feature_data = np.arange(n_feature_rows, dtype=np.float64)[:, None]
+    target_data = np.zeros((n_target_rows, n_subjects))
+    IDs = np.arange(n_feature_rows * n_subjects)
+    target_row = IDs // (n_subjects * n_frames)
+    ID_ref = pd.DataFrame({'pos_id': np.asarray(pos_per_target_row)[target_row],
+                           'cond_id': 0,
+                           'subject_id': IDs % n_subjects + 1},
+                          index=pd.Index(IDs, name='global_id'))
+    par = pd.DataFrame({'nFrames': [n_frames], 'nAngles': [1]})
+    return feature_data, target_data, ID_ref, par
+
+
+def test_model_eval_pos_unequal_positions():
+    # position 0: 3 target rows (12 IDs), position 1: 2 target rows (8 IDs)
+    feature_data, target_data, ID_ref, par = make_database([0, 0, 0, 1, 1])
+    params = create_test_params(feature_data, target_data, par)
+    part_test = ID_ref.index.values
+    mae_p, mse_p, loc_pred = model_eval_pos(StubModel(), None, part_test,
+                                            params, ID_ref, batch_size=5)
+    assert [len(x) for x in loc_pred[:3]] == [12, 8, 0]
+    np.testing.assert_array_equal(loc_pred[0], np.repeat(np.arange(6), 2))
+    np.testing.assert_array_equal(loc_pred[1], np.repeat(np.arange(6, 10), 2))
+    np.testing.assert_allclose(mae_p[:2], [2.5, 7.5])
+    assert np.isnan(mae_p[2])
+
+
+class BatchesOnly(object):
+    """Generator without get_targets, served batch by batch."""
+    def __init__(self, gen):
+        self.gen = gen
+
+    def __len__(self):
+        return len(self.gen)
+
+    def __getitem__(self, index):
+        return self.gen[index]
+
+
+@pytest.mark.parametrize('shuffle', [False, True])
+@pytest.mark.parametrize('batch_size', [3, 7, 40])
+def test_targets_aligned_with_predictions(shuffle, batch_size):
+    n_frames = 2
+    feature_data, _, ID_ref, par = make_database([0, 0, 0, 1, 1],
+                                                 n_frames=n_frames)
+    # target encodes target row and subject
+    target_data = np.arange(5)[:, None] * 10.0 + np.arange(2)
+    params = create_test_params(feature_data, target_data, par,
+                                batch_size=batch_size, shuffle=shuffle)
+    # 17 of 20 IDs, the last batch is partial
+    IDs = np.random.RandomState(0).permutation(ID_ref.index.values)[:17]
+    np.random.seed(1)
+    gen = DataGenerator_raw(IDs, **params)
+    model = StubModel()
+    y = get_y_gen(gen)
+    batches = [gen[i] for i in range(len(gen))]
+    assert len(y) == len(gen) * batch_size
+    if batches:
+        np.testing.assert_array_equal(
+            y, np.concatenate([b[1] for b in batches]))
+    np.testing.assert_array_equal(get_y_gen(BatchesOnly(gen)), y)
+    pred = np.ravel(model.predict_generator(gen)) if len(gen) \
+        else np.array([])
+    assert len(pred) == len(y)
+    # prediction is the feature row of the same sample as the target
+    np.testing.assert_array_equal(pred // n_frames, y // 10)
+
+    # all IDs in order, remainder included
+    if not shuffle:
+        pred = model_predict_all(model, gen)
+        y = gen.get_targets(IDs)
+        assert len(pred) == len(y) == len(IDs)
+        np.testing.assert_array_equal(pred, IDs // 2)
+        np.testing.assert_array_equal(y, target_data[IDs // 4, IDs % 2])
+
+
+def test_calc_errors_m_single_pass():
+    feature_data, target_data, ID_ref, par = make_database([0, 0, 0, 1, 1])
+    params = create_test_params(feature_data, target_data, par, batch_size=3)
+    pos = ID_ref['pos_id'].values
+    # reversed position order, partial last batches
+    pos_ids = np.array([1, 0])
+    part_x = [ID_ref.index.values[pos == p] for p in pos_ids]
+    model = StubModel()
+    MSE, tau_sq, sigma_sq, delta_x, delta_mean = calc_errors_m(
+        model, part_x, params, pos_ids)
+    assert model.n_passes == 1
+
+    # prediction is the feature row, target 0 deg
+    expected = [feature_data[x // 2, 0] for x in part_x]
+    assert [len(d) for d in delta_x] == [8, 12]
+    for d, e in zip(delta_x, expected):
+        np.testing.assert_allclose(d, e)
+    np.testing.assert_allclose(delta_mean, [np.mean(e) for e in expected])
+    all_delta = np.concatenate(expected)
+    np.testing.assert_allclose(MSE, np.mean(all_delta**2))
+    np.testing.assert_allclose(
+        tau_sq, np.mean([np.mean(e)**2 for e in expected]))
+    np.testing.assert_allclose(
+        sigma_sq, np.mean(np.concatenate([(e - np.mean(e))**2
+                                          for e in expected])))
+
+
+def error_decomp_per_position(pred, y, pos, pos_ids):
+    """Original per-position loop of calc_errors_m with L*B samples per
+    position."""
+    LB = np.sum(pos == pos_ids[0])
+    X = len(pos_ids)
+    delta_x = []
+    delta_mean_x = np.zeros(X)
+    for x, p in enumerate(pos_ids):
+        pred_x = pred[pos == p]
+        y_x = y[pos == p]
+        delta = np.zeros(len(pred_x))
+        for i in range(len(pred_x)):
+            delta[i] = angle_diff_deg_atan2(pred_x[i], y_x[i])
+        delta_x.append(delta)
+        delta_mean_x[x] = np.sum(delta) / LB
+    MSE_m = np.sum(np.square(delta_x)) / (LB * X)
+    tau_sq_m = np.sum(np.square(delta_mean_x)) / X
+    sigma_sq_m = np.sum(np.square([d - m for d, m in
+                                   zip(delta_x, delta_mean_x)])) / (LB * X)
+    return MSE_m, tau_sq_m, sigma_sq_m, delta_x, delta_mean_x
+
+
+def random_predictions(n_pos, n_per_pos, seed=0):
+    """Shuffled samples of n_pos positions with wrapping predictions."""
+    rng = np.random.RandomState(seed)
+    n = n_pos * n_per_pos
+    IDs = rng.permutation(n)
+    ID_ref = pd.DataFrame({'pos_id': np.arange(n) // n_per_pos + 3,
+                           'cond_id': np.arange(n) % 2,
+                           'subject_id': np.arange(n) % 4 + 1},
+                          index=pd.Index(np.arange(n), name='global_id'))
+    y = rng.uniform(-180.0, 180.0, n)
+    # errors up to 60 deg plus a position dependent bias, across +-180
+    bias = 20.0 * ID_ref['pos_id'].values[IDs]
+    pred = y + bias + rng.normal(0.0, 20.0, n)
+    pred = np.where(pred > 180.0, pred - 360.0, pred)
+    return pred, y, IDs, ID_ref
+
+
+def test_calc_error_decomp_equals_per_position():
+    pred, y, IDs, ID_ref = random_predictions(4, 60)
+    pos = ID_ref['pos_id'].values[IDs]
+    pos_ids = np.unique(pos)
+    expected = error_decomp_per_position(pred, y, pos, pos_ids)
+    for kwargs in [dict(IDs=IDs, ID_ref=ID_ref), dict(groups=pos)]:
+        MSE, tau_sq, sigma_sq, delta, delta_mean = calc_error_decomp(
+            pred, y, **kwargs)
+        np.testing.assert_allclose(MSE, expected[0])
+        np.testing.assert_allclose(tau_sq, expected[1])
+        np.testing.assert_allclose(sigma_sq, expected[2])
+        for p, d in zip(pos_ids, expected[3]):
+            np.testing.assert_allclose(delta[pos == p], d, atol=1e-9)
+        np.testing.assert_allclose(delta_mean.values, expected[4])
+        np.testing.assert_array_equal(delta_mean.index, pos_ids)
+        # equal group sizes
+        np.testing.assert_allclose(MSE, tau_sq + sigma_sq)
+
+
+def test_calc_error_decomp_unequal_groups():
+    pred, y, IDs, ID_ref = random_predictions(3, 40, seed=1)
+    # drop part of the second position
+    keep = ~((ID_ref['pos_id'].values[IDs] == 4) & (IDs % 40 < 25))
+    pred, y, IDs = pred[keep], y[keep], IDs[keep]
+    MSE, tau_sq, sigma_sq, delta, delta_mean = calc_error_decomp(
+        pred, y, IDs, ID_ref)
+    pos = ID_ref['pos_id'].values[IDs]
+    means = [np.mean(delta[pos == p]) for p in [3, 4, 5]]
+    np.testing.assert_allclose(delta_mean.values, means)
+    np.testing.assert_allclose(tau_sq, np.mean(np.square(means)))
+    np.testing.assert_allclose(
+        sigma_sq, np.mean(np.square(delta - delta_mean[pos].values)))
+    np.testing.assert_allclose(MSE, np.mean(np.square(delta)))
+
+
+def test_calc_error_decomp_multiple_columns():
+    pred, y, IDs, ID_ref = random_predictions(2, 40, seed=2)
+    _, tau_sq, _, delta, delta_mean = calc_error_decomp(
+        pred, y, IDs, ID_ref, by=['pos_id', 'cond_id'])
+    assert delta_mean.index.names == ['pos_id', 'cond_id']
+    assert len(delta_mean) == 4
+    keys = ID_ref[['pos_id', 'cond_id']].values[IDs]
+    for (p, c), m in delta_mean.items():
+        sel = (keys[:, 0] == p) & (keys[:, 1] == c)
+        np.testing.assert_allclose(m, np.mean(delta[sel]))
+    np.testing.assert_allclose(tau_sq, np.mean(np.square(delta_mean.values)))
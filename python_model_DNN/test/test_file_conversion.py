@@ -0,0 +1,279 @@
+"""
+Tests of the conversion functions of utils.file_conversion.
+"""
+
+import json
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils import file_conversion
+from utils.file_conversion import (imap_bounded, _read_csv_compact,
+                                   cast_compact, check_dtype_precision,
+                                   csv_raw2hdf_single, csv_raw2hdf_stream,
+                                   csv2hdf_sep_parallel,
+                                   hdf_sep2hdf_single_parallel, hdf_raw2npy,
+                                   raw2npy)
+from utils.manifest import read_manifest
+
+STREAM_KEYS = ['position_table', 'condition_table', 'feature_par',
+               'ID_reference_table', 'target_data', 'feature_data']
+
+
+class RecordingPool(object):
+    """Synchronous stand-in for multiprocessing.Pool recording the
+    number of submitted but not yet consumed tasks."""
+    def __init__(self):
+        self.pending = 0
+        self.max_pending = 0
+
+    def apply_async(self, func, args):
+        self.pending += 1
+        self.max_pending = max(self.max_pending, self.pending)
+        pool = self
+
+        class Result(object):
+            def get(self):
+                pool.pending -= 1
+                return func(*args)
+        return Result()
+
+
+@pytest.mark.parametrize('max_pending', [1, 3, 20])
+def test_imap_bounded(max_pending):
+    pool = RecordingPool()
+    out = list(imap_bounded(pool, np.square, range(10), max_pending))
+    assert out == [x**2 for x in range(10)]
+    assert pool.max_pending == min(max_pending, 10)
+
+
+@pytest.mark.parametrize('dtype', [np.uint16, np.int8])
+def test_cast_compact_out_of_range(dtype):
+    angles = pd.DataFrame({'subject_1': [-90.0, 0.0, 179.6]})
+    with pytest.raises(ValueError):
+        cast_compact(angles, dtype)
+    with pytest.raises(ValueError):
+        cast_compact(np.array([0.0, np.nan]), np.int16)
+    np.testing.assert_array_equal(cast_compact(angles, np.int16).values[:, 0],
+                                  [-90, 0, 180])
+
+
+@pytest.mark.parametrize('dtype', [np.float32, np.float16, np.int16])
+def test_csv_chunks_equal_cast(tmp_path, dtype):
+    rng = np.random.RandomState(1)
+    df = pd.DataFrame(rng.uniform(-180.0, 180.0, (2000, 3)),
+                      columns=['subject_1', 'subject_2', 'subject_3'])
+    # just above a float16 rounding midpoint, a float32 parse rounds it
+    # to the midpoint and float16 then rounds down to even
+    df.iloc[7, 0] = 100.03125 + 1e-9
+    filename = str(tmp_path / 'target_data.csv')
+    df.to_csv(filename, index=False, float_format='%.12f')
+    chunks = pd.concat([chunk for chunk, _ in
+                        file_conversion._csv_chunks(filename, 300,
+                                                    dtype=dtype)],
+                       ignore_index=True)
+    expected = cast_compact(pd.read_csv(filename), dtype)
+    pd.testing.assert_frame_equal(chunks, expected)
+    pd.testing.assert_frame_equal(chunks, _read_csv_compact(filename, dtype))
+
+
+def test_parallel_conversion(tmp_path):
+    pytest.importorskip('tables')
+    data_dir = str(tmp_path)+'/'
+    # unequal lengths, filelist not in sorted order
+    n_rows = {'exp1_NFCHOA_L56_M006_pos03_data.csv': 3,
+              'exp1_NFCHOA_L56_M006_pos01_data.csv': 5,
+              'exp1_NFCHOA_L56_M006_pos02_data.csv': 2}
+    dfs = {}
+    for i, (name, n) in enumerate(n_rows.items()):
+        dfs[name] = pd.DataFrame({'x': np.arange(n) + 10.0*i,
+                                  'y': np.full(n, float(i))})
+        dfs[name].to_csv(data_dir+name, index=False)
+    filelist = sorted(n_rows)
+
+    manifest = csv2hdf_sep_parallel(data_dir, list(n_rows), data_dir,
+                                    processes=2, max_pending=1)
+    assert manifest == read_manifest(data_dir+'manifest.json')
+    h5_list = [f['filename'] for f in manifest['files']]
+    assert h5_list == [name[:-4]+'.h5' for name in filelist]
+    assert [f['n_rows'] for f in manifest['files']] == [5, 2, 3]
+    assert [f['row_offset'] for f in manifest['files']] == [0, 5, 7]
+    for name, h5_name in zip(filelist, h5_list):
+        pd.testing.assert_frame_equal(pd.read_hdf(data_dir+h5_name, 'data'),
+                                      dfs[name])
+
+    manifest = hdf_sep2hdf_single_parallel(data_dir, h5_list[::-1], data_dir,
+                                           processes=2, max_pending=1)
+    assert manifest == read_manifest(data_dir+'database_manifest.json')
+    assert [f['filename'] for f in manifest['files']] == h5_list
+    assert [f['n_rows'] for f in manifest['files']] == [5, 2, 3]
+    database = pd.read_hdf(data_dir+'database.h5', 'database')
+    np.testing.assert_array_equal(
+        database.values, np.concatenate([dfs[name].values
+                                         for name in filelist]))
+
+
+@pytest.mark.parametrize('dtype', [np.float32, np.float16, np.int16])
+def test_read_csv_compact(tmp_path, dtype):
+    rng = np.random.RandomState(0)
+    df = pd.DataFrame(rng.uniform(-180.0, 180.0, (25, 3)),
+                      columns=['subject_1', 'subject_2', 'subject_3'])
+    filename = str(tmp_path / 'target_data.csv')
+    df.to_csv(filename, index=False)
+    full = pd.read_csv(filename)
+    compact = _read_csv_compact(filename, dtype, chunksize=7)
+    assert (compact.dtypes == dtype).all()
+    assert compact.columns.tolist() == full.columns.tolist()
+    pd.testing.assert_frame_equal(compact, cast_compact(full, dtype))
+    _, t_err = check_dtype_precision(full, full, dtype, dtype)
+    np.testing.assert_allclose(
+        np.max(np.abs(compact.values.astype(np.float64) - full.values)),
+        t_err)
+
+
+class Interrupt(Exception):
+    """Stand-in for a crash or KeyboardInterrupt during conversion."""
+
+
+def write_raw_csv(data_dir):
+    """Small non-redundant (raw) CSV database."""
+    rng = np.random.RandomState(0)
+    pd.DataFrame({'pos_id': np.arange(3), 'azimuth': [-90, 0, 90]}).to_csv(
+        data_dir+'position_table.csv', index=False)
+    pd.DataFrame({'cond_id': np.arange(2), 'snr': [0.0, 10.0]}).to_csv(
+        data_dir+'condition_table.csv', index=False)
+    pd.DataFrame({'nFrames': [3], 'nAngles': [3]}).to_csv(
+        data_dir+'feature_par.csv', index=False)
+    pd.DataFrame({'global_id': np.arange(30),
+                  'pos_id': rng.randint(0, 3, 30),
+                  'cond_id': rng.randint(0, 2, 30),
+                  'subject_id': np.arange(30) % 3}).to_csv(
+        data_dir+'ID_reference_table.csv', index=False)
+    pd.DataFrame(rng.uniform(-180.0, 180.0, (23, 3)),
+                 columns=['subject_1', 'subject_2', 'subject_3']).to_csv(
+        data_dir+'target_data.csv', index=False)
+    pd.DataFrame(rng.uniform(-1.0, 1.0, (27, 4)),
+                 columns=['ILD', 'ITD', 'IC', 'level']).to_csv(
+        data_dir+'feature_data.csv', index=False)
+
+
+def interrupt_read(monkeypatch, n_chunks):
+    """Raise while reading the chunk after n_chunks chunks."""
+    csv_chunks = file_conversion._csv_chunks
+    count = [0]
+
+    def chunks(*args, **kwargs):
+        for chunk in csv_chunks(*args, **kwargs):
+            if count[0] == n_chunks:
+                raise Interrupt()
+            count[0] += 1
+            yield chunk
+    monkeypatch.setattr(file_conversion, '_csv_chunks', chunks)
+
+
+def interrupt_write(monkeypatch, n_chunks):
+    """Raise after appending chunk n_chunks+1, before its progress is
+    recorded."""
+    count = [0]
+
+    class Json(object):
+        load = staticmethod(json.load)
+
+        @staticmethod
+        def dump(obj, f):
+            if count[0] == n_chunks:
+                raise Interrupt()
+            count[0] += 1
+            json.dump(obj, f)
+    monkeypatch.setattr(file_conversion, 'json', Json)
+
+
+@pytest.mark.parametrize('interrupt', [interrupt_read, interrupt_write])
+@pytest.mark.parametrize('n_chunks', [2, 5, 9])
+def test_csv_raw2hdf_stream_resume(tmp_path, monkeypatch, interrupt,
+                                   n_chunks):
+    pytest.importorskip('tables')
+    data_dir = str(tmp_path)+'/'
+    write_raw_csv(data_dir)
+    dtypes = dict(feature_dtype=np.float32, target_dtype=np.float16)
+    kwargs = dict(chunksize=4, verbose=False, **dtypes)
+    csv_raw2hdf_single(data_dir, data_dir, 'single.h5', **dtypes)
+    n_rows = csv_raw2hdf_stream(data_dir, data_dir, 'stream.h5', **kwargs)
+
+    # interrupt every n_chunks chunks until the conversion completes
+    n_calls = 0
+    while True:
+        n_calls += 1
+        with monkeypatch.context() as m:
+            interrupt(m, n_chunks)
+            try:
+                resumed = csv_raw2hdf_stream(data_dir, data_dir,
+                                             'resumed.h5', **kwargs)
+                break
+            except Interrupt:
+                pass
+    assert n_calls > 2
+    assert resumed == n_rows == {'ID_reference_table': 30,
+                                 'target_data': 23, 'feature_data': 27}
+
+    # streamed tables equal the non-streaming conversion, index included
+    for key in STREAM_KEYS:
+        expected = pd.read_hdf(data_dir+'single.h5', key)
+        for name in ['stream.h5', 'resumed.h5']:
+            actual = pd.read_hdf(data_dir+name, key)
+            assert actual.index.is_unique
+            pd.testing.assert_frame_equal(actual, expected)
+    for key, n in n_rows.items():
+        index = pd.read_hdf(data_dir+'resumed.h5', key).index
+        np.testing.assert_array_equal(index, np.arange(n))
+
+    # a completed conversion is not extended by another call
+    assert csv_raw2hdf_stream(data_dir, data_dir, 'resumed.h5',
+                              **kwargs) == n_rows
+    pd.testing.assert_frame_equal(
+        pd.read_hdf(data_dir+'resumed.h5', 'feature_data'),
+        pd.read_hdf(data_dir+'single.h5', 'feature_data'))
+
+
+@pytest.mark.parametrize('dtypes', [{}, {'feature_dtype': np.float32,
+                                         'target_dtype': np.int16}])
+def test_raw2npy_round_trip(tmp_path, dtypes):
+    pytest.importorskip('tables')
+    load_data_raw = pytest.importorskip('utils.load_data_raw')
+    data_dir = str(tmp_path)+'/'
+    write_raw_csv(data_dir)
+    csv_raw2hdf_single(data_dir, data_dir, 'database_raw.h5', **dtypes)
+    tables = [pd.read_hdf(data_dir+'database_raw.h5', key)
+              for key in ['feature_data', 'target_data', 'ID_reference_table',
+                          'position_table', 'condition_table', 'feature_par']]
+    # chunked copy of the HDF5 tables and the converter of the HDF5 file
+    npy_dirs = []
+    for name in ['chunked', 'converted']:
+        (tmp_path / name).mkdir()
+        npy_dirs.append(data_dir+name+'/')
+    raw2npy(*tables, npy_dirs[0], chunksize=4)
+    hdf_raw2npy(data_dir+'database_raw.h5', npy_dirs[1])
+
+    f_df, t_df, labels = load_data_raw.load_raw_ft_h5(
+        data_dir+'database_raw.h5')
+    IDs_h5 = load_data_raw.load_raw_IDs_h5(data_dir+'database_raw.h5')
+    for npy_dir in npy_dirs:
+        feature_data, target_data, f_labels = load_data_raw.load_raw_npy(
+            npy_dir)
+        assert isinstance(feature_data, np.memmap)
+        assert feature_data.flags['C_CONTIGUOUS']
+        assert feature_data.dtype == f_df.values.dtype
+        assert target_data.dtype == t_df.values.dtype
+        np.testing.assert_array_equal(feature_data, f_df.values)
+        np.testing.assert_array_equal(target_data, t_df.values)
+        assert f_labels == labels == f_df.columns.tolist()
+
+        IDs_npy = load_data_raw.load_raw_IDs_npy(npy_dir)
+        for actual, expected in zip(IDs_npy, IDs_h5):
+            pd.testing.assert_frame_equal(actual, expected)
+        ID_ref = load_data_raw.load_raw_IDs_npy(npy_dir, mmap_mode=None,
+                                                as_frame=False)[0]
+        np.testing.assert_array_equal(ID_ref['global_id'],
+                                      IDs_h5[0].index.values)
+        np.testing.assert_array_equal(ID_ref['subject_id'],
+                                      IDs_h5[0]['subject_id'].values)
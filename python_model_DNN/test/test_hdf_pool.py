@@ -0,0 +1,96 @@
+"""
+Tests of the pool of open HDF5 file handles, utils.hdf_pool.
+"""
+
+import multiprocessing as mp
+import pickle
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('tables')
+
+from utils.hdf_pool import HDFStorePool
+
+
+@pytest.fixture
+def paths(tmp_path):
+    """Four single-key HDF5 files with x = file index."""
+    paths = []
+    for i in range(4):
+        path = str(tmp_path / 'file{}.h5'.format(i))
+        pd.DataFrame({'x': np.full(5, i)}).to_hdf(path, key='data',
+                                                   format='table')
+        paths.append(path)
+    return paths
+
+
+def read_in_child(pool, path, queue):
+    """Read through a pool inherited by a forked process."""
+    x = pool.select(path)['x'].values[0]
+    queue.put((x, pool.stats(), list(pool._stores)))
+    pool.close()
+
+
+def test_lru_eviction(paths):
+    pool = HDFStorePool(max_open=2)
+    for i in [0, 1, 0, 2]:
+        assert pool.select(paths[i])['x'].values[0] == i
+    # file 1 was least recently used when file 2 was opened
+    assert list(pool._stores) == [paths[0], paths[2]]
+    assert pool.stats() == {'hits': 1, 'misses': 3, 'evictions': 1,
+                            'open': 2}
+    pool.select(paths[3], start=1, stop=3)
+    assert list(pool._stores) == [paths[2], paths[3]]
+    assert pool.stats() == {'hits': 1, 'misses': 4, 'evictions': 2,
+                            'open': 2}
+    store = pool.get(paths[2])
+    assert store.is_open
+    assert pool.hits == 2
+    assert list(pool._stores) == [paths[3], paths[2]]
+    pool.close()
+    assert not store.is_open
+    assert pool.stats()['open'] == 0
+
+
+def test_select_requires_key_for_multiple_keys(paths):
+    pd.DataFrame({'y': [1]}).to_hdf(paths[0], key='other', format='table')
+    pool = HDFStorePool()
+    with pytest.raises(ValueError):
+        pool.select(paths[0])
+    assert pool.select(paths[0], key='other')['y'].tolist() == [1]
+    pool.close()
+
+
+def test_reset_after_fork(paths):
+    pool = HDFStorePool(max_open=2)
+    pool.select(paths[0])
+    pool.select(paths[0])
+    ctx = mp.get_context('fork')
+    queue = ctx.Queue()
+    p = ctx.Process(target=read_in_child, args=(pool, paths[1], queue))
+    p.start()
+    x, stats, stores = queue.get(timeout=30)
+    p.join(timeout=30)
+    assert p.exitcode == 0
+    # the child started with an empty pool and its own counters
+    assert x == 1
+    assert stats == {'hits': 0, 'misses': 1, 'evictions': 0, 'open': 1}
+    assert stores == [paths[1]]
+    # the handles of the parent are untouched
+    assert pool.stats() == {'hits': 1, 'misses': 1, 'evictions': 0,
+                            'open': 1}
+    assert pool.select(paths[0])['x'].values[0] == 0
+    pool.close()
+
+
+def test_pickle_reopens(paths):
+    pool = HDFStorePool(max_open=3, mode='r')
+    pool.select(paths[0])
+    clone = pickle.loads(pickle.dumps(pool))
+    assert (clone.max_open, clone.mode) == (3, 'r')
+    assert clone.stats() == {'hits': 0, 'misses': 0, 'evictions': 0,
+                             'open': 0}
+    assert clone.select(paths[0])['x'].values[0] == 0
+    clone.close()
+    pool.close()
@@ -0,0 +1,284 @@
+"""
+Tests of the batch generator of utils.load_data_raw with feature column
+selection and on-the-fly scaling.
+"""
+
+import multiprocessing as mp
+import pickle
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('keras')
+
+from utils.eval import create_test_params
+from utils.load_data_raw import (DataGenerator_raw, RawDatabase,
+                                 load_raw_ft_h5)
+from utils.scaler import StreamingScaler
+
+LABELS = ['ILD_100Hz', 'ILD_200Hz', 'ITD_100Hz', 'ITD_200Hz', 'IC_100Hz',
+          'IC_200Hz']
+N_SUBJECTS = 2
+N_FRAMES = 2
+
+
+@pytest.fixture
+def data():
+    rng = np.random.RandomState(0)
+    feature_data = rng.uniform(-10.0, 10.0, (8, len(LABELS))) \
+        * np.arange(1, len(LABELS)+1)
+    target_data = rng.uniform(-180.0, 180.0, (4, N_SUBJECTS))
+    scaler = StreamingScaler().fit(feature_data)
+    scaler.columns = list(LABELS)
+    return feature_data, target_data, scaler
+
+
+def make_params(feature_data, target_data, **kwargs):
+    par = pd.DataFrame({'nFrames': [N_FRAMES], 'nAngles': [1]})
+    return create_test_params(feature_data, target_data, par,
+                              batch_size=4, column_labels=LABELS, **kwargs)
+
+
+def expected_X(feature_data, scaler, IDs, idx):
+    """Manually scaled features of IDs in columns idx."""
+    X = feature_data[IDs // N_SUBJECTS][:, idx]
+    return X * scaler.scale[idx] + scaler.offset[idx]
+
+
+def test_scaler_selected_by_label(data):
+    feature_data, target_data, scaler = data
+    IDs = np.arange(16)
+    gen = DataGenerator_raw(IDs, **make_params(feature_data, target_data,
+                                               scaler=scaler,
+                                               columns=['ITD', 'IC_100Hz']))
+    idx = [2, 3, 4]
+    assert gen.scaler.columns == [LABELS[i] for i in idx]
+    X, _ = gen.get_data(IDs)
+    np.testing.assert_allclose(X, expected_X(feature_data, scaler, IDs, idx))
+
+
+def test_reduced_scaler_selected_by_label(data):
+    feature_data, target_data, scaler = data
+    IDs = np.arange(16)
+    # scaler reduced to other columns in other order, same length
+    reduced = scaler.subset(['IC_200Hz', 'ITD_100Hz', 'ITD_200Hz'])
+    gen = DataGenerator_raw(IDs, **make_params(feature_data, target_data,
+                                               scaler=reduced,
+                                               columns=['ITD', 'IC_200Hz']))
+    X, _ = gen.get_data(IDs)
+    np.testing.assert_allclose(X, expected_X(feature_data, scaler, IDs,
+                                             [2, 3, 5]))
+
+
+def test_scaler_label_mismatch_raises(data):
+    feature_data, target_data, scaler = data
+    reduced = scaler.subset(['ILD_100Hz', 'ILD_200Hz'])
+    with pytest.raises(KeyError):
+        DataGenerator_raw(np.arange(16),
+                          **make_params(feature_data, target_data,
+                                        scaler=reduced, columns=['ITD']))
+
+
+def test_scaler_without_labels(data):
+    feature_data, target_data, scaler = data
+    IDs = np.arange(16)
+    gen = DataGenerator_raw(IDs, feature_data, target_data, batch_size=4,
+                            dim=2, n_frames=N_FRAMES, scaler=scaler,
+                            columns=[1, 4])
+    X, _ = gen.get_data(IDs)
+    np.testing.assert_allclose(X, expected_X(feature_data, scaler, IDs,
+                                             [1, 4]))
+    with pytest.raises(ValueError):
+        DataGenerator_raw(IDs, feature_data, target_data, n_frames=N_FRAMES,
+                          scaler=scaler.subset([0, 1, 2]), columns=[1, 4])
+
+
+def make_generators(IDs, feature_data, target_data, **kwargs):
+    """Vectorized and loop generator with identical shuffling."""
+    gens = []
+    for vectorized in [True, False]:
+        np.random.seed(3)
+        gens.append(DataGenerator_raw(IDs, feature_data, target_data,
+                                      batch_size=5, dim=len(LABELS),
+                                      n_frames=N_FRAMES,
+                                      vectorized=vectorized, **kwargs))
+    return gens
+
+
+@pytest.mark.parametrize('shuffle', [False, True])
+@pytest.mark.parametrize('columns', [None, [4, 0, 3]])
+def test_vectorized_equals_loop(data, shuffle, columns):
+    feature_data, target_data, scaler = data
+    rng = np.random.RandomState(1)
+    IDs = rng.permutation(len(feature_data) * N_SUBJECTS)[:13]
+    vec, loop = make_generators(IDs, feature_data, target_data,
+                                shuffle=shuffle, columns=columns,
+                                scaler=scaler)
+    assert len(vec) == len(loop) == 2
+    np.testing.assert_array_equal(vec.indexes, loop.indexes)
+    for i in range(len(vec)):
+        X_vec, y_vec = vec[i]
+        X_loop, y_loop = loop[i]
+        assert X_vec.shape == X_loop.shape == (5, vec.dim)
+        np.testing.assert_array_equal(X_vec, X_loop)
+        np.testing.assert_array_equal(y_vec, y_loop)
+
+
+def test_dedup_equals_loop(data):
+    feature_data, target_data, _ = data
+    # subject 1 of feature rows 1 and 6 missing
+    IDs = np.setdiff1d(np.arange(len(feature_data) * N_SUBJECTS), [3, 13])
+    _, loop = make_generators(IDs, feature_data, target_data, shuffle=False,
+                              columns=[1, 5])
+    dedup = DataGenerator_raw(IDs, feature_data, target_data, batch_size=3,
+                              n_frames=N_FRAMES, shuffle=False,
+                              columns=[1, 5], dedup=True)
+    # per sample features and target of the loop path, keyed by ID
+    samples = {}
+    for i in range(len(loop)):
+        X, y = loop[i]
+        for ID, x, t in zip(IDs[loop.indexes[i*5:(i+1)*5]], X, y):
+            samples[ID] = (x, t)
+    n_checked = 0
+    for i in range(len(dedup)):
+        X, y = dedup[i]
+        for row, x, t in zip(dedup.feature_rows[i*3:(i+1)*3], X, y):
+            for subject in range(N_SUBJECTS):
+                ID = row * N_SUBJECTS + subject
+                if ID not in IDs:
+                    assert np.isnan(t[subject])
+                elif ID in samples:
+                    np.testing.assert_array_equal(x, samples[ID][0])
+                    assert t[subject] == samples[ID][1]
+                    n_checked += 1
+    assert n_checked == len(samples)
+
+
+@pytest.fixture
+def database(tmp_path, data):
+    """Raw HDF5 database of data with small metadata tables."""
+    pytest.importorskip('tables')
+    feature_data, target_data, _ = data
+    filename = str(tmp_path / 'database_raw.h5')
+    tables = {
+        'feature_data': pd.DataFrame(feature_data, columns=LABELS),
+        'target_data': pd.DataFrame(target_data,
+                                    columns=['subject_1', 'subject_2']),
+        'ID_reference_table': pd.DataFrame(
+            {'pos_id': np.arange(16) // 8, 'cond_id': 0,
+             'subject_id': np.arange(16) % N_SUBJECTS + 1}),
+        'position_table': pd.DataFrame({'azimuth': [-90, 90]}),
+        'condition_table': pd.DataFrame({'sfs_method': ['NFCHOA_R006']}),
+        'feature_par': pd.DataFrame({'nFrames': [N_FRAMES], 'nAngles': [1]})}
+    for key, df in tables.items():
+        df.to_hdf(filename, key=key, format='table')
+    return filename, tables
+
+
+def read_in_child(db, queue):
+    """Read through a database handle inherited or unpickled by a child
+    process."""
+    try:
+        queue.put((db.is_loaded('feature_data'),
+                   db.select('feature_data', 2, 4, columns='ITD').values,
+                   db.store is db.store))
+    finally:
+        db.close()
+
+
+def test_raw_database_lazy(database):
+    filename, tables = database
+    with RawDatabase(filename) as db:
+        assert not any(db.is_loaded(name) for name in RawDatabase.TABLES)
+        # metadata of the large tables without reading them
+        assert db.n_rows('feature_data') == 8
+        assert db.columns('feature_data') == LABELS
+        par = db.feature_par
+        assert db.feature_par is par
+        assert [db.is_loaded(name) for name in RawDatabase.TABLES] \
+            == [False, False, False, False, False, True]
+        ID_ref, pos, cond, par = db.load_IDs()
+        pd.testing.assert_frame_equal(ID_ref, tables['ID_reference_table'])
+        assert not db.is_loaded('feature_data')
+        feature_df, target_df, labels = db.load_ft()
+        pd.testing.assert_frame_equal(feature_df, tables['feature_data'])
+        pd.testing.assert_frame_equal(target_df, tables['target_data'])
+        assert labels == LABELS
+        db.clear('feature_data')
+        assert not db.is_loaded('feature_data')
+        assert db.is_loaded('target_data')
+        db.clear()
+        assert not db.is_loaded('target_data')
+    assert db._store is None
+
+
+@pytest.mark.parametrize('columns, idx', [
+    (None, list(range(len(LABELS)))),
+    ('ITD', [2, 3]),
+    (['IC_200Hz', 'ILD'], [5, 0, 1]),
+    ([4, 1], [4, 1])])
+def test_raw_database_select(database, columns, idx):
+    filename, tables = database
+    expected = tables['feature_data'].iloc[2:6, idx]
+    with RawDatabase(filename) as db:
+        # read from the file, then served from the cache
+        df = db.select('feature_data', 2, 6, columns=columns)
+        assert not db.is_loaded('feature_data')
+        pd.testing.assert_frame_equal(df, expected)
+        db.feature_data
+        pd.testing.assert_frame_equal(
+            db.select('feature_data', 2, 6, columns=columns), expected)
+    with RawDatabase(filename, feature_dtype=np.float32) as db:
+        df = db.select('feature_data', 2, 6, columns=columns)
+        assert (df.dtypes == np.float32).all()
+        pd.testing.assert_frame_equal(df, expected.astype(np.float32))
+
+
+def test_raw_database_pickle(database):
+    filename, tables = database
+    db = RawDatabase(filename, keys={'feature_par': 'feature_par'},
+                     target_dtype=np.float32)
+    db.feature_data
+    clone = pickle.loads(pickle.dumps(db))
+    assert clone._store is None
+    assert not clone.is_loaded('feature_data')
+    assert (clone.filename, clone.keys, clone.target_dtype) \
+        == (db.filename, db.keys, db.target_dtype)
+    assert (clone.target_data.dtypes == np.float32).all()
+    clone.close()
+    db.close()
+
+
+@pytest.mark.parametrize('method', ['fork', 'spawn'])
+def test_raw_database_child_process(database, method):
+    filename, tables = database
+    db = RawDatabase(filename)
+    parent_store = db.store
+    db.feature_data
+    ctx = mp.get_context(method)
+    queue = ctx.Queue()
+    p = ctx.Process(target=read_in_child, args=(db, queue))
+    p.start()
+    is_loaded, X, same_store = queue.get(timeout=60)
+    p.join(timeout=60)
+    assert p.exitcode == 0
+    # forked children inherit the cache, spawned ones start empty
+    assert is_loaded == (method == 'fork')
+    assert same_store
+    np.testing.assert_array_equal(X, tables['feature_data'].values[2:4, 2:4])
+    # the child neither closed nor replaced the store of the parent
+    assert db.store is parent_store
+    assert parent_store.is_open
+    db.close()
+
+
+@pytest.mark.parametrize('chunksize', [3, 100])
+def test_load_raw_ft_h5_columns(database, chunksize):
+    filename, tables = database
+    feature_df, target_df, labels = load_raw_ft_h5(
+        filename, feature_dtype=np.float32, columns=['ITD', 'IC_100Hz'],
+        chunksize=chunksize)
+    assert labels == ['ITD_100Hz', 'ITD_200Hz', 'IC_100Hz']
+    pd.testing.assert_frame_equal(
+        feature_df, tables['feature_data'][labels].astype(np.float32))
+    pd.testing.assert_frame_equal(target_df, tables['target_data'])
@@ -0,0 +1,184 @@
+"""
+Tests of the generators of the redundant database,
+utils.load_data_redundant.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('keras')
+pytest.importorskip('tables')
+
+from utils.hdf_pool import HDFStorePool
+from utils.load_data_redundant import (DG_redundant_block,
+                                       DG_redundant_consec, block_shuffle,
+                                       coalesce_rows, read_row_range,
+                                       split_runs)
+from utils.manifest import ManifestIndex, create_manifest
+
+FILELIST = ['exp1_LWFS_L56_M006_pos01_data',
+            'exp1_NFCHOA_L56_M006_pos01_data',
+            'exp1_NFCHOA_L56_M006_pos02_data']
+FEATURES = ['ILD_100Hz', 'ITD_100Hz']
+TARGET = 'target'
+
+
+def write_files(data_dir, n_rows, ext):
+    """Data files whose rows hold their global ID."""
+    filelist = []
+    offset = 0
+    for name, n in zip(FILELIST, n_rows):
+        ID = np.arange(offset, offset+n)
+        df = pd.DataFrame({'ILD_100Hz': ID, 'ITD_100Hz': -ID,
+                           'target': 0.5*ID})
+        filename = name+ext
+        if ext == '.h5':
+            df.to_hdf(data_dir+filename, key='data', format='table')
+        else:
+            df.to_csv(data_dir+filename, index=False)
+        filelist.append(filename)
+        offset += n
+    return filelist
+
+
+@pytest.fixture
+def pool():
+    pool = HDFStorePool()
+    yield pool
+    pool.close()
+
+
+def make_block(tmp_path, ext, n_rows, IDs, **kwargs):
+    data_dir = str(tmp_path)+'/'
+    filelist = write_files(data_dir, n_rows, ext)
+    if len(set(n_rows)) > 1:
+        kwargs['manifest'] = ManifestIndex(create_manifest(filelist, n_rows))
+    else:
+        kwargs['n_rows'] = n_rows[0]
+    return DG_redundant_block(IDs, data_dir, filelist, FEATURES, TARGET,
+                              dim=len(FEATURES), **kwargs)
+
+
+def count_reads(gen):
+    """Wrap read_rows of gen to record the ranges read."""
+    reads = []
+    read_rows = gen.read_rows
+
+    def wrapper(filename, start, stop):
+        reads.append((filename, start, stop))
+        return read_rows(filename, start, stop)
+    gen.read_rows = wrapper
+    return reads
+
+
+def test_coalesce_rows():
+    rows = np.array([0, 1, 2, 5, 6, 20])
+    assert [(a, b, list(r)) for a, b, r in coalesce_rows(rows, 1)] \
+        == [(0, 3, [0, 1, 2]), (5, 7, [5, 6]), (20, 21, [20])]
+    assert [(a, b, list(r)) for a, b, r in coalesce_rows(rows, 3)] \
+        == [(0, 7, [0, 1, 2, 5, 6]), (20, 21, [20])]
+    assert [(a, b) for a, b, _ in coalesce_rows(rows, 1024)] == [(0, 21)]
+
+
+@pytest.mark.parametrize('window', [None, 1, 4])
+def test_block_shuffle_is_permutation(window):
+    np.random.seed(0)
+    idx = block_shuffle(23, 5, window)
+    np.testing.assert_array_equal(np.sort(idx), np.arange(23))
+    if window == 1:
+        # without shuffling within windows the blocks stay intact
+        bounds = np.flatnonzero(np.diff(idx // 5)) + 1
+        for block in np.split(idx, bounds):
+            np.testing.assert_array_equal(
+                block, np.arange(block[0], min(block[0]+5, 23)))
+
+
+@pytest.mark.parametrize('ext', ['.h5', '.csv'])
+@pytest.mark.parametrize('n_rows', [[6, 6, 6], [5, 3, 7]])
+@pytest.mark.parametrize('max_gap', [0, 2, 1024])
+@pytest.mark.parametrize('block_size', [None, 4])
+def test_block_batches_in_requested_order(tmp_path, pool, ext, n_rows,
+                                          max_gap, block_size):
+    np.random.seed(1)
+    # leave out some rows to create gaps
+    IDs = np.delete(np.arange(sum(n_rows)), [2, 7, 8])
+    gen = make_block(tmp_path, ext, n_rows, IDs, batch_size=5, shuffle=True,
+                     max_gap=max_gap, block_size=block_size, pool=pool)
+    reads = count_reads(gen)
+    served = []
+    for i in range(len(gen)):
+        X, y = gen[i]
+        expected = IDs[gen.indexes[i*5:(i+1)*5]]
+        np.testing.assert_array_equal(X[:, 0], expected)
+        np.testing.assert_array_equal(X[:, 1], -expected)
+        np.testing.assert_array_equal(y, 0.5*expected)
+        served.extend(expected)
+    assert len(served) == len(gen)*5
+    assert len(set(served)) == len(served)
+    if max_gap == 1024:
+        # one read per file and batch
+        n_files = [len(np.unique(gen.locate(IDs[gen.indexes[i*5:(i+1)*5]])
+                                 [0])) for i in range(len(gen))]
+        assert len(reads) == sum(n_files)
+
+
+def test_block_unshuffled_reads_contiguous(tmp_path, pool):
+    n_rows = [5, 3, 7]
+    IDs = np.arange(sum(n_rows))
+    gen = make_block(tmp_path, '.h5', n_rows, IDs, batch_size=5,
+                     shuffle=False, max_gap=1, pool=pool)
+    reads = count_reads(gen)
+    X, _ = gen[1]
+    np.testing.assert_array_equal(X[:, 0], np.arange(5, 10))
+    # rows 5:10 are the second file and the first two rows of the third
+    assert reads == [(FILELIST[1]+'.h5', 0, 3), (FILELIST[2]+'.h5', 0, 2)]
+
+
+def test_split_runs():
+    file_idx = np.array([0, 0, 0, 1, 1, 1, 2])
+    local_idx = np.array([3, 4, 6, 0, 1, 2, 0])
+    assert split_runs(file_idx, local_idx) \
+        == [(0, 3, 5), (0, 6, 7), (1, 0, 3), (2, 0, 1)]
+    assert split_runs(file_idx[:0], local_idx[:0]) == []
+
+
+@pytest.mark.parametrize('ext', ['.h5', '.csv'])
+def test_read_row_range(tmp_path, pool, ext):
+    data_dir = str(tmp_path)+'/'
+    filelist = write_files(data_dir, [6], ext)
+    for p in [None, pool]:
+        data = read_row_range(data_dir+filelist[0], 2, 5, p)
+        assert list(data.columns) == FEATURES+[TARGET]
+        np.testing.assert_array_equal(data['ILD_100Hz'].values, [2, 3, 4])
+
+
+@pytest.mark.parametrize('ext', ['.h5', '.csv'])
+def test_consec_batch_spans_files(tmp_path, pool, ext):
+    n_rows = [5, 3, 7]
+    data_dir = str(tmp_path)+'/'
+    filelist = write_files(data_dir, n_rows, ext)
+    manifest = ManifestIndex(create_manifest(filelist, n_rows))
+    IDs = np.arange(sum(n_rows))
+    gen = DG_redundant_consec(IDs, data_dir, filelist, FEATURES, TARGET,
+                              batch_size=6, dim=len(FEATURES), pool=pool,
+                              manifest=manifest)
+    assert len(gen) == 2
+    # batch 0 spans the first two files, batch 1 the last two
+    for i in range(len(gen)):
+        X, y = gen[i]
+        expected = IDs[i*6:(i+1)*6]
+        np.testing.assert_array_equal(X[:, 0], expected)
+        np.testing.assert_array_equal(X[:, 1], -expected)
+        np.testing.assert_array_equal(y, 0.5*expected)
+
+
+def test_consec_short_batch_raises(tmp_path, pool):
+    data_dir = str(tmp_path)+'/'
+    filelist = write_files(data_dir, [4, 4], '.h5')
+    # n_rows larger than the files, the batch runs past the first file
+    gen = DG_redundant_consec(np.arange(8), data_dir, filelist, FEATURES,
+                              TARGET, n_rows=6, batch_size=6,
+                              dim=len(FEATURES), pool=pool)
+    with pytest.raises(ValueError, match='Read 4 rows for batch of size 6'):
+        gen[0]
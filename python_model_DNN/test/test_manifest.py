@@ -0,0 +1,95 @@
+"""
+Tests of the manifest of the redundant database, utils.manifest.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils.manifest import (ManifestIndex, create_manifest,
+                            create_manifest_from_files, read_manifest,
+                            write_manifest)
+
+FILELIST = ['exp1_NFCHOA_L56_M006_pos01_data.csv',
+            'exp1_NFCHOA_L56_M006_pos02_data.csv',
+            'exp1_LWFS_L56_M006_pos01_data.csv',
+            'exp1_NFCHOA_L56_R006_pos03_data.csv',
+            'exp1_LWFS_L56_R006_pos10_data.csv']
+N_ROWS = [3, 0, 5, 1, 4]
+
+
+def reference_IDs(keep):
+    """IDs of the kept files built row by row."""
+    IDs = []
+    offset = 0
+    for k, n in zip(keep, N_ROWS):
+        if k:
+            IDs.extend(range(offset, offset+n))
+        offset += n
+    return np.array(IDs, dtype=np.int64)
+
+
+@pytest.fixture
+def index():
+    return ManifestIndex(create_manifest(FILELIST, N_ROWS))
+
+
+def test_offsets(index):
+    assert len(index) == sum(N_ROWS)
+    np.testing.assert_array_equal(index.offsets, [0, 3, 3, 8, 9, 13])
+    assert [f['row_offset'] for f in index.manifest['files']] \
+        == [0, 3, 3, 8, 9]
+
+
+def test_locate_unequal_lengths(index):
+    IDs = np.arange(len(index))
+    file_idx, local_idx = index.locate(IDs)
+    expected_file = np.repeat(np.arange(len(FILELIST)), N_ROWS)
+    expected_local = np.concatenate([np.arange(n) for n in N_ROWS])
+    np.testing.assert_array_equal(file_idx, expected_file)
+    np.testing.assert_array_equal(local_idx, expected_local)
+    # first and last row of each file, the empty file is skipped
+    file_idx, local_idx = index.locate([2, 3, 7, 8, 9, 12])
+    np.testing.assert_array_equal(file_idx, [0, 2, 2, 3, 4, 4])
+    np.testing.assert_array_equal(local_idx, [2, 0, 4, 0, 0, 3])
+    for ID in [-1, len(index)]:
+        with pytest.raises(IndexError):
+            index.locate([0, ID])
+
+
+@pytest.mark.parametrize('ignore_list, keep', [
+    ([], [1, 1, 1, 1, 1]),
+    (['LWFS'], [1, 1, 0, 1, 0]),
+    (['pos01'], [0, 1, 0, 1, 1]),
+    (['R006', 'pos01'], [0, 1, 0, 0, 0]),
+    (['L56'], [0, 0, 0, 0, 0])])
+def test_get_ID_list_ignore(index, ignore_list, keep):
+    IDs = index.get_ID_list(ignore_list)
+    assert IDs.dtype == np.int64
+    np.testing.assert_array_equal(IDs, reference_IDs(keep))
+
+
+def test_get_ID_list_equals_equal_length_ID_list():
+    load_data_redundant = pytest.importorskip('utils.load_data_redundant')
+    # manifests list the files in sorted order, like get_ID_list
+    index = ManifestIndex(create_manifest(sorted(FILELIST),
+                                          [4]*len(FILELIST)))
+    for ignore_list in [[], ['LWFS'], ['pos02', 'R006']]:
+        IDs, _ = load_data_redundant.get_ID_list(list(FILELIST), ignore_list,
+                                                 n_rows=4)
+        np.testing.assert_array_equal(index.get_ID_list(ignore_list), IDs)
+
+
+def test_manifest_from_files(tmp_path):
+    data_dir = str(tmp_path)+'/'
+    for name, n in zip(FILELIST, N_ROWS):
+        pd.DataFrame({'x': np.arange(n)}).to_csv(data_dir+name, index=False)
+    manifest = create_manifest_from_files(data_dir, FILELIST[::-1])
+    assert [f['filename'] for f in manifest['files']] == sorted(FILELIST)
+    n_rows = dict(zip(FILELIST, N_ROWS))
+    assert [f['n_rows'] for f in manifest['files']] \
+        == [n_rows[name] for name in sorted(FILELIST)]
+    write_manifest(data_dir+'manifest.json', manifest)
+    assert read_manifest(data_dir+'manifest.json') == manifest
+    index = ManifestIndex.from_file(data_dir+'manifest.json')
+    assert len(index) == sum(N_ROWS)
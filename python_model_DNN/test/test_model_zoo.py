@@ -0,0 +1,118 @@
+"""
+Tests of the model index and LRU cache of utils.model_zoo, on stub
+files instead of trained models.
+"""
+
+import json
+import numpy as np
+import pytest
+
+pytest.importorskip('keras')
+
+import utils.model_zoo as model_zoo
+from utils.custom_loss import CUSTOM_OBJECTS
+from utils.model_zoo import ModelZoo
+
+MODELS = ['mlp_maew_adam_bs1000_test-NR006-NM027_none_toptest.h5',
+          'mlp_msew_adam_bs1000_test-NR006_nsc_toptest.h5',
+          'cnn_maew_adam_bs500_test-NM027_none_wraptest.h5']
+
+
+@pytest.fixture
+def model_dir(tmp_path):
+    """Model directory with empty '.h5' stubs, a history and a partition."""
+    for name in MODELS:
+        (tmp_path / name).write_bytes(b'')
+    base = MODELS[0][:-3]
+    with open(str(tmp_path / (base + '_history.json')), 'w') as f:
+        json.dump({'loss': [2.0, 1.0]}, f)
+    np.save(str(tmp_path / (base + '_partition_test.npy')),
+            np.arange(5, dtype=np.uint32))
+    return str(tmp_path) + '/'
+
+
+@pytest.fixture
+def loads(monkeypatch):
+    """Record load_model calls, returning a stub object per file."""
+    calls = []
+
+    def load_model(filename, custom_objects=None):
+        assert custom_objects == CUSTOM_OBJECTS
+        calls.append(filename)
+        return object()
+    monkeypatch.setattr(model_zoo, 'load_model', load_model)
+    return calls
+
+
+@pytest.fixture
+def sessions(monkeypatch):
+    """Count clear_session calls of the Keras backend."""
+    calls = []
+
+    class Backend(object):
+        @staticmethod
+        def clear_session():
+            calls.append(None)
+    monkeypatch.setattr(model_zoo, 'K', Backend)
+    return calls
+
+
+def test_index(model_dir):
+    zoo = ModelZoo(model_dir)
+    assert len(zoo) == 3
+    assert zoo.names() == sorted(MODELS)
+    assert zoo.names('toptest') == sorted(MODELS[:2])
+    info = zoo.get_info(MODELS[0])
+    assert info['model'] == 'mlp-001'
+    assert info['loss'] == 'mae-w'
+    assert info['test'] == 'toptest'
+    assert info['history'] == MODELS[0][:-3] + '_history.json'
+    assert info['partition'] == MODELS[0][:-3] + '_partition_test.npy'
+    assert zoo.get_history(MODELS[0]) == {'loss': [2.0, 1.0]}
+    np.testing.assert_array_equal(zoo.get_partition(MODELS[0]), np.arange(5))
+    assert zoo.get_history(MODELS[1]) is None
+    assert zoo.get_partition(MODELS[1]) is None
+
+
+def test_lru_eviction(model_dir, loads):
+    zoo = ModelZoo(model_dir, max_models=2)
+    assert loads == []
+    m0 = zoo.get(MODELS[0])
+    zoo.get(MODELS[1])
+    assert zoo.get(MODELS[0]) is m0
+    assert (zoo.hits, zoo.misses) == (1, 2)
+    # MODELS[1] is least recently used and evicted
+    zoo.get(MODELS[2])
+    assert list(zoo._cache) == [MODELS[0], MODELS[2]]
+    zoo.get(MODELS[1])
+    assert list(zoo._cache) == [MODELS[2], MODELS[1]]
+    assert (zoo.hits, zoo.misses) == (1, 4)
+    assert loads == [model_dir + MODELS[i] for i in [0, 1, 2, 1]]
+
+
+def test_unknown_model(model_dir, loads):
+    zoo = ModelZoo(model_dir)
+    with pytest.raises(KeyError):
+        zoo.get('missing.h5')
+    assert loads == []
+
+
+def test_clear_session_when_empty(model_dir, loads, sessions):
+    zoo = ModelZoo(model_dir, max_models=2)
+    for i in [0, 1, 2, 0]:
+        zoo.get(MODELS[i])
+    # evictions leave a model in the cache
+    assert sessions == []
+    zoo.clear()
+    assert len(sessions) == 1
+    zoo.clear()
+    assert len(sessions) == 1
+
+    zoo = ModelZoo(model_dir, max_models=1)
+    zoo.get(MODELS[0])
+    assert len(sessions) == 1
+    zoo.get(MODELS[0])
+    zoo.get(MODELS[1])
+    zoo.get(MODELS[2])
+    assert len(sessions) == 3
+    assert list(zoo._cache) == [MODELS[2]]
@@ -0,0 +1,33 @@
+"""
+Tests of the plotting helpers of utils.plot.
+"""
+
+import numpy as np
+import pytest
+
+pytest.importorskip('matplotlib')
+
+from utils.plot import get_density_counts
+
+
+def test_get_density_counts_equals_histogram2d():
+    rng = np.random.RandomState(0)
+    x = rng.randint(-30, 31, 10000)
+    # out-of-range values, values on the edges and NaN
+    data = np.concatenate((rng.uniform(-250.0, 250.0, 9990),
+                           [-200.0, 200.0, -200.1, 200.1, 0.0, -2.0, 2.0,
+                            1000.0, -1000.0, np.nan]))
+    counts, x_min = get_density_counts(x, data, bins=100)
+    x_edges = np.arange(x.min(), x.max()+2) - 0.5
+    y_edges = np.linspace(-200, 200, 101)
+    expected, _, _ = np.histogram2d(data, x, bins=[y_edges, x_edges])
+    assert x_min == x.min()
+    np.testing.assert_array_equal(counts, expected)
+    assert counts.sum() == np.sum(np.abs(data) <= 200)
+
+
+def test_get_density_counts_drops_out_of_range():
+    x = np.zeros(4, dtype=np.int64)
+    counts, _ = get_density_counts(x, np.array([-300.0, -199.0, 199.0, 300.0]),
+                                   bins=4)
+    np.testing.assert_array_equal(counts[:, 0], [1, 0, 0, 1])
@@ -0,0 +1,128 @@
+"""
+Tests of the batched offline inference of predict_raw against
+model.predict on a stub model.
+"""
+
+import json
+import os
+import numpy as np
+import pytest
+
+pytest.importorskip('keras')
+
+from predict_raw import parse_columns, predict_raw
+from utils.scaler import StreamingScaler
+
+N_ROWS = 23
+N_SUBJECTS = 3
+LABELS = ['ILD_1', 'ILD_2', 'ITD_1', 'IC_1']
+
+
+class StubModel(object):
+    """Model predicting a weighted sum of the features, without Keras."""
+    def __init__(self, n_outputs=1):
+        self.n_outputs = n_outputs
+
+    def predict(self, X, batch_size=None):
+        pred = np.asarray(X) @ np.arange(1.0, X.shape[1]+1)
+        return np.repeat(pred[:, None], self.n_outputs, axis=1)
+
+
+@pytest.fixture
+def database(tmp_path):
+    """Small .npy database as written by file_conversion.raw2npy."""
+    db = str(tmp_path / 'db') + '/'
+    os.makedirs(db)
+    rng = np.random.RandomState(0)
+    feature_data = rng.uniform(-1.0, 1.0, (N_ROWS, 4))
+    np.save(db + 'feature_data.npy', feature_data)
+    np.save(db + 'target_data.npy', np.zeros((5, N_SUBJECTS)))
+    with open(db + 'columns.json', 'w') as f:
+        json.dump({'feature_data': LABELS,
+                   'target_data': ['subject_1', 'subject_2',
+                                   'subject_3']}, f)
+    return db, feature_data
+
+
+@pytest.mark.parametrize('start, stop, chunksize',
+                         [(0, None, 5), (0, None, 100), (4, 17, 6)])
+def test_predict_raw_npy(tmp_path, database, start, stop, chunksize):
+    db, feature_data = database
+    model = StubModel()
+    output = str(tmp_path / 'pred.npy')
+    predict_raw(model, db, output, chunksize=chunksize, start=start,
+                stop=stop, verbose=False)
+    out = np.load(output)
+    stop = N_ROWS if stop is None else stop
+    assert out.shape == (stop * N_SUBJECTS,)
+    expected = np.repeat(model.predict(feature_data[start:stop])[:, 0],
+                         N_SUBJECTS).astype(np.float32)
+    np.testing.assert_array_equal(out[start*N_SUBJECTS:], expected)
+    assert np.isnan(out[:start*N_SUBJECTS]).all()
+
+
+def test_predict_raw_h5(tmp_path, database):
+    pytest.importorskip('tables')
+    import pandas as pd
+    db, feature_data = database
+    model = StubModel()
+    output = str(tmp_path / 'pred.h5')
+    predict_raw(model, db, output, chunksize=7, verbose=False)
+    df = pd.read_hdf(output, 'prediction')
+    np.testing.assert_array_equal(df['global_id'], np.arange(N_ROWS*N_SUBJECTS))
+    np.testing.assert_array_equal(
+        df['prediction'],
+        np.repeat(model.predict(feature_data)[:, 0], N_SUBJECTS)
+        .astype(np.float32))
+
+
+def test_predict_raw_prediction_count_mismatch(tmp_path, database):
+    db, _ = database
+    with pytest.raises(ValueError):
+        predict_raw(StubModel(n_outputs=2), db, str(tmp_path / 'pred.npy'),
+                    chunksize=5, verbose=False)
+
+
+@pytest.mark.parametrize('columns, idx', [
+    (['ITD', 'ILD'], [2, 0, 1]),
+    (['IC_1', 1], [3, 1]),
+    ('ILD', [0, 1])])
+@pytest.mark.parametrize('labelled', [True, False])
+def test_predict_raw_columns(tmp_path, database, columns, idx, labelled):
+    db, feature_data = database
+    model = StubModel()
+    scaler = StreamingScaler().fit(feature_data * [1.0, 2.0, 3.0, 4.0])
+    if labelled:
+        scaler.columns = list(LABELS)
+    output = str(tmp_path / 'pred.npy')
+    predict_raw(model, db, output, chunksize=5, verbose=False,
+                scaler=scaler, columns=columns)
+    # the scaler of all columns is applied to the selected ones only
+    X = (feature_data * scaler.scale + scaler.offset)[:, idx]
+    expected = np.repeat(model.predict(X)[:, 0], N_SUBJECTS)
+    np.testing.assert_allclose(np.load(output), expected, rtol=1e-6)
+
+    if labelled:
+        # scaler already reduced to the columns of the model
+        reduced = scaler.subset([LABELS[i] for i in idx][::-1])
+        predict_raw(model, db, output, chunksize=5, verbose=False,
+                    scaler=reduced, columns=columns)
+        np.testing.assert_allclose(np.load(output), expected, rtol=1e-6)
+
+
+def test_predict_raw_columns_mismatch(tmp_path, database):
+    db, feature_data = database
+    scaler = StreamingScaler().fit(feature_data)
+    output = str(tmp_path / 'pred.npy')
+    with pytest.raises(ValueError):
+        predict_raw(StubModel(), db, output, verbose=False,
+                    scaler=scaler.subset([0, 1, 2]), columns=['ILD'])
+    scaler.columns = list(LABELS)
+    with pytest.raises(KeyError):
+        predict_raw(StubModel(), db, output, verbose=False,
+                    scaler=scaler.subset(['ILD_1']), columns=['ITD'])
+
+
+def test_parse_columns():
+    assert parse_columns(None) is None
+    assert parse_columns(['ILD', '3', 'IC_1']) == ['ILD', 3, 'IC_1']
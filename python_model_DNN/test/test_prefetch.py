@@ -0,0 +1,123 @@
+"""
+Tests of the multi-process prefetching wrapper utils.prefetch.
+"""
+
+import numpy as np
+import pytest
+
+pytest.importorskip('keras')
+
+from multiprocessing import shared_memory
+from keras.utils import Sequence
+
+from utils.load_data_raw import DataGenerator_raw
+from utils.prefetch import PrefetchLoader
+
+N_SUBJECTS = 4
+N_FRAMES = 5
+
+
+def make_generator(shuffle=False, **kwargs):
+    rng = np.random.RandomState(0)
+    feature_data = rng.uniform(-1.0, 1.0, (200, 6))
+    target_data = rng.uniform(-180.0, 180.0, (40, N_SUBJECTS))
+    IDs = rng.permutation(len(feature_data) * N_SUBJECTS)[:700]
+    return DataGenerator_raw(IDs, feature_data, target_data, batch_size=32,
+                             dim=6, shuffle=shuffle, n_frames=N_FRAMES,
+                             **kwargs)
+
+
+class FailingGenerator(Sequence):
+    """Generator raising on batch fail_at."""
+    def __init__(self, fail_at):
+        self.fail_at = fail_at
+
+    def __len__(self):
+        return 10
+
+    def __getitem__(self, index):
+        if index == self.fail_at:
+            raise ValueError('batch {}'.format(index))
+        return np.full((4, 3), index, dtype=np.float32), np.zeros(4)
+
+
+def shm_names(loader):
+    return [shm.name for slot in loader._shm for shm in slot]
+
+
+def assert_unlinked(names):
+    assert names
+    for name in names:
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name=name)
+
+
+@pytest.mark.parametrize('shuffle', [False, True])
+@pytest.mark.parametrize('dedup', [False, True])
+def test_batches_equal_generator(shuffle, dedup):
+    np.random.seed(1)
+    gen = make_generator(shuffle, dedup=dedup)
+    expected = [gen[i] for i in range(len(gen))]
+    with PrefetchLoader(gen, workers=3, queue_depth=4) as loader:
+        assert len(loader) == len(gen)
+        for i in range(len(loader)):
+            X, y = loader[i]
+            np.testing.assert_array_equal(X, expected[i][0])
+            np.testing.assert_array_equal(y, expected[i][1])
+        # random access restarts the pipeline at the index
+        n = len(loader)
+        for i in [n//2, n//2+1, 1, n-1]:
+            X, y = loader[i]
+            np.testing.assert_array_equal(X, expected[i][0])
+            np.testing.assert_array_equal(y, expected[i][1])
+        assert loader.stats()['batches'] == n + 4
+        with pytest.raises(IndexError):
+            loader[n]
+
+
+def test_epoch_end_updates_generator():
+    np.random.seed(2)
+    gen = make_generator(shuffle=True)
+    loader = PrefetchLoader(gen, workers=2, queue_depth=3)
+    try:
+        for _ in range(2):
+            expected = [gen[i] for i in range(len(gen))]
+            for i in range(len(loader)):
+                np.testing.assert_array_equal(loader[i][0], expected[i][0])
+            loader.on_epoch_end()
+    finally:
+        loader.close()
+
+
+def test_close_unlinks_segments():
+    loader = PrefetchLoader(make_generator(), workers=2, queue_depth=3)
+    loader[0]
+    names = shm_names(loader)
+    assert len(names) == 2 * 3
+    loader.close()
+    assert_unlinked(names)
+    assert loader._procs == []
+    loader.close()
+    with pytest.raises(RuntimeError):
+        loader[0]
+
+
+def test_worker_error_unlinks_segments():
+    loader = PrefetchLoader(FailingGenerator(fail_at=3), workers=2,
+                            queue_depth=2)
+    names = shm_names(loader)
+    with pytest.raises(RuntimeError, match='batch 3'):
+        for i in range(len(loader)):
+            loader[i]
+    assert_unlinked(names)
+
+
+def test_consumer_error_unlinks_segments():
+    names = []
+    with pytest.raises(KeyError):
+        with PrefetchLoader(make_generator(), workers=2,
+                            queue_depth=3) as loader:
+            names = shm_names(loader)
+            loader[0]
+            raise KeyError('consumer')
+    assert_unlinked(names)
@@ -0,0 +1,123 @@
+"""
+Tests of the task hashing and the subset data access of the headless
+report generator report_models.
+"""
+
+import json
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('keras')
+pytest.importorskip('tables')
+
+import report_models
+from utils.file_conversion import raw2npy
+from utils.load_data_raw import DataGenerator_raw
+from utils.model_zoo import ModelZoo
+
+N_SUBJECTS = 2
+N_FRAMES = 2
+CONDITIONS = ['NFCHOA_R006', 'NFCHOA_M027']
+MODEL = 'mlp_maew_adam_bs1000_test-NR006_none_toptest.h5'
+SETTINGS = {'mode': 'density', 'overlay': True, 'batch_size': 4, 'dpi': 50,
+            'subsets': CONDITIONS}
+
+
+def make_tables():
+    """Raw database of 2 conditions x 2 positions x 2 target rows."""
+    n_target_rows = 8
+    n_feature_rows = n_target_rows * N_FRAMES
+    f_df = pd.DataFrame(np.arange(3*n_feature_rows, dtype=np.float64)
+                        .reshape(-1, 3), columns=['ILD_1', 'ITD_1', 'IC_1'])
+    t_df = pd.DataFrame(np.arange(n_target_rows*N_SUBJECTS,
+                                  dtype=np.float64).reshape(-1, N_SUBJECTS),
+                        columns=['subject_1', 'subject_2'])
+    IDs = np.arange(n_feature_rows * N_SUBJECTS)
+    target_row = IDs // (N_SUBJECTS * N_FRAMES)
+    ID_ref = pd.DataFrame({'pos_id': target_row // 2 % 2,
+                           'cond_id': target_row // 4,
+                           'subject_id': IDs % N_SUBJECTS + 1},
+                          index=pd.Index(IDs, name='global_id'))
+    pos_df = pd.DataFrame({'x': [0.0, 1.0], 'y': [0.0, 0.0]},
+                          index=pd.Index([0, 1], name='pos_id'))
+    cond_df = pd.DataFrame({'sfs_method': CONDITIONS},
+                           index=pd.Index([0, 1], name='cond_id'))
+    par_df = pd.DataFrame({'nFrames': [N_FRAMES], 'nAngles': [1]})
+    return f_df, t_df, ID_ref, pos_df, cond_df, par_df
+
+
+@pytest.fixture(params=['h5', 'npy'])
+def database(request, tmp_path):
+    tables = make_tables()
+    if request.param == 'npy':
+        export_dir = str(tmp_path / 'db') + '/'
+        os.makedirs(export_dir)
+        raw2npy(*tables, export_dir)
+        yield export_dir
+        return
+    filename = str(tmp_path / 'db.h5')
+    for key, df in zip(['feature_data', 'target_data', 'ID_reference_table',
+                        'position_table', 'condition_table', 'feature_par'],
+                       tables):
+        df.to_hdf(filename, key=key, format='table')
+    yield filename
+    if report_models._state.get('data') is not None:
+        report_models._state['data']['db'].close()
+
+
+@pytest.mark.parametrize('kind', CONDITIONS)
+def test_get_subset(database, kind):
+    f_df, t_df, ID_ref, _, _, _ = make_tables()
+    report_models._init_worker('', database, SETTINGS)
+    feat, targ, IDs, offset = report_models._get_subset(kind)
+    expected = np.flatnonzero(ID_ref['cond_id'] == CONDITIONS.index(kind))
+    np.testing.assert_array_equal(IDs, expected)
+    if not database.endswith('/'):
+        # HDF5: only the rows spanned by the subset are read
+        assert len(feat) == len(f_df) // 2 and len(targ) == len(t_df) // 2
+    gen = DataGenerator_raw(IDs - offset, feat, targ, n_frames=N_FRAMES)
+    gen_all = DataGenerator_raw(IDs, f_df.values, t_df.values,
+                                n_frames=N_FRAMES)
+    X, y = gen.get_data(IDs - offset)
+    X_all, y_all = gen_all.get_data(IDs)
+    np.testing.assert_array_equal(X, X_all)
+    np.testing.assert_array_equal(y, y_all)
+
+
+def test_create_tasks_hash_inputs(tmp_path):
+    model_dir = str(tmp_path / 'models') + '/'
+    os.makedirs(model_dir)
+    base = MODEL[:-3]
+    with open(model_dir + MODEL, 'wb') as f:
+        f.write(b'weights 1')
+    with open(model_dir + base + '_history.json', 'w') as f:
+        json.dump({'loss': [1.0], 'val_loss': [1.0]}, f)
+    database = str(tmp_path / 'db.h5')
+    with open(database, 'wb') as f:
+        f.write(b'database')
+
+    def hashes():
+        zoo = ModelZoo(model_dir)
+        tasks, _ = report_models.create_tasks(zoo, zoo.names(), database,
+                                              str(tmp_path), CONDITIONS,
+                                              SETTINGS, {})
+        return {t['kind']: t['hash'] for t in tasks}
+
+    h0 = hashes()
+    assert sorted(h0) == sorted(['history'] + CONDITIONS)
+    assert hashes() == h0
+    # retrained model changes all figures of the model, incl. history
+    with open(model_dir + MODEL, 'wb') as f:
+        f.write(b'weights 2')
+    h1 = hashes()
+    assert all(h1[k] != h0[k] for k in h0)
+    np.save(model_dir + base + '_partition_test.npy', np.arange(3))
+    h2 = hashes()
+    assert all(h2[k] != h1[k] for k in h1)
+    # database replaced, same path
+    with open(database, 'wb') as f:
+        f.write(b'database, changed')
+    h3 = hashes()
+    assert all(h3[k] != h2[k] for k in h2)
@@ -0,0 +1,89 @@
+"""
+Tests of the out-of-core feature scaler of utils.scaler.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+preprocessing = pytest.importorskip('sklearn.preprocessing')
+
+from utils.scaler import (StreamingScaler, fit_scaler, load_scaler,
+                          scaler_filename)
+
+COLUMNS = ['ILD_100Hz', 'ITD_100Hz', 'IC_100Hz', 'const']
+
+
+@pytest.fixture
+def feature_data():
+    rng = np.random.RandomState(0)
+    data = rng.normal(0.0, [1.0, 1e-3, 50.0, 1.0], (1000, 4)) + [5, 0, -20, 0]
+    # constant feature, not scaled
+    data[:, 3] = 7.0
+    return pd.DataFrame(data, columns=COLUMNS)
+
+
+def fit_chunks(data, method, chunksize):
+    scaler = StreamingScaler(method)
+    for start in range(0, len(data), chunksize):
+        scaler.partial_fit(data.iloc[start:start+chunksize])
+    return scaler.finalize()
+
+
+@pytest.mark.parametrize('chunksize', [1, 7, 1000])
+def test_minmax_equals_sklearn(feature_data, chunksize):
+    scaler = fit_chunks(feature_data, 'minmax', chunksize)
+    ref = preprocessing.MinMaxScaler(feature_range=(-1, 1)).fit(
+        feature_data.values)
+    assert scaler.n_samples == len(feature_data)
+    assert scaler.columns == COLUMNS
+    np.testing.assert_allclose(scaler.data_min, ref.data_min_)
+    np.testing.assert_allclose(scaler.data_max, ref.data_max_)
+    np.testing.assert_allclose(scaler.transform(feature_data.values),
+                               ref.transform(feature_data.values),
+                               rtol=1e-12, atol=1e-12)
+    np.testing.assert_allclose(
+        scaler.inverse_transform(scaler.transform(feature_data.values)),
+        feature_data.values, rtol=1e-12, atol=1e-9)
+
+
+@pytest.mark.parametrize('chunksize', [3, 1000])
+def test_standard_equals_sklearn(feature_data, chunksize):
+    scaler = fit_chunks(feature_data, 'standard', chunksize)
+    ref = preprocessing.StandardScaler().fit(feature_data.values)
+    np.testing.assert_allclose(scaler.mean, ref.mean_)
+    np.testing.assert_allclose(scaler.var, ref.var_, rtol=1e-10)
+    np.testing.assert_allclose(scaler.transform(feature_data.values),
+                               ref.transform(feature_data.values),
+                               rtol=1e-9, atol=1e-9)
+
+
+def test_save_load_round_trip(tmp_path, feature_data):
+    scaler = StreamingScaler().fit(feature_data, chunksize=100)
+    filename = str(tmp_path / 'scaler.json')
+    scaler.save(filename)
+    loaded = StreamingScaler.load(filename)
+    assert loaded.method == scaler.method
+    assert loaded.feature_range == scaler.feature_range
+    assert loaded.columns == COLUMNS
+    assert loaded.n_samples == scaler.n_samples
+    for key in ['data_min', 'data_max', 'mean', 'var', 'scale', 'offset']:
+        np.testing.assert_array_equal(getattr(loaded, key),
+                                      getattr(scaler, key))
+    X = feature_data.values[:10]
+    np.testing.assert_array_equal(loaded.transform(X), scaler.transform(X))
+
+
+def test_fit_scaler_sidecar(tmp_path, feature_data):
+    pytest.importorskip('tables')
+    database = str(tmp_path / 'database_raw.h5')
+    feature_data.to_hdf(database, key='feature_data', format='table')
+    scaler = fit_scaler(database, chunksize=64)
+    assert scaler_filename(database) == str(tmp_path /
+                                            'database_raw_scaler_minmax.json')
+    loaded = load_scaler(database)
+    assert loaded.columns == COLUMNS
+    np.testing.assert_array_equal(loaded.scale, scaler.scale)
+    np.testing.assert_allclose(
+        loaded.transform(feature_data.values),
+        StreamingScaler().fit(feature_data).transform(feature_data.values))
@@ -0,0 +1,84 @@
+"""
+Tests of the floor-mod wrapped angle differences of utils.custom_loss
+against the atan2 reference implementations, including the +-180 and
+360 degree boundaries.
+"""
+
+import numpy as np
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+
+from utils.custom_loss import (angle_diff_deg, angle_diff_deg_atan2,
+                               angle_errors_deg)
+
+# differences of exactly and close to +-180 and multiples of 360
+BOUNDARIES = np.array([180.0, -180.0, 179.999, -179.999, 180.001, -180.001,
+                       0.0, 360.0, -360.0, 540.0, -540.0, 720.0, -720.0])
+
+
+def angles():
+    """Random angles in the range of predictions and targets, plus
+    the boundaries relative to targets 0 and 90 degree."""
+    rng = np.random.RandomState(0)
+    a = rng.uniform(-720.0, 720.0, 100000)
+    b = rng.uniform(-180.0, 180.0, 100000)
+    a = np.concatenate((a, BOUNDARIES, BOUNDARIES + 90.0))
+    b = np.concatenate((b, np.zeros(len(BOUNDARIES)),
+                        90.0 * np.ones(len(BOUNDARIES))))
+    return a, b
+
+
+def test_angle_diff_deg_range():
+    a, b = angles()
+    diff = angle_diff_deg(a, b)
+    assert np.all(diff >= -180.0) and np.all(diff < 180.0)
+
+
+def test_angle_diff_deg_equals_atan2():
+    a, b = angles()
+    diff = angle_diff_deg(a, b)
+    diff_atan2 = angle_diff_deg_atan2(a, b)
+    # exactly +-180 maps to -180 with floor-mod, to +180 or -180 with atan2
+    np.testing.assert_allclose(np.abs(diff), np.abs(diff_atan2),
+                               rtol=0, atol=1e-9)
+    inner = np.abs(diff_atan2) < 179.99
+    np.testing.assert_allclose(diff[inner], diff_atan2[inner],
+                               rtol=0, atol=1e-9)
+
+
+def test_angle_diff_deg_boundaries():
+    diff = angle_diff_deg(BOUNDARIES, 0.0)
+    np.testing.assert_allclose(
+        diff, [-180.0, -180.0, 179.999, -179.999, -179.999, 179.999,
+               0.0, 0.0, 0.0, -180.0, -180.0, 0.0, 0.0], rtol=0, atol=1e-9)
+
+
+def test_angle_errors_deg():
+    a, b = angles()
+    abs_err, sq_err = angle_errors_deg(a, b)
+    diff_atan2 = angle_diff_deg_atan2(a, b)
+    np.testing.assert_allclose(abs_err, np.abs(diff_atan2), rtol=0, atol=1e-9)
+    np.testing.assert_allclose(sq_err, np.square(diff_atan2), rtol=1e-9,
+                               atol=1e-6)
+
+
+def test_tf_angle_diff_deg_equals_atan2():
+    from utils.custom_loss import (tf_angle_diff_deg, tf_angle_diff_deg_atan2,
+                                   mae_wrap_angle, mse_wrap_angle)
+    a, b = angles()
+    # float32 as used in training
+    y_pred = tf.constant(a.astype(np.float32)[:, None])
+    y_true = tf.constant(b.astype(np.float32)[:, None])
+    diff = np.ravel(tf_angle_diff_deg(y_pred, y_true).numpy())
+    diff_atan2 = np.ravel(tf_angle_diff_deg_atan2(y_pred, y_true).numpy())
+    assert np.all(diff >= -180.0) and np.all(diff < 180.0)
+    # float32 precision: deviations up to ~1e-4 degree for angles up to 720
+    np.testing.assert_allclose(np.abs(diff), np.abs(diff_atan2),
+                               rtol=0, atol=1e-3)
+    np.testing.assert_allclose(np.abs(diff), np.abs(angle_diff_deg(a, b)),
+                               rtol=0, atol=1e-3)
+    mae = mae_wrap_angle(y_true, y_pred).numpy()
+    mse = mse_wrap_angle(y_true, y_pred).numpy()
+    np.testing.assert_allclose(mae, np.abs(diff), rtol=1e-6)
+    np.testing.assert_allclose(mse, np.square(diff), rtol=1e-6)